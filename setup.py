@@ -97,7 +97,7 @@ setup(
     ],
     python_requires='>=3.6',
     package_data={
-        'src': ['operations.dll', 'liboperations.so'],
+        'src': ['operations.dll', 'liboperations.so', 'ultokernel.dll', 'libultokernel.so', 'native/*.c'],
     },
     include_package_data=True,
 )
@@ -0,0 +1,802 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# compiler.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+from src.core.kernel import ArithmeticKernel
+from src.core.lazyeval import LazyEval, LazySite
+from src.core.vector import Vector
+from src.dataflow import uses_variable
+from src.nodes import NodeType, Operator, to_tuple
+
+
+# Marks a hoisted loop invariant that has not been evaluated since its loop was entered.
+UNSET = object()
+
+
+# Statuses a compiled statement returns to the loop enclosing it: BREAK leaves the loop and CONTINUE goes on with
+# its next iteration. Statements that run to their end return None.
+BREAK = 1
+CONTINUE = 2
+
+
+def may_stop(statements):
+    """
+    Checks whether a block may stop before its end through `break` or `continue`, directly or in a branch of an
+    `if`. Nested loops consume the status of their own body.
+
+    Args:
+    statements (list): The statements of the block.
+
+    Returns:
+    bool: True if the block may return a status.
+    """
+    for node in statements:
+        tag = node.tag
+        if tag == NodeType.BREAK or tag == NodeType.CONTINUE:
+            return True
+        if tag == NodeType.IF and (may_stop(node.body) or may_stop(node.orelse)
+                                   or any(may_stop(branch) for _, branch in node.elifs)):
+            return True
+    return False
+
+
+def count_values(start, end, step):
+    """
+    Yields the values of a range loop, counting from `start` while below `end`.
+
+    Args:
+    start (int): The first value.
+    end (int): The exclusive upper bound.
+    step (int): The increment.
+    """
+    current_value = start
+    while current_value < end:
+        yield current_value
+        current_value += step
+
+
+def count_range(start, end, step):
+    """
+    Returns an iterator over the values of a range loop. Integer bounds with a positive step count exactly as
+    Python's `range` does, which is iterated natively then.
+
+    Args:
+    start (int): The first value.
+    end (int): The exclusive upper bound.
+    step (int): The increment.
+
+    Returns:
+    iterator: The values.
+    """
+    if type(start) is int and type(end) is int and type(step) is int and step > 0:
+        return iter(range(start, end, step))
+    return count_values(start, end, step)
+
+
+class Compiler:
+    """
+    A closure compiler for the Ulto programming language.
+
+    The `Compiler` class turns the AST produced by the parser into a tree of pre-bound Python closures
+    before execution starts. Node-type dispatch, operator lookup and the eager/lazy decision for every
+    assignment site are resolved once at compile time, so loops run without re-inspecting node types on every
+    visit. The compiled closures operate directly on the runtime state (frame,
+    LogStack, memory manager and counters) of the interpreter they were compiled for, with every variable
+    resolved to a slot of the interpreter's `Frame`. Loop invariants hoisted by the `Optimiser` are cached in a
+    cell owned by their loop, which clears it whenever the loop is entered. Loops count their iterations locally
+    and add them to their site of the interpreter's `Profiler` once they are left. `break` and `continue` do not
+    raise: their closures return a status, passed up by the blocks that may stop early to their loop.
+
+    Attributes:
+        engine (Interpreter): The interpreter whose runtime state the compiled closures operate on.
+        invariant_cells (dict): Maps hoisted `Invariant` nodes to the cell caching their value.
+        hoisting (bool): Whether compiled expressions use the cached value of hoisted invariants.
+        statement_compilers (dict): Maps statement node types to the method compiling them.
+        expression_compilers (dict): Maps expression node types to the method compiling them.
+    """
+    def __init__(self, engine):
+        """
+        Initializes the compiler for the given interpreter.
+
+        Args:
+        engine (Interpreter): The interpreter the compiled closures will run against.
+        """
+        self.engine = engine
+        self.invariant_cells = {}
+        self.hoisting = True
+        self.statement_compilers = {
+            NodeType.ASSIGN: self.compile_assignment,
+            NodeType.REVERSE: self.compile_reverse,
+            NodeType.REVTRACE: self.compile_revtrace,
+            NodeType.REWIND: self.compile_rewind,
+            NodeType.IF: self.compile_if,
+            NodeType.FOR: self.compile_for,
+            NodeType.WHILE: self.compile_while,
+            NodeType.PRINT: self.compile_print,
+            NodeType.COMPOUND_ASSIGN: self.compile_compound_assignment,
+            NodeType.BREAK: self.compile_break,
+            NodeType.CONTINUE: self.compile_continue,
+        }
+        self.expression_compilers = {
+            NodeType.NAME: self.compile_variable,
+            NodeType.CONSTANT: self.compile_constant,
+            NodeType.BINARY: self.compile_binary,
+            NodeType.INDEX: self.compile_index,
+            NodeType.LEN: self.compile_len,
+            NodeType.LIST: self.compile_list,
+            NodeType.INVARIANT: self.compile_invariant,
+        }
+
+    def compile_program(self, ast):
+        """
+        Compiles every top-level statement of a program.
+
+        Args:
+        ast (list): The abstract syntax tree.
+
+        Returns:
+        list: One compiled closure per top-level statement.
+        """
+        return [self.compile_statement(node) for node in ast]
+
+    def compile_block(self, statements):
+        """
+        Compiles a block of statements into a single closure. A block that may stop early, see `may_stop`,
+        checks the status of every statement and returns the first one set.
+
+        Args:
+        statements (list): The statement nodes of the block.
+
+        Returns:
+        callable: A closure executing the statements in order, returning `BREAK`, `CONTINUE` or None.
+        """
+        compiled = tuple(self.compile_statement(stmt) for stmt in statements)
+        if len(compiled) == 1:
+            return compiled[0]
+
+        if may_stop(statements):
+            def stopping_block():
+                for stmt in compiled:
+                    status = stmt()
+                    if status:
+                        return status
+            return stopping_block
+
+        def block():
+            for stmt in compiled:
+                stmt()
+        return block
+
+    def compile_statement(self, node):
+        """
+        Compiles a single statement node.
+
+        Args:
+        node (Node): The statement node.
+
+        Returns:
+        callable: The compiled statement.
+        """
+        compile_method = self.statement_compilers.get(node.tag)
+        if compile_method is None:
+            self.engine.error(f'Unknown node type: {node.tag.name}')
+        return compile_method(node)
+
+    def compile_assignment(self, node):
+        """
+        Compiles an assignment node.
+
+        A copy of another variable shares its value, evaluated or not. Otherwise the value is computed as the
+        assignment runs if the `DataFlowAnalyser` marked the site eager, else made by a `LazySite`, which computes
+        cheap values at once and defers the others to a `LazyEval`. Values whose expression raises are deferred
+        either way, so a value that is never read cannot stop the program.
+
+        Args:
+        node (Assign): The assignment node.
+
+        Returns:
+        callable: The compiled assignment.
+        """
+        var_name, value = node.name, node.value
+        engine = self.engine
+        slots = engine.frame.slots
+        slot = engine.frame.resolve(var_name)
+        logstack = engine.logstack
+        memory_manager = engine.memory_manager
+        charged = engine.frame.charged
+
+        if value.tag == NodeType.NAME:
+            source = engine.frame.resolve(value.id)
+
+            def make_value():
+                return slots[source]
+        elif node.eager:
+            evaluate = self.compile_expression(value)
+            hoisting, self.hoisting = self.hoisting, False
+            try:
+                fallback = LazySite(value, self.compile_expression(value), engine.frame)
+            finally:
+                self.hoisting = hoisting
+
+            def make_value():
+                try:
+                    new_value = evaluate()
+                except Exception:
+                    # an expression that raises is deferred, its error reported only if the value is read.
+                    return fallback.defer(engine)
+                engine.evaluations += 1
+                return new_value
+        else:
+            # a thunk can be forced after its loop has been left, when the cached invariants are stale.
+            hoisting, self.hoisting = self.hoisting, False
+            try:
+                site = LazySite(value, self.compile_expression(value), engine.frame)
+            finally:
+                self.hoisting = hoisting
+
+            def make_value():
+                return site.make(engine)
+
+        def assignment():
+            engine.assignments += 1
+            new_value = make_value()
+            memory_manager.track(new_value)
+            # the previous value is released once the history holds it, so what they share stays charged.
+            logstack.push(var_name, slots[slot])
+            memory_manager.release(charged[slot])
+            charged[slot] = slots[slot] = new_value
+        return assignment
+
+    def compile_compound_assignment(self, node):
+        """
+        Compiles a compound assignment (`+=`, `-=`, `*=`, `/=`) against its operator.
+
+        Args:
+        node (CompoundAssign): The compound assignment node.
+
+        Returns:
+        callable: The compiled compound assignment.
+        """
+        var_name, op, value = node.name, node.op, node.value
+        engine = self.engine
+        # `/=` divides integers like `//`, as its C implementation did.
+        apply = engine.operators[Operator.INT_DIV if op == Operator.OVER else op]
+        slots = engine.frame.slots
+        slot = engine.frame.resolve(var_name)
+        logstack = engine.logstack
+        memory_manager = engine.memory_manager
+        charged = engine.frame.charged
+        evaluate = self.compile_expression(value)
+
+        if var_name in engine.frame.loop_names:
+            def compound_assignment():
+                current_value = slots[slot]
+                if isinstance(current_value, LazyEval):
+                    current_value = current_value.evaluate()
+                engine.evaluations += 1
+                operand = evaluate()
+                # Log current value for maybe reversal in logstack
+                logstack.push(var_name, current_value)
+                new_value = apply(current_value, operand)
+                memory_manager.track(new_value)
+                memory_manager.release(charged[slot])
+                charged[slot] = slots[slot] = new_value
+            return compound_assignment
+
+        def delta_assignment():
+            current_value = slots[slot]
+            if isinstance(current_value, LazyEval):
+                current_value = current_value.evaluate()
+            engine.evaluations += 1
+            operand = evaluate()
+            # Log the operand where it is enough to undo the assignment, the current value otherwise
+            logstack.push_delta(var_name, op, operand, current_value)
+            new_value = apply(current_value, operand)
+            memory_manager.track(new_value)
+            memory_manager.release(charged[slot])
+            charged[slot] = slots[slot] = new_value
+        return delta_assignment
+
+    def compile_if(self, node):
+        """
+        Compiles an if node together with its elif and else branches.
+
+        Args:
+        node (If): The if node.
+
+        Returns:
+        callable: The compiled conditional.
+        """
+        condition, true_branch, elif_branches, false_branch = node.condition, node.body, node.elifs, node.orelse
+        engine = self.engine
+        test = self.compile_condition(condition)
+        run_true = self.compile_block(true_branch)
+        run_false = self.compile_block(false_branch)
+        elifs = tuple((self.compile_condition(elif_condition), self.compile_block(elif_branch))
+                      for elif_condition, elif_branch in elif_branches)
+
+        def conditional():
+            engine.evaluations += 1
+            if test():
+                return run_true()
+            for elif_test, run_elif in elifs:
+                engine.evaluations += 1
+                if elif_test():
+                    return run_elif()
+            return run_false()
+        return conditional
+
+    def compile_while(self, node):
+        """
+        Compiles a while node.
+
+        Args:
+        node (While): The while node.
+
+        Returns:
+        callable: The compiled loop.
+        """
+        condition, body = node.condition, node.body
+        engine = self.engine
+        site = engine.profiler.loop(node)
+        invariants = self.compile_invariant_cells(node)
+        test = self.compile_condition(condition)
+        run_body = self.compile_block(body)
+
+        def loop():
+            for cell in invariants:
+                cell[0] = UNSET
+            ticks = 0
+            while True:
+                engine.evaluations += 1
+                if not test():
+                    break
+                if run_body() == BREAK:
+                    break
+                ticks += 1
+            site.entries += 1
+            site.iterations += ticks
+        return loop
+
+    def compile_for(self, node):
+        """
+        Compiles a for loop node over a range, a list literal or an iterable expression.
+
+        Args:
+        node (For): The for loop node.
+
+        Returns:
+        callable: The compiled loop.
+        """
+        var_name, iterable = node.target, node.iterable
+        engine = self.engine
+        slot = engine.frame.resolve(var_name)
+        site = engine.profiler.loop(node)
+        invariants = self.compile_invariant_cells(node)
+        iterate = self.compile_iteration(node)
+
+        if iterable.tag == NodeType.RANGE:
+            start_value, end_value, step_value = iterable.start, iterable.end, iterable.step
+            start = self.compile_expression(start_value)
+            end = self.compile_expression(end_value)
+            step = self.compile_expression(step_value) if step_value else None
+
+            def range_loop():
+                engine.evaluations += 2
+                start_val = start()
+                end_val = end()
+                step_val = 1
+                if step is not None:
+                    engine.evaluations += 1
+                    step_val = step()
+                for cell in invariants:
+                    cell[0] = UNSET
+                site.entries += 1
+                site.iterations += iterate(count_range(start_val, end_val, step_val))
+                engine.account(slot)
+            return range_loop
+
+        items = self.compile_expression(iterable)
+        iterable_name = to_tuple(iterable)
+
+        def iterable_loop():
+            engine.evaluations += 1
+            iterable_value = items()
+            if not isinstance(iterable_value, (Vector, str)):
+                engine.error(f'Variable "{iterable_name}" is not an iterable')
+            for cell in invariants:
+                cell[0] = UNSET
+            site.entries += 1
+            site.iterations += iterate(iter(iterable_value))
+            engine.account(slot)
+        return iterable_loop
+
+    def compile_iteration(self, node):
+        """
+        Compiles the body of a for loop into a function running it for every value of an iterator.
+
+        The loop variable is an induction variable, kept in a local of that function. It is only written to its
+        slot on every iteration if the body uses it by name or rewinds, see `uses_variable`; otherwise the slot
+        is written once, with the last value, when the loop is left, through `break` or not. A loop over a range
+        then runs as a native Python `for` over the body.
+
+        Args:
+        node (For): The for loop node.
+
+        Returns:
+        callable: Runs the loop over an iterator and returns the number of iterations completed.
+        """
+        slots = self.engine.frame.slots
+        slot = self.engine.frame.resolve(node.target)
+        run_body = self.compile_block(node.body)
+
+        if uses_variable(node.body, node.target):
+            def iterate(iterator):
+                ticks = 0
+                for item in iterator:
+                    slots[slot] = item
+                    if run_body() == BREAK:
+                        break
+                    ticks += 1
+                return ticks
+            return iterate
+
+        def iterate_locally(iterator):
+            ticks = 0
+            item = UNSET
+            for item in iterator:
+                if run_body() == BREAK:
+                    break
+                ticks += 1
+            if item is not UNSET:
+                slots[slot] = item
+            return ticks
+        return iterate_locally
+
+    def compile_print(self, node):
+        """
+        Compiles a print node.
+
+        Args:
+        node (Print): The print node.
+
+        Returns:
+        callable: The compiled print statement.
+        """
+        values = node.values
+        engine = self.engine
+        evaluators = tuple(self.compile_expression(value) for value in values)
+
+        def print_statement():
+            engine.evaluations += len(evaluators)
+            engine.print_values([evaluate() for evaluate in evaluators])
+        return print_statement
+
+    def compile_reverse(self, node):
+        """
+        Compiles a reverse node.
+
+        Args:
+        node (Reverse): The reverse node.
+
+        Returns:
+        callable: The compiled reversal.
+        """
+        var_name = node.name
+        engine = self.engine
+        slots = engine.frame.slots
+        slot = engine.frame.resolve(var_name)
+        logstack = engine.logstack
+        memory_manager = engine.memory_manager
+        charged = engine.frame.charged
+
+        def reverse():
+            engine.reversals += 1
+            previous_value = logstack.pop(var_name, slots[slot])
+            if previous_value is not None:
+                # the restored value replaces the current one in memory, the current one is in the history now.
+                memory_manager.track(previous_value)
+                memory_manager.release(charged[slot])
+                charged[slot] = slots[slot] = previous_value
+        return reverse
+
+    def compile_revtrace(self, node):
+        """
+        Compiles a revtrace node.
+
+        Args:
+        node (Revtrace): The revtrace node.
+
+        Returns:
+        callable: The compiled reverse tracepath.
+        """
+        var_name, index_expr = node.name, node.index
+        engine = self.engine
+        logstack = engine.logstack
+        slots = engine.frame.slots
+        slot = engine.frame.resolve(var_name)
+        evaluate_index = self.compile_expression(index_expr)
+
+        def revtrace():
+            engine.evaluations += 1
+            index = evaluate_index()  # support for both iterable variables and integers
+
+            # Retrieve the previous value from the reverse log stack
+            previous_value = logstack.peek(var_name, index, slots[slot])
+            if previous_value is not None:
+                print(f"Reverse Tracepath state {index} of {var_name}: {previous_value}")
+            else:
+                print(f"No state found for {var_name} at index {index}")
+        return revtrace
+
+    def compile_rewind(self, node):
+        """
+        Compiles a rewind node.
+
+        Args:
+        node (Rewind): The rewind node.
+
+        Returns:
+        callable: The compiled rewind.
+        """
+        engine = self.engine
+        evaluate_steps = self.compile_expression(node.steps)
+
+        def rewind():
+            engine.evaluations += 1
+            engine.rewind(evaluate_steps())
+        return rewind
+
+    def compile_break(self, node):
+        """
+        Compiles a break node.
+
+        Args:
+        node (Break): The break node.
+
+        Returns:
+        callable: A closure returning `BREAK` to the innermost loop, which it leaves.
+        """
+        def break_statement():
+            return BREAK
+        return break_statement
+
+    def compile_continue(self, node):
+        """
+        Compiles a continue node.
+
+        Args:
+        node (Continue): The continue node.
+
+        Returns:
+        callable: A closure returning `CONTINUE` to the innermost loop, which goes on with its next iteration.
+        """
+        def continue_statement():
+            return CONTINUE
+        return continue_statement
+
+    def compile_expression(self, expr):
+        """
+        Compiles an expression into a closure returning its value.
+
+        Args:
+        expr (Node): The expression to be compiled.
+
+        Returns:
+        callable: The compiled expression.
+        """
+        compile_method = self.expression_compilers.get(expr.tag)
+        if compile_method is None:
+            self.engine.error(f"Unknown expression type: {expr}")
+        return compile_method(expr)
+
+    def compile_condition(self, condition):
+        """
+        Compiles the condition of an `if`, `elif` or `while`, whose value is only tested for truthiness.
+
+        Args:
+        condition (any): The condition expression.
+
+        Returns:
+        callable: The compiled condition.
+        """
+        if condition.tag == NodeType.BINARY and ArithmeticKernel.is_fusable(condition):
+            return self.compile_arithmetic(condition, condition=True)
+        return self.compile_expression(condition)
+
+    def compile_invariant_cells(self, node):
+        """
+        Creates the cells caching the invariants hoisted into a loop.
+
+        Args:
+        node (While or For): The loop node.
+
+        Returns:
+        tuple: The cells, to be cleared whenever the loop is entered.
+        """
+        cells = []
+        for invariant in node.invariants:
+            cell = self.invariant_cells[invariant] = [UNSET]
+            cells.append(cell)
+        return tuple(cells)
+
+    def compile_invariant(self, node):
+        """
+        Compiles a hoisted loop invariant, evaluated once per entry into its loop.
+
+        Args:
+        node (Invariant): The invariant node.
+
+        Returns:
+        callable: The compiled expression.
+        """
+        evaluate = self.compile_expression(node.value)
+        cell = self.invariant_cells.get(node)
+        if cell is None or not self.hoisting:
+            return evaluate
+
+        def invariant():
+            value = cell[0]
+            if value is UNSET:
+                value = cell[0] = evaluate()
+            return value
+        return invariant
+
+    def compile_constant(self, node):
+        """
+        Compiles a constant.
+
+        Args:
+        node (Constant): The constant node.
+
+        Returns:
+        callable: The compiled constant, returning its value.
+        """
+        value = node.value
+
+        def constant():
+            return value
+        return constant
+
+    def compile_variable(self, node):
+        """
+        Compiles a variable read, forcing lazily evaluated values.
+
+        Args:
+        node (Name): The variable node.
+
+        Returns:
+        callable: The compiled variable read.
+        """
+        slots = self.engine.frame.slots
+        slot = self.engine.frame.resolve(node.id)
+
+        def variable():
+            value = slots[slot]
+            if isinstance(value, LazyEval):
+                return value.evaluate()
+            return value
+        return variable
+
+    def compile_list(self, node):
+        """
+        Compiles a list literal into a `Vector` of its evaluated elements.
+
+        Args:
+        node (ListLiteral): The list literal node.
+
+        Returns:
+        callable: The compiled list literal.
+        """
+        evaluators = tuple(self.compile_expression(item) for item in node.elements)
+
+        def list_literal():
+            return Vector([evaluate() for evaluate in evaluators])
+        return list_literal
+
+    def compile_binary(self, node):
+        """
+        Compiles a binary operation, binding the operator implementation at compile time.
+
+        Purely arithmetic expressions are handed to the interpreter's `ArithmeticKernel` as a whole.
+
+        Args:
+        node (Binary): The binary operation node.
+
+        Returns:
+        callable: The compiled operation.
+        """
+        if ArithmeticKernel.is_fusable(node):
+            return self.compile_arithmetic(node)
+        left, op, right = node.left, node.op, node.right
+        apply = self.engine.operators.get(op)
+        if apply is None:
+            self.engine.error(f'Unknown operator: {op}')
+        evaluate_left = self.compile_expression(left)
+        evaluate_right = self.compile_expression(right)
+
+        def binary():
+            return apply(evaluate_left(), evaluate_right())
+        return binary
+
+    def compile_arithmetic(self, expr, condition=False):
+        """
+        Compiles an expression of integer constants, variables and binary operators into one fused kernel call.
+
+        The closure tree for the same expression is kept as the fallback the kernel defers to when an operand
+        turns out not to be an integer.
+
+        Args:
+        expr (Binary): The binary expression.
+        condition (bool): Whether the value is only tested for truthiness.
+
+        Returns:
+        callable: The compiled expression.
+        """
+        fallback = self.compile_operator_tree(expr)
+        return self.engine.kernel.fuse(expr, self.engine.frame, fallback, condition) or fallback
+
+    def compile_operator_tree(self, expr):
+        """
+        Compiles a fusable expression into plain closures, one per node, without going through the kernel.
+
+        Args:
+        expr (Node): The expression.
+
+        Returns:
+        callable: The compiled expression.
+        """
+        if expr.tag != NodeType.BINARY:
+            return self.compile_expression(expr)
+        left, op, right = expr.left, expr.op, expr.right
+        apply = self.engine.operators[op]
+        evaluate_left = self.compile_operator_tree(left)
+        evaluate_right = self.compile_operator_tree(right)
+
+        def binary():
+            return apply(evaluate_left(), evaluate_right())
+        return binary
+
+    def compile_index(self, node):
+        """
+        Compiles an index operation on a list.
+
+        Args:
+        node (Index): The index node.
+
+        Returns:
+        callable: The compiled index operation.
+        """
+        engine = self.engine
+        evaluate_left = self.compile_expression(node.target)
+        evaluate_right = self.compile_expression(node.index)
+
+        def index():
+            left_val = evaluate_left()
+            right_val = evaluate_right()
+            if isinstance(left_val, Vector):
+                return left_val[right_val]
+            engine.error(f"Cannot index non-list type: {left_val}")
+        return index
+
+    def compile_len(self, node):
+        """
+        Compiles a len() call on a string or list.
+
+        Args:
+        node (Len): The len node.
+
+        Returns:
+        callable: The compiled len() call.
+        """
+        engine = self.engine
+        evaluate = self.compile_expression(node.value)
+
+        def length():
+            evaluated_expr = evaluate()
+            if isinstance(evaluated_expr, str) or isinstance(evaluated_expr, Vector):
+                return len(evaluated_expr)
+            engine.error(f"len() function requires a string or list, got {type(evaluated_expr).__name__}")
+        return length
@@ -0,0 +1,134 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# frame.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+import sys
+from sortedcontainers import SortedDict
+from src.nodes import NodeType
+
+
+class Frame:
+    """
+    Slot-indexed variable storage for a running Ulto program.
+
+    Every identifier is resolved to a fixed slot index once, at compile time, and its value is kept in a plain
+    list at that index. Compiled code reads and writes `slots[index]` directly, so the cost of a variable access
+    does not depend on how many names the program uses. A slot holding `None` is unassigned, which matches the
+    `None` returned for unknown names by the old symbol table. Sorted views over the assigned variables are only
+    built on request, for debugging output. Memory reports use running counts instead: the values the slots are
+    charged for, kept by the `MemoryManager`, and the size of the names.
+
+    Attributes:
+        slots (list): The variable values, indexed by slot.
+        names (list): The variable names, indexed by slot.
+        index (dict): Maps variable names to their slot.
+        charged (list): The value every slot is charged to the `MemoryManager` for. It is the value of the slot
+            but while a loop runs, as loops are only charged for their variable once they are left.
+        name_size (int): The size of the variable names, in bytes.
+        loop_names (set): The variables written by loops without being logged, the for loop targets. Their
+            compound assignments are always logged as snapshots.
+    """
+    def __init__(self):
+        """
+        Initializes an empty frame.
+        """
+        self.slots = []
+        self.names = []
+        self.index = {}
+        self.charged = []
+        self.name_size = 0
+        self.loop_names = set()
+
+    def resolve(self, var_name):
+        """
+        Returns the slot of a variable, assigning a new one if the name has not been seen before.
+
+        Args:
+        var_name (str): The variable name.
+
+        Returns:
+        int: The slot index.
+        """
+        slot = self.index.get(var_name)
+        if slot is None:
+            slot = len(self.slots)
+            self.index[var_name] = slot
+            self.names.append(var_name)
+            self.slots.append(None)
+            self.charged.append(None)
+            self.name_size += sys.getsizeof(var_name)
+        return slot
+
+    def resolve_program(self, ast):
+        """
+        Resolver pass assigning a slot to every identifier assigned or iterated over in the AST, and collecting
+        the variables written by loops.
+
+        Names that are only read are resolved lazily by the compilers as they meet them.
+
+        Args:
+        ast (list): The abstract syntax tree.
+        """
+        for node in ast:
+            tag = node.tag
+            if tag in (NodeType.ASSIGN, NodeType.COMPOUND_ASSIGN, NodeType.REVERSE, NodeType.REVTRACE):
+                self.resolve(node.name)
+            elif tag == NodeType.FOR:
+                self.resolve(node.target)
+                self.loop_names.add(node.target)
+                self.resolve_program(node.body)
+            elif tag == NodeType.WHILE:
+                self.resolve_program(node.body)
+            elif tag == NodeType.IF:
+                self.resolve_program(node.body)
+                for _, elif_branch in node.elifs:
+                    self.resolve_program(elif_branch)
+                self.resolve_program(node.orelse)
+
+    def get(self, var_name, default=None):
+        """
+        Returns the value of a variable by name.
+
+        Args:
+        var_name (str): The variable name.
+        default (any): The value returned for unassigned variables.
+
+        Returns:
+        The value of the variable, or `default`.
+        """
+        slot = self.index.get(var_name)
+        if slot is None or self.slots[slot] is None:
+            return default
+        return self.slots[slot]
+
+    def set(self, var_name, value):
+        """
+        Sets the value of a variable by name.
+
+        Args:
+        var_name (str): The variable name.
+        value (any): The new value.
+        """
+        self.slots[self.resolve(var_name)] = value
+
+    def items(self):
+        """
+        Yields the assigned variables in slot order.
+
+        Returns:
+        generator: (name, value) pairs.
+        """
+        for var_name, value in zip(self.names, self.slots):
+            if value is not None:
+                yield var_name, value
+
+    def sorted_view(self):
+        """
+        Builds a sorted snapshot of the assigned variables.
+
+        Returns:
+        SortedDict: The variables keyed by name.
+        """
+        return SortedDict(self.items())
@@ -0,0 +1,360 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# kernel.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+import os
+import ctypes
+import platform
+import operator
+from src.core.lazyeval import LazyEval
+from src.nodes import NodeType
+
+# Range of the native 64-bit fast path. Integers outside of it, and results overflowing it, are handled with
+# Python's arbitrary precision integers.
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+# Opcodes of the native kernel, see src/native/ultokernel.c.
+NATIVE_OPCODES = {
+    'plus': 1, 'minus': 2, 'times': 3, 'over': 4, 'modulo': 5, 'int_div': 6,
+    'eq': 7, 'neq': 8, 'lt': 9, 'gt': 10, 'lte': 11, 'gte': 12, 'and': 13, 'or': 14,
+}
+NATIVE_STACK_DEPTH = 64
+
+# Below this many operators an expression is evaluated by its fused Python function, above it by a single call
+# into the native kernel. Measured with tests/benchmarks/kernel_crossover.py; per call ctypes overhead dominates
+# anything shorter.
+NATIVE_MIN_OPERATORS = 48
+
+
+def c_divide(left, right):
+    """
+    Integer division truncating towards zero, as in C.
+    """
+    if right == 0:
+        raise ZeroDivisionError('Division by zero error')
+    quotient = abs(left) // abs(right)
+    return -quotient if (left < 0) != (right < 0) else quotient
+
+
+def c_modulo(left, right):
+    """
+    Remainder taking the sign of the dividend, as in C.
+    """
+    if right == 0:
+        raise ZeroDivisionError('Division by zero error')
+    if left >= 0 and right > 0:
+        return left % right
+    return left - right * c_divide(left, right)
+
+
+def integer_operator(int_operation, fallback):
+    """
+    Builds a binary operator with C semantics for integer operands and a Python fallback for everything else
+    (floats, strings and lists). Integer results are exact, they never wrap around.
+
+    Args:
+    int_operation (callable): The operation applied when both operands are integers.
+    fallback (callable): The operation applied otherwise.
+
+    Returns:
+    callable: The operator.
+    """
+    def apply(left, right):
+        if isinstance(left, int) and isinstance(right, int):
+            return int_operation(left, right)
+        return fallback(left, right)
+    return apply
+
+
+OPERATORS = {
+    'plus': operator.add,
+    'minus': operator.sub,
+    'times': operator.mul,
+    'over': integer_operator(c_divide, operator.truediv),
+    'modulo': integer_operator(c_modulo, operator.mod),
+    'int_div': integer_operator(c_divide, operator.floordiv),
+    'eq': integer_operator(lambda left, right: 1 if left == right else 0, operator.eq),
+    'neq': integer_operator(lambda left, right: 1 if left != right else 0, operator.ne),
+    'lt': integer_operator(lambda left, right: 1 if left < right else 0, operator.lt),
+    'gt': integer_operator(lambda left, right: 1 if left > right else 0, operator.gt),
+    'lte': integer_operator(lambda left, right: 1 if left <= right else 0, operator.le),
+    'gte': integer_operator(lambda left, right: 1 if left >= right else 0, operator.ge),
+    'and': integer_operator(lambda left, right: 1 if left and right else 0, lambda left, right: left and right),
+    'or': integer_operator(lambda left, right: 1 if left or right else 0, lambda left, right: left or right),
+}
+
+# Python source templates used when fusing an expression. Comparisons and logical operators produce 1 or 0 like
+# their C counterparts, except at the top of a condition where only truthiness matters. `and`/`or` evaluate both
+# operands, as the C functions receive them already evaluated.
+PYTHON_TEMPLATES = {
+    'plus': '({0} + {1})',
+    'minus': '({0} - {1})',
+    'times': '({0} * {1})',
+    'over': '_div({0}, {1})',
+    'int_div': '_div({0}, {1})',
+    'modulo': '_mod({0}, {1})',
+    'eq': '({0} == {1})',
+    'neq': '({0} != {1})',
+    'lt': '({0} < {1})',
+    'gt': '({0} > {1})',
+    'lte': '({0} <= {1})',
+    'gte': '({0} >= {1})',
+    'and': '(({0} != 0) & ({1} != 0))',
+    'or': '(({0} != 0) | ({1} != 0))',
+}
+COMPARISONS = ('eq', 'neq', 'lt', 'gt', 'lte', 'gte', 'and', 'or')
+
+
+def load_native_library(name):
+    """
+    Loads an optional shared library shipped next to the interpreter sources.
+
+    Args:
+    name (str): The library name without platform prefix or suffix.
+
+    Returns:
+    ctypes.CDLL or None: The library, or `None` if it is not built for this platform.
+    """
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if platform.system() == "Windows":
+        lib_path = os.path.join(src_dir, f'{name}.dll')
+    else:
+        lib_path = os.path.join(src_dir, f'lib{name}.so')
+    try:
+        return ctypes.CDLL(lib_path)
+    except OSError:
+        return None
+
+
+class ArithmeticKernel:
+    """
+    Evaluates whole integer expressions in one call.
+
+    Applying every binary operator through its own ctypes call costs far more than the C work it does. The kernel
+    instead fuses an expression tree made of integer constants, variables and binary operators into a single
+    callable. Short expressions become one generated Python function; expressions with at least
+    `native_min_operators` operators are packed once into a postfix program for the native kernel
+    (src/native/ultokernel.c) and evaluated in a single FFI call, when that library is built. Both paths check
+    that every variable holds an integer and otherwise defer to a fallback, so lazy values, lists and strings
+    keep their general semantics. The native kernel works on 64-bit integers; when an operand is outside that
+    range or a result overflows it, the expression is redone by the fallback with Python's arbitrary precision
+    integers, so results are exact while values that fit never pay for big integer arithmetic.
+
+    Attributes:
+        native (ctypes.CDLL or None): The native kernel library, if available.
+        native_min_operators (int): Operator count from which the native kernel is preferred.
+        fused (int): The number of expressions fused so far.
+    """
+    def __init__(self, native_min_operators=NATIVE_MIN_OPERATORS, native=True):
+        """
+        Initializes the kernel.
+
+        Args:
+        native_min_operators (int): Operator count from which the native kernel is preferred.
+        native (bool): Whether to load the native kernel at all.
+        """
+        self.native = load_native_library('ultokernel') if native else None
+        if self.native is not None:
+            self.native.ulto_eval.argtypes = [ctypes.POINTER(ctypes.c_int32), ctypes.c_int32,
+                                              ctypes.POINTER(ctypes.c_int64), ctypes.POINTER(ctypes.c_int64)]
+            self.native.ulto_eval.restype = ctypes.c_int32
+        self.native_min_operators = native_min_operators
+        self.fused = 0
+
+    @staticmethod
+    def is_fusable(expr):
+        """
+        Checks whether an expression only contains integer constants, variables and kernel operators.
+
+        Args:
+        expr (Node): The expression.
+
+        Returns:
+        bool: True if the kernel can evaluate the expression.
+        """
+        tag = expr.tag
+        if tag == NodeType.BINARY:
+            return (expr.op in NATIVE_OPCODES
+                    and ArithmeticKernel.is_fusable(expr.left) and ArithmeticKernel.is_fusable(expr.right))
+        if tag == NodeType.CONSTANT:
+            return isinstance(expr.value, int)
+        return tag == NodeType.NAME
+
+    @staticmethod
+    def count_operators(expr):
+        """
+        Counts the binary operators in an expression.
+
+        Args:
+        expr (Node): The expression.
+
+        Returns:
+        int: The number of binary operators.
+        """
+        if expr.tag == NodeType.BINARY:
+            return 1 + ArithmeticKernel.count_operators(expr.left) + ArithmeticKernel.count_operators(expr.right)
+        return 0
+
+    def fuse(self, expr, frame, fallback, condition=False):
+        """
+        Fuses a binary expression into a single callable.
+
+        Args:
+        expr (Binary): The binary expression.
+        frame (Frame): The frame holding the variables the expression reads.
+        fallback (callable): Evaluates the expression generically when a variable does not hold an integer.
+        condition (bool): Whether the value is only tested for truthiness.
+
+        Returns:
+        callable or None: The fused expression, or `None` if the expression cannot be fused.
+        """
+        if expr.tag != NodeType.BINARY or not self.is_fusable(expr):
+            return None
+        variables = []
+        self.collect_variables(expr, frame, variables)
+        operators = self.count_operators(expr)
+        if (self.native is not None and operators >= self.native_min_operators
+                and self.stack_depth(expr) <= NATIVE_STACK_DEPTH and self.constants_fit(expr)):
+            fused = self.fuse_native(expr, frame, variables, fallback)
+        else:
+            fused = self.fuse_python(expr, frame, variables, fallback, condition)
+        self.fused += 1
+        return fused
+
+    def collect_variables(self, expr, frame, variables):
+        """
+        Collects the frame slots of the variables an expression reads, in order of first use.
+
+        Args:
+        expr (Node): The expression.
+        frame (Frame): The frame resolving variable names.
+        variables (list): The slots collected so far, extended in place.
+        """
+        if expr.tag == NodeType.BINARY:
+            self.collect_variables(expr.left, frame, variables)
+            self.collect_variables(expr.right, frame, variables)
+        elif expr.tag == NodeType.NAME:
+            slot = frame.resolve(expr.id)
+            if slot not in variables:
+                variables.append(slot)
+
+    def constants_fit(self, expr):
+        """
+        Checks whether every constant in an expression fits in the native kernel's 64-bit (int64) operands.
+
+        Args:
+        expr (Node): The expression.
+
+        Returns:
+        bool: True if all constants lie between INT_MIN and INT_MAX.
+        """
+        if expr.tag == NodeType.BINARY:
+            return self.constants_fit(expr.left) and self.constants_fit(expr.right)
+        return expr.tag != NodeType.CONSTANT or INT_MIN <= expr.value <= INT_MAX
+
+    def stack_depth(self, expr):
+        """
+        Computes how many operand stack slots the postfix program for an expression needs.
+
+        Args:
+        expr (Node): The expression.
+
+        Returns:
+        int: The maximum stack depth.
+        """
+        if expr.tag == NodeType.BINARY:
+            return max(self.stack_depth(expr.left), 1 + self.stack_depth(expr.right))
+        return 1
+
+    def python_source(self, expr, frame, top=False, condition=False):
+        """
+        Renders an expression as Python source over local variables named after frame slots.
+
+        Args:
+        expr (Node): The expression.
+        frame (Frame): The frame resolving variable names.
+        top (bool): Whether this is the root of the expression.
+        condition (bool): Whether the root is only tested for truthiness.
+
+        Returns:
+        str: The Python source.
+        """
+        if expr.tag == NodeType.BINARY:
+            op = expr.op
+            source = PYTHON_TEMPLATES[op].format(self.python_source(expr.left, frame),
+                                                 self.python_source(expr.right, frame))
+            if op in COMPARISONS and not (top and condition):
+                source = f'(1 if {source} else 0)'
+            return source
+        if expr.tag == NodeType.NAME:
+            return f'v{frame.resolve(expr.id)}'
+        return repr(int(expr.value))
+
+    def fuse_python(self, expr, frame, variables, fallback, condition):
+        """
+        Generates a single Python function evaluating the whole expression.
+        """
+        loads = ''.join(f'    v{slot} = slots[{slot}]\n'
+                        f'    if v{slot}.__class__ is LazyEval:\n'
+                        f'        v{slot} = v{slot}.evaluate()\n' for slot in variables)
+        guard = ' and '.join(f'type(v{slot}) is int' for slot in variables) or 'True'
+        source = (
+            'def fused():\n'
+            f'{loads}'
+            f'    if {guard}:\n'
+            f'        return {self.python_source(expr, frame, top=True, condition=condition)}\n'
+            '    return fallback()\n'
+        )
+        namespace = {'slots': frame.slots, 'fallback': fallback, 'LazyEval': LazyEval, '_div': c_divide,
+                     '_mod': c_modulo}
+        exec(compile(source, '<ulto kernel>', 'exec'), namespace)
+        return namespace['fused']
+
+    def fuse_native(self, expr, frame, variables, fallback):
+        """
+        Packs the expression into a postfix program and returns a function evaluating it in one native call.
+        """
+        values_index = {}
+        constants = []
+        program = []
+
+        def emit(node):
+            if node.tag == NodeType.BINARY:
+                emit(node.left)
+                emit(node.right)
+                program.extend((NATIVE_OPCODES[node.op], 0))
+                return
+            key = ('slot', frame.resolve(node.id)) if node.tag == NodeType.NAME else ('const', int(node.value))
+            if key not in values_index:
+                values_index[key] = len(values_index)
+                constants.append(key)
+            program.extend((0, values_index[key]))
+
+        emit(expr)
+        native_program = (ctypes.c_int32 * len(program))(*program)
+        values = (ctypes.c_int64 * len(constants))()
+        for position, (kind, value) in enumerate(constants):
+            if kind == 'const':
+                values[position] = value
+        positions = [(position, value) for position, (kind, value) in enumerate(constants) if kind == 'slot']
+        result = ctypes.c_int64()
+        result_ref = ctypes.byref(result)
+        length = len(program)
+        slots = frame.slots
+        ulto_eval = self.native.ulto_eval
+
+        def fused():
+            for position, slot in positions:
+                value = slots[slot]
+                if value.__class__ is LazyEval:
+                    value = value.evaluate()
+                if type(value) is not int or not INT_MIN <= value <= INT_MAX:
+                    return fallback()
+                values[position] = value
+            if ulto_eval(native_program, length, values, result_ref) != 0:
+                return fallback()
+            return result.value
+        return fused
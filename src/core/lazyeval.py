@@ -4,6 +4,53 @@
 #
 # Aman Thapa Magar <at719@sussex.ac.uk>
 
+from src.nodes import NodeType
+
+# Longest chain of unevaluated thunks a thunk may depend on. Forcing a chain recurses once per thunk, so past this
+# depth the value is computed at once instead.
+MAX_DEPTH = 64
+
+# Expressions of at most this many operators and without list literals cost less to compute than a thunk does to
+# make and force, and are computed at once unless they depend on an unevaluated thunk.
+CHEAP_OPERATORS = 8
+
+
+def scan_inputs(expr, names):
+    """
+    Collects the variables an expression reads and estimates its cost.
+
+    Args:
+    expr (Node): The expression.
+    names (list): The list collecting the variable names, each once, in the order they are read.
+
+    Returns:
+    int: The number of operators, or -1 if the expression builds a list.
+    """
+    tag = expr.tag
+    if tag == NodeType.NAME:
+        if expr.id not in names:
+            names.append(expr.id)
+        return 0
+    if tag == NodeType.CONSTANT:
+        return 0
+    if tag == NodeType.BINARY:
+        left = scan_inputs(expr.left, names)
+        right = scan_inputs(expr.right, names)
+        return -1 if left < 0 or right < 0 else left + right + 1
+    if tag == NodeType.INDEX:
+        target = scan_inputs(expr.target, names)
+        index = scan_inputs(expr.index, names)
+        return -1 if target < 0 or index < 0 else target + index + 1
+    if tag == NodeType.LEN:
+        value = scan_inputs(expr.value, names)
+        return -1 if value < 0 else value + 1
+    if tag == NodeType.INVARIANT:
+        return scan_inputs(expr.value, names)
+    if tag == NodeType.LIST:
+        for element in expr.elements:
+            scan_inputs(element, names)
+    return -1
+
 
 class LazyEval:
     """
@@ -14,24 +61,47 @@ class LazyEval:
     unless certain conditions are met. The class ensures that the expression is evaluated only once, caching
     the result for subsequent accesses.
 
+    A thunk made by a `LazySite` captures the values of the variables its expression reads, its inputs, when it
+    is made. Values are never modified in place, so they are the versions of the inputs the assignment saw: the
+    expression is evaluated against them, whatever the variables hold by the time the value is needed, and the
+    inputs are dropped once it has been.
+
     Attributes:
-        expression (any): The expression to be lazily evaluated.
+        expression (any): The expression to be lazily evaluated, either an AST expression or a closure compiled
+                          from one.
         engine (ExecutionEngine): The engine used to evaluate the expression.
         value (any): The evaluated value of the expression, initialized to `None`.
         evaluated (bool): A flag indicating whether the expression has been evaluated, initialized to `False`.
+        tracker (MemoryManager): The memory manager charged for the lazy value while it is held, which is told
+                                 when it is evaluated, `None` if it is not tracked.
+        holders (int): The number of variables and history entries the memory manager tracks the value for.
+        inputs (tuple): The frame slots of the variables the expression reads, empty if it reads the current
+                        values.
+        captured (tuple): The values of the inputs when the thunk was made.
+        depth (int): The length of the longest chain of unevaluated thunks the value depends on, itself included.
     """
-    def __init__(self, expression, engine):
+    __slots__ = ('expression', 'engine', 'value', 'evaluated', 'tracker', 'holders', 'inputs', 'captured', 'depth')
+
+    def __init__(self, expression, engine, inputs=(), captured=(), depth=1):
         """
         Initializes the LazyEval instance.
 
         Args:
         expression (any): The expression to be lazily evaluated.
         engine (ExecutionEngine): The engine to evaluate the expression.
+        inputs (tuple): The frame slots of the variables the expression reads.
+        captured (tuple): The values of those variables to evaluate the expression against.
+        depth (int): The length of the longest chain of unevaluated thunks the value depends on.
         """
         self.expression = expression
         self.engine = engine
         self.value = None
         self.evaluated = False
+        self.tracker = None
+        self.holders = 0
+        self.inputs = inputs
+        self.captured = captured
+        self.depth = depth
 
     def evaluate(self):
         """
@@ -41,6 +111,134 @@ class LazyEval:
         The evaluated value of the expression.
         """
         if not self.evaluated:
-            self.value = self.engine.evaluate_expression(self.expression)
+            inputs = self.inputs
+            if inputs:
+                # the captured versions are put in the frame for the evaluation, then the current ones restored.
+                slots = self.engine.frame.slots
+                current = [slots[slot] for slot in inputs]
+                for slot, value in zip(inputs, self.captured):
+                    slots[slot] = value
+                try:
+                    self.value = self.compute()
+                finally:
+                    for slot, value in zip(inputs, current):
+                        slots[slot] = value
+                self.inputs = self.captured = ()
+            else:
+                self.value = self.compute()
             self.evaluated = True
-        return self.value
\ No newline at end of file
+            self.depth = 0
+            if self.tracker is not None:
+                self.tracker.track_evaluated(self)
+        return self.value
+
+    def compute(self):
+        """
+        Evaluates the expression against the variables in the frame.
+
+        Returns:
+        The value of the expression.
+        """
+        if callable(self.expression):
+            return self.expression()
+        return self.engine.evaluate_expression(self.expression)
+
+
+class LazySite:
+    """
+    An assignment whose values are computed lazily, unless a cost model finds it cheaper to compute them at once.
+
+    Every time the assignment runs, the values of its inputs are captured. A value is computed at once if the
+    expression is cheap, see `CHEAP_OPERATORS`, and none of its inputs is an unevaluated thunk, which computing it
+    would force; or if it would otherwise depend on a chain of more than `MAX_DEPTH` thunks. Otherwise a `LazyEval`
+    is made, holding the captured inputs.
+
+    A value computed at once whose expression raises, such as a division by zero, is made a `LazyEval` after all,
+    so the error is only reported if the value is read.
+
+    The last value or thunk made is cached together with the inputs it was made from, and reused for as long as
+    the same inputs come back, as an assignment in a loop whose inputs the loop does not change would. Values
+    are never modified in place, so an input is unchanged exactly when it holds the same object; any other
+    value invalidates the cache.
+
+    Attributes:
+        expression (callable): The compiled expression, reading its inputs from the frame.
+        inputs (tuple): The frame slots of the variables the expression reads.
+        cheap (bool): Whether the expression is cheap enough to compute at once.
+        captured (tuple or None): The inputs the cached value was made from, `None` if nothing is cached.
+        cached (any): The cached value or thunk.
+    """
+    __slots__ = ('expression', 'inputs', 'cheap', 'captured', 'cached')
+
+    def __init__(self, expr, expression, frame):
+        """
+        Prepares an assignment site.
+
+        Args:
+        expr (Node): The assigned expression.
+        expression (callable): The expression compiled against `frame`.
+        frame (Frame): The frame the variables read by the expression are resolved against.
+        """
+        names = []
+        operators = scan_inputs(expr, names)
+        self.expression = expression
+        self.inputs = tuple(frame.resolve(var_name) for var_name in names)
+        self.cheap = 0 <= operators <= CHEAP_OPERATORS
+        self.captured = None
+        self.cached = None
+
+    def make(self, engine):
+        """
+        Makes the value of the assignment from the current values of its inputs.
+
+        Args:
+        engine (ExecutionEngine): The engine running the assignment, whose frame holds the inputs.
+
+        Returns:
+        The value, or a `LazyEval` computing it.
+        """
+        slots = engine.frame.slots
+        captured = tuple([slots[slot] for slot in self.inputs])
+        previous = self.captured
+        if previous is not None:
+            for value, previous_value in zip(captured, previous):
+                if value is not previous_value:
+                    break
+            else:
+                return self.cached
+        depth = 0
+        for value in captured:
+            if value.__class__ is LazyEval and value.depth > depth:
+                depth = value.depth
+        if depth >= MAX_DEPTH or (not depth and self.cheap):
+            try:
+                value = self.expression()
+            except Exception:
+                # the error is left for when the value is read, if ever, as it would be had the value been lazy.
+                value = LazyEval(self.expression, engine, self.inputs, captured, depth + 1)
+            else:
+                engine.evaluations += 1
+        else:
+            value = LazyEval(self.expression, engine, self.inputs, captured, depth + 1)
+        self.captured = captured
+        self.cached = value
+        return value
+
+    def defer(self, engine):
+        """
+        Makes a thunk of the assignment from the current values of its inputs, without computing it. Used by
+        eager assignments whose expression raised, so the error only surfaces if the value is read.
+
+        Args:
+        engine (ExecutionEngine): The engine running the assignment, whose frame holds the inputs.
+
+        Returns:
+        LazyEval: The thunk.
+        """
+        slots = engine.frame.slots
+        captured = tuple([slots[slot] for slot in self.inputs])
+        depth = 0
+        for value in captured:
+            if value.__class__ is LazyEval and value.depth > depth:
+                depth = value.depth
+        return LazyEval(self.expression, engine, self.inputs, captured, depth + 1)
@@ -4,8 +4,679 @@
 #
 # Aman Thapa Magar <at719@sussex.ac.uk>
 
-import time
 import sys
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from src.core.lazyeval import LazyEval
+from src.core.malloc import LAZY_SIZE
+from src.core.segmentlog import Segment, SegmentLog
+from src.core.retention import KeepAll, NEVER
+
+# Range of the typed integer column. Other integers are kept in the generic column.
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+# What the value column holds for an entry: the integer itself, nothing (the variable was unassigned), or the
+# position of the value in the generic object column. The kind takes the low bits of the entry's tag.
+KIND_INT = 0
+KIND_NONE = 1
+KIND_OBJECT = 2
+# Delta entries hold the operand of a compound assignment instead of the previous value, which is recovered by
+# undoing the operation on the value that followed it. Integer operands are stored in the value column, the
+# string appended by a concatenation in the object column.
+KIND_ADD = 3
+KIND_SUBTRACT = 4
+KIND_MULTIPLY = 5
+KIND_CONCAT = 6
+KIND_BITS = 3
+KIND_MASK = 7
+
+# Default maximum number of consecutive delta entries. The next reversible update is logged as a snapshot
+# instead, so recovering any previous value, and rewinding, undoes at most this many operations per variable.
+SNAPSHOT_INTERVAL = 32
+
+# Maximum number of entries, or of undo stack positions, written to a `SegmentLog` as one segment.
+SEGMENT_ENTRIES = 4096
+
+# Approximate memory taken by an entry with its undo stack position and journal step, in bytes, which is what a
+# `LogStack` counts against its memory budget. Objects are counted on top.
+ENTRY_SIZE = 36
+
+# Default memory budget of a `LogStack` moving older entries to a `SegmentLog`, in megabytes.
+HISTORY_BUDGET = 16
+
+
+def delta_kind(op, old_value, operand):
+    """
+    Chooses how a compound assignment can be logged as a delta.
+
+    Args:
+        op (str): The compound operator: 'plus', 'minus', 'times' or 'over'.
+        old_value (Any): The value of the variable before the assignment.
+        operand (Any): The right-hand side of the assignment.
+
+    Returns:
+        int or None: The kind of the delta entry, or `None` if the assignment cannot be undone exactly from its
+        result and operand, e.g. a division or a multiplication by zero.
+    """
+    if type(old_value) is int and type(operand) is int:
+        if not INT_MIN <= operand <= INT_MAX:
+            return None
+        if op == 'plus':
+            return KIND_ADD
+        if op == 'minus':
+            return KIND_SUBTRACT
+        if op == 'times' and operand:
+            return KIND_MULTIPLY
+        return None
+    # lists need no delta: snapshots of a `Vector` share all but its last values with the current one.
+    if op == 'plus' and type(old_value) is str and type(operand) is str:
+        return KIND_CONCAT
+    return None
+
+
+def undo(kind, operand, value):
+    """
+    Recovers the value a variable had before a compound assignment logged as a delta.
+
+    Args:
+        kind (int): The kind of the delta entry.
+        operand (Any): The operand of the assignment.
+        value (Any): The value the assignment produced.
+
+    Returns:
+        Any: The value before the assignment.
+    """
+    if kind == KIND_ADD:
+        return value - operand
+    if kind == KIND_SUBTRACT:
+        return value + operand
+    if kind == KIND_MULTIPLY:
+        return value // operand
+    return value[:len(value) - len(operand)]
+
+
+class History:
+    """
+    The logged values of a single variable, stored column-wise.
+
+    Every entry takes one slot in two typed arrays, 16 bytes in total: its value and a tag combining the
+    sequence number it was logged under with its kind. Integers are stored unboxed in the value column; any
+    other value is appended to a generic object column and the value column holds its position there. `None`
+    needs no storage at all.
+
+    Entries are either snapshots of the previous value or deltas holding the operand of a reversible compound
+    assignment. A delta is undone on the value that followed it, which is the current value of the variable for
+    the most recent entry and the previous value recovered for the entry above it otherwise. A snapshot is
+    forced after a number of consecutive deltas, `SNAPSHOT_INTERVAL` by default, bounding the work needed to
+    recover any entry.
+
+    The entries are only ever appended, a reversal included, so the history is also the index of the variable
+    into the journal of the `LogStack`: the value the variable had at any step is the previous value of its first
+    entry logged at or after that step. The entries a reversal can still undo are kept apart, in a stack of
+    positions. Every entry also records the top of that stack after it, so the stack as it was at any step can
+    be rebuilt by following those links down from the top it had then.
+
+    With a `SegmentLog`, the oldest entries and the bottom of the undo stack can be moved out of memory by
+    `spill`, in segments of up to `SEGMENT_ENTRIES` entries. The columns above only hold the entries from
+    `base` on, and older entries are read back from the log when they are reached. Positions count every entry
+    ever logged, discarded ones included.
+
+    Attributes:
+        number (int): The number of the variable in the journal.
+        values (array): The integer values, or positions in `objects`, of the entries in memory.
+        tags (array): The sequence number of every entry in memory shifted by KIND_BITS, or-ed with its kind.
+            Increasing.
+        objects (list): The values that are not 64-bit integers, in logging order.
+        object_sizes (array): The size of every value in `objects` when it was logged, in bytes.
+        offset (int): The number of objects discarded from the front of `objects`, or moved to the log.
+        start (int): The position of the oldest entry kept.
+        base (int): The position of the oldest entry in memory.
+        deltas (int): The number of consecutive delta entries at the end of the history.
+        undo (array): The positions of the entries reversals can still undo, from the top of the undo stack down
+            to the first position moved to the log.
+        tops (array): For every entry in memory, the position of the top of the undo stack once it was logged,
+            -1 if it was empty.
+        store (SegmentLog or None): The log older entries are moved to, `None` to keep them in memory.
+        segments (list): The `Segment` of every run of entries moved to the log, oldest first.
+        segment_positions (array): The position of the first entry of every segment.
+        segment_tags (array): The tag of the first entry of every segment.
+        undo_segments (list): The offset and length of every run of the undo stack moved to the log, bottom first.
+        undo_firsts (array): The first position of every run of the undo stack in the log.
+        undo_ends (array): The number of positions of the undo stack in the log up to the end of every run.
+        object_size (int): The size of the objects of the entries kept, in memory or in the log, in bytes.
+        memory (MemoryManager or None): The manager the objects in memory are charged to, `None` to measure them
+            with `sys.getsizeof` alone.
+    """
+    __slots__ = ('number', 'values', 'tags', 'objects', 'object_sizes', 'offset', 'start', 'base', 'deltas',
+                 'undo', 'tops', 'store', 'segments', 'segment_positions', 'segment_tags', 'undo_segments',
+                 'undo_firsts', 'undo_ends', 'object_size', 'memory')
+
+    def __init__(self, number=0, store=None, memory=None):
+        self.number = number
+        self.values = array('q')
+        self.tags = array('Q')
+        self.objects = []
+        self.object_sizes = array('Q')
+        self.offset = 0
+        self.start = 0
+        self.base = 0
+        self.deltas = 0
+        self.undo = array('Q')
+        self.tops = array('q')
+        self.store = store
+        self.segments = []
+        self.segment_positions = array('Q')
+        self.segment_tags = array('Q')
+        self.undo_segments = []
+        self.undo_firsts = array('Q')
+        self.undo_ends = array('Q')
+        self.object_size = 0
+        self.memory = memory
+
+    def __len__(self):
+        return self.base - self.start + len(self.tags)
+
+    def append(self, value, sequence, top=None):
+        """
+        Appends a snapshot entry.
+
+        Args:
+            value (Any): The logged value.
+            sequence (int): The sequence number of the entry.
+            top (int): For entries made by a reversal or a rewind, which cannot be undone themselves, the top of
+                the undo stack they leave. `None` pushes the entry onto the undo stack.
+
+        Returns:
+            int: The size of the value if it was stored in the object column, 0 otherwise.
+        """
+        if top is None:
+            top = self.base + len(self.tags)
+            self.undo.append(top)
+        self.tops.append(top)
+        self.deltas = 0
+        if type(value) is int and INT_MIN <= value <= INT_MAX:
+            self.values.append(value)
+            self.tags.append(sequence << KIND_BITS)
+            return 0
+        if value is None:
+            self.values.append(0)
+            self.tags.append(sequence << KIND_BITS | KIND_NONE)
+            return 0
+        self.values.append(self.offset + len(self.objects))
+        self.objects.append(value)
+        self.tags.append(sequence << KIND_BITS | KIND_OBJECT)
+        size = self.memory.track(value) if self.memory is not None else sys.getsizeof(value)
+        self.object_sizes.append(size)
+        self.object_size += size
+        return size
+
+    def append_delta(self, kind, operand, sequence):
+        """
+        Appends a delta entry.
+
+        Args:
+            kind (int): The kind of the delta, see `delta_kind`.
+            operand (Any): The operand of the compound assignment.
+            sequence (int): The sequence number of the entry.
+
+        Returns:
+            int: The size of the operand if it was stored in the object column, 0 otherwise.
+        """
+        top = self.base + len(self.tags)
+        self.undo.append(top)
+        self.tops.append(top)
+        self.tags.append(sequence << KIND_BITS | kind)
+        self.deltas += 1
+        if kind != KIND_CONCAT:
+            self.values.append(operand)
+            return 0
+        self.values.append(self.offset + len(self.objects))
+        self.objects.append(operand)
+        size = self.memory.track(operand) if self.memory is not None else sys.getsizeof(operand)
+        self.object_sizes.append(size)
+        self.object_size += size
+        return size
+
+    def entry(self, position):
+        """
+        Returns an entry, reading it back from the log if it is no longer in memory.
+
+        Args:
+            position (int): The position of the entry.
+
+        Returns:
+            tuple: The tag of the entry and its integer value, operand or object.
+        """
+        index = position - self.base
+        if index >= 0:
+            tag = self.tags[index]
+            if tag & KIND_MASK in (KIND_OBJECT, KIND_CONCAT):
+                return tag, self.objects[self.values[index] - self.offset]
+            return tag, self.values[index]
+        store = self.store
+        segment = self.segments[bisect_right(self.segment_positions, position) - 1]
+        index = position - segment.position
+        tag = store.read_array('Q', segment.tags, segment.count)[index]
+        value = store.read_array('q', segment.values, segment.count)[index]
+        if tag & KIND_MASK in (KIND_OBJECT, KIND_CONCAT):
+            value -= segment.object_base
+            if segment.resident is not None and value in segment.resident:
+                return tag, segment.resident[value]
+            return tag, store.read_objects(segment.objects, segment.length)[value]
+        return tag, value
+
+    def get(self, position, current_value):
+        """
+        Returns the value of the variable before the entry at a position was logged.
+
+        Args:
+            position (int): The position of the entry.
+            current_value (Any): The current value of the variable, needed if the entries from `position` up
+                to the most recent one are all deltas.
+
+        Returns:
+            Any: The previous value of the variable.
+        """
+        if position < self.base:
+            return self.get_spilled(position, current_value)
+        tags = self.tags
+        position -= self.base
+        # the nearest snapshot at or above the position, from which the deltas below it are undone.
+        start = position
+        while start < len(tags) and tags[start] & KIND_MASK >= KIND_ADD:
+            start += 1
+        value = self.snapshot(start) if start < len(tags) else current_value
+        if start > position and isinstance(value, LazyEval):
+            value = value.evaluate()
+        for entry in range(start - 1, position - 1, -1):
+            kind = tags[entry] & KIND_MASK
+            operand = self.objects[self.values[entry] - self.offset] if kind == KIND_CONCAT else self.values[entry]
+            value = undo(kind, operand, value)
+        return value
+
+    def get_spilled(self, position, current_value):
+        """
+        Returns the value of the variable before an entry moved to the log was logged, like `get`.
+
+        Args:
+            position (int): The position of the entry.
+            current_value (Any): The current value of the variable.
+
+        Returns:
+            Any: The previous value of the variable.
+        """
+        end = self.base + len(self.tags)
+        deltas = []
+        value = current_value
+        while position < end:
+            tag, value = self.entry(position)
+            kind = tag & KIND_MASK
+            if kind < KIND_ADD:
+                if kind == KIND_NONE:
+                    value = None
+                break
+            deltas.append((kind, value))
+            position += 1
+        else:
+            value = current_value
+        if deltas and isinstance(value, LazyEval):
+            value = value.evaluate()
+        for kind, operand in reversed(deltas):
+            value = undo(kind, operand, value)
+        return value
+
+    def snapshot(self, index):
+        """
+        Returns the value stored by a snapshot entry in memory.
+
+        Args:
+            index (int): The index of the entry in the columns.
+
+        Returns:
+            Any: The logged value.
+        """
+        kind = self.tags[index] & KIND_MASK
+        if kind == KIND_INT:
+            return self.values[index]
+        if kind == KIND_OBJECT:
+            return self.objects[self.values[index] - self.offset]
+        return None
+
+    def top(self, position):
+        """
+        Returns the top of the undo stack once an entry was logged.
+
+        Args:
+            position (int): The position of the entry.
+
+        Returns:
+            int: The position of the top, -1 if the stack was empty.
+        """
+        index = position - self.base
+        if index >= 0:
+            return self.tops[index]
+        segment = self.segments[bisect_right(self.segment_positions, position) - 1]
+        return self.store.read_array('q', segment.tops, segment.count)[position - segment.position]
+
+    def position_at(self, sequence):
+        """
+        Finds the first entry logged at or after a sequence number.
+
+        Args:
+            sequence (int): The sequence number.
+
+        Returns:
+            int: The position of the entry, one past the most recent entry if there is none.
+        """
+        bound = sequence << KIND_BITS
+        tags = self.tags
+        if self.segments and (not tags or tags[0] >= bound):
+            index = bisect_left(self.segment_tags, bound)
+            if not index:
+                return self.start
+            segment = self.segments[index - 1]
+            return segment.position + bisect_left(self.store.read_array('Q', segment.tags, segment.count), bound)
+        return self.base + bisect_left(tags, bound)
+
+    def value_at(self, sequence, current_value):
+        """
+        Returns the value the variable had just before the mutation with a sequence number was made.
+
+        Args:
+            sequence (int): The sequence number.
+            current_value (Any): The current value of the variable.
+
+        Returns:
+            Any: The value of the variable at that step.
+        """
+        position = self.position_at(sequence)
+        if position == self.base + len(self.tags):
+            return current_value
+        return self.get(position, current_value)
+
+    def spilled_undo(self, index):
+        """
+        Returns a position of the undo stack that was moved to the log.
+
+        Args:
+            index (int): How far below the part of the stack in memory the position is, 1 for the first one.
+
+        Returns:
+            int: The position.
+        """
+        position = self.undo_ends[-1] - index
+        run = bisect_right(self.undo_ends, position)
+        offset, count = self.undo_segments[run]
+        return self.store.read_array('Q', offset, count)[position - (self.undo_ends[run - 1] if run else 0)]
+
+    def load_undo(self):
+        """
+        Moves the top run of the undo stack in the log back into memory, once the part in memory is empty.
+        """
+        offset, count = self.undo_segments.pop()
+        self.undo.extend(self.store.read_array('Q', offset, count))
+        del self.undo_firsts[-1]
+        del self.undo_ends[-1]
+
+    def truncate_undo(self, top):
+        """
+        Removes the positions above a position from the undo stack, if the position is on it.
+
+        Args:
+            top (int): The position.
+
+        Returns:
+            bool: Whether the position is on the stack.
+        """
+        undo = self.undo
+        if undo and top >= undo[0]:
+            index = bisect_left(undo, top)
+            if index < len(undo) and undo[index] == top:
+                del undo[index + 1:]
+                return True
+            return False
+        run = bisect_right(self.undo_firsts, top) - 1
+        if run < 0:
+            return False
+        offset, count = self.undo_segments[run]
+        positions = self.store.read_array('Q', offset, count)
+        index = bisect_left(positions, top)
+        if index == count or positions[index] != top:
+            return False
+        undo[:] = positions[:index + 1]
+        del self.undo_segments[run:]
+        del self.undo_firsts[run:]
+        del self.undo_ends[run:]
+        return True
+
+    def restore_undo(self, top):
+        """
+        Rebuilds the undo stack as it was when its top was at a position, following the links from that position
+        down to the first entry still on the current stack.
+
+        Args:
+            top (int): The position of the top, -1 for an empty stack.
+        """
+        chain = array('Q')
+        while top >= self.start:
+            if self.truncate_undo(top):
+                break
+            chain.append(top)
+            top = self.top(top - 1) if top > self.start else -1
+        else:
+            # the whole stack differs, or its older entries were discarded.
+            del self.undo[:]
+            del self.undo_segments[:]
+            del self.undo_firsts[:]
+            del self.undo_ends[:]
+        chain.reverse()
+        self.undo.extend(chain)
+
+    def discard_before(self, sequence):
+        """
+        Discards the entries logged before a sequence number. Deltas only depend on the entries above them, so
+        the remaining entries can still be recovered. Entries in the log are discarded by whole segments.
+
+        Args:
+            sequence (int): The sequence number of the oldest entry to keep.
+
+        Returns:
+            tuple: The number of entries discarded and the size of their objects in bytes.
+        """
+        bound = sequence << KIND_BITS
+        start = self.start
+        size = 0
+        segments = self.segments
+        if segments:
+            # a segment can go once the entry following it is old enough too.
+            count = bisect_right(self.segment_tags, bound)
+            if count and (count < len(segments) or self.tags[0] > bound):
+                count -= 1
+            if count:
+                self.start = segments[count].position if count < len(segments) else self.base
+                size += sum(segment.size for segment in segments[:count])
+                if self.memory is not None:
+                    for segment in segments[:count]:
+                        for value in (segment.resident or {}).values():
+                            self.memory.release(value)
+                del segments[:count]
+                del self.segment_positions[:count]
+                del self.segment_tags[:count]
+        if not segments:
+            count = bisect_left(self.tags, bound)
+            if count:
+                discarded_objects = sum(1 for tag in self.tags[:count] if tag & KIND_MASK in (KIND_OBJECT, KIND_CONCAT))
+                size += sum(self.object_sizes[:discarded_objects])
+                if self.memory is not None:
+                    for value in self.objects[:discarded_objects]:
+                        self.memory.release(value)
+                del self.values[:count]
+                del self.tags[:count]
+                del self.tops[:count]
+                del self.objects[:discarded_objects]
+                del self.object_sizes[:discarded_objects]
+                self.offset += discarded_objects
+                self.base += count
+                self.start = self.base
+        if self.start == start:
+            return 0, 0
+        self.deltas = min(self.deltas, len(self))
+        self.object_size -= size
+        self.discard_undo()
+        return self.start - start, size
+
+    def discard_undo(self):
+        """
+        Removes the positions of discarded entries from the bottom of the undo stack.
+        """
+        start = self.start
+        undo_segments = self.undo_segments
+        if undo_segments:
+            # every run but the last one starting at or before `start` is made of discarded positions.
+            count = bisect_right(self.undo_firsts, start)
+            if count:
+                offset, length = undo_segments[count - 1]
+                positions = self.store.read_array('Q', offset, length)
+                kept = positions[bisect_left(positions, start):]
+                del undo_segments[:count]
+                del self.undo_firsts[:count]
+                if kept:
+                    # the run is written again without its discarded positions.
+                    if len(kept) < length:
+                        offset = self.store.write_array(kept)
+                    undo_segments.insert(0, (offset, len(kept)))
+                    self.undo_firsts.insert(0, kept[0])
+                ends = array('Q')
+                total = 0
+                for offset, length in undo_segments:
+                    total += length
+                    ends.append(total)
+                self.undo_ends = ends
+        del self.undo[:bisect_left(self.undo, start)]
+
+    def spill(self, keep):
+        """
+        Moves all but the most recent entries, and all but the top of the undo stack, to the log.
+
+        Args:
+            keep (int): The number of entries, and of undo stack positions, to keep in memory.
+        """
+        store = self.store
+        count = len(self.tags) - keep
+        if count > 0:
+            spilled_objects = 0
+            for first in range(0, count, SEGMENT_ENTRIES):
+                last = min(first + SEGMENT_ENTRIES, count)
+                tags = self.tags[first:last]
+                segment = Segment(self.base + first, last - first, store.write_array(self.values[first:last]),
+                                  store.write_array(tags), store.write_array(self.tops[first:last]))
+                object_count = sum(1 for tag in tags if tag & KIND_MASK in (KIND_OBJECT, KIND_CONCAT))
+                if object_count:
+                    objects = self.objects[spilled_objects:spilled_objects + object_count]
+                    segment.size = sum(self.object_sizes[spilled_objects:spilled_objects + object_count])
+                    # unevaluated lazy values hold closures, which cannot be written out.
+                    resident = {index: value for index, value in enumerate(objects) if isinstance(value, LazyEval)}
+                    if resident:
+                        segment.resident = resident
+                        objects = [None if index in resident else value for index, value in enumerate(objects)]
+                    if self.memory is not None:
+                        # what is written to the log no longer takes memory.
+                        for value in objects:
+                            self.memory.release(value)
+                    segment.objects, segment.length = store.write_objects(objects)
+                    segment.object_base = self.offset + spilled_objects
+                    spilled_objects += object_count
+                self.segments.append(segment)
+                self.segment_positions.append(segment.position)
+                self.segment_tags.append(tags[0])
+            del self.values[:count]
+            del self.tags[:count]
+            del self.tops[:count]
+            del self.objects[:spilled_objects]
+            del self.object_sizes[:spilled_objects]
+            self.offset += spilled_objects
+            self.base += count
+        undo = self.undo
+        count = len(undo) - keep
+        if count > 0:
+            total = self.undo_ends[-1] if self.undo_ends else 0
+            for first in range(0, count, SEGMENT_ENTRIES):
+                positions = undo[first:min(first + SEGMENT_ENTRIES, count)]
+                self.undo_segments.append((store.write_array(positions), len(positions)))
+                self.undo_firsts.append(positions[0])
+                total += len(positions)
+                self.undo_ends.append(total)
+            del undo[:count]
+
+    def size(self):
+        """
+        Estimates the size of the entries kept, as counted against retention policies.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return len(self) * ENTRY_SIZE + self.object_size
+
+    def resident_size(self):
+        """
+        Estimates the memory taken by the entries still in memory, as counted by the `LogStack`.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return len(self.tags) * ENTRY_SIZE + sum(self.object_sizes)
+
+    def compact(self):
+        """
+        Replaces the evaluated `LazyEval` values in memory that only the history holds by the values they were
+        evaluated to, freeing the lazy values. The objects replaced can then be moved to the log, too.
+
+        Returns:
+            int: The memory freed in bytes, as counted by `object_size`.
+        """
+        freed = 0
+        objects = self.objects
+        sizes = self.object_sizes
+        for index, value in enumerate(objects):
+            size = self.unwrap(value)
+            if size is not None:
+                objects[index] = value.value
+                freed += sizes[index] - size
+                sizes[index] = size
+        for segment in self.segments:
+            resident = segment.resident
+            if resident:
+                for index, value in resident.items():
+                    size = self.unwrap(value)
+                    if size is not None:
+                        resident[index] = value.value
+                        # the lazy value itself is what is freed, its value being charged either way.
+                        freed += LAZY_SIZE
+                        segment.size -= LAZY_SIZE
+        self.object_size -= freed
+        return freed
+
+    def unwrap(self, value):
+        """
+        Charges the value of an evaluated `LazyEval` held by the history alone in place of the lazy value.
+
+        Args:
+            value (Any): An object of the history.
+
+        Returns:
+            int: The size of the value in bytes, `None` if the object is not such a lazy value.
+        """
+        if type(value) is not LazyEval or not value.evaluated:
+            return None
+        if self.memory is None:
+            return sys.getsizeof(value.value)
+        if value.holders != 1:
+            return None
+        size = self.memory.track(value.value)
+        self.memory.release(value)
+        return size
 
 
 class LogStack:
@@ -13,60 +684,231 @@ class LogStack:
     A class to manage a stack-based log of variable values with support for undo operations.
 
     The `LogStack` class is designed to keep track of the changes made to variables over time.
-    It stores the history of variable values along with timestamps, allowing for operations
-    like pushing new values, popping the most recent value, peeking at previous values, pruning
-    old entries, and calculating memory usage.
+    It stores the history of variable values, allowing for operations like pushing new values,
+    popping the most recent value, peeking at previous values, pruning old entries, and calculating
+    memory usage.
+
+    The history of every variable is a `History` of typed columns rather than a list of tuples, so logging
+    an integer allocates no Python objects. Reversible compound assignments are logged as deltas through
+    `push_delta`, see `History`.
+
+    Every mutation, reversals included, is one step of an append-only journal: its sequence number is the
+    step, and the journal records which variable it changed. The histories index the journal per variable,
+    so the state of the whole program at any step is rebuilt with one binary search per variable, see
+    `state_at`, and rewound to it, see `rewind`. Variables advanced by `for` loops are only journaled when
+    assigned.
+
+    Given a `SegmentLog`, the log keeps within a memory budget without giving up any history: once the entries
+    in memory are estimated to take more than the budget, all but the most recent entries of every variable,
+    and the older part of the journal, are moved to the segment log, from which `pop`, `peek`, `state_at` and
+    `rewind` read them back when they reach them. Each entry is moved once, so this costs amortised constant
+    time per mutation.
+
+    How much history is kept is decided by a `RetentionPolicy` for the whole program, and optionally one per
+    variable, see `retain`. The whole history is kept by default. Policies are not consulted on every mutation:
+    each one tells how many steps can be made before it may be exceeded, and the log only checks them, and its
+    memory budget, once `sequence` reaches `check_at`. What they discard is counted in `lost`, and the steps
+    before `first_step` cannot be rewound to anymore.
+
+    Given a `MemoryManager`, the objects logged are tracked by it as long as they are in memory, and the entries
+    in memory are charged to it as one block, resized whenever the log checks its policies. The next check is
+    scheduled before the entries logged since could bring memory under pressure, and brought forward by the
+    manager if values do first. The log then gives up what it must to relieve it, in stages, see `relieve`.
 
     Attributes:
-        log (dict): A dictionary where keys are variable names and values are lists of tuples
-                    storing old values and their corresponding timestamps.
-        last_pruned (float): The last time the log was pruned, stored as a Unix timestamp.
+        log (dict): A dictionary where keys are variable names and values are the `History` of the variable.
+        sequence (int): The sequence number given to the next logged entry, i.e. the number of steps made.
+        journal (array): The number of the variable changed at every step from `first_step` on, or from the last
+            step moved to `store`.
+        first_step (int): The oldest step still in the journal.
+        variables (list): The variable names, indexed by their number in the journal.
+        snapshot_interval (int): The maximum number of consecutive delta entries in a history.
+        store (SegmentLog or None): The log older entries are moved to, `None` to keep the whole history in memory.
+        budget (int): The memory budget of the entries, in bytes.
+        resident (int): The estimated memory taken by the entries in memory when `sequence` was `counted`, in
+            bytes, objects logged since included.
+        counted (int): The sequence number up to which the entries are counted in `resident`.
+        spill_limit (int): The estimate above which entries are moved to `store`.
+        retention (RetentionPolicy): The retention policy of the whole program.
+        retained (dict): The retention policies of single variables, by name.
+        check_at (int): The sequence number at which the policies and the memory budget are checked next.
+        discarded (int): The number of entries discarded by retention policies.
+        object_size (int): The size of the objects of the entries kept, in bytes.
+        lost (dict): The number of entries discarded by retention policies, by variable name.
+        journal_segments (list): The offset and length of every run of the journal moved to `store`, oldest first.
+        journal_steps (array): The first step of every run of the journal in `store`.
+        memory (MemoryManager or None): The manager the entries and objects in memory are charged to.
+        warn (callable or None): Called with a message whenever history is given up under memory pressure.
     """
 
-    def __init__(self):
+    def __init__(self, snapshot_interval=SNAPSHOT_INTERVAL, store=None, budget=HISTORY_BUDGET, retention=None,
+                 memory=None, warn=None):
         """
         Initializes a new instance of the LogStack class.
 
-        The constructor initializes an empty log dictionary and sets the `last_pruned`
-        attribute to the current time.
+        Args:
+            snapshot_interval (int): The maximum number of consecutive delta entries in a history. Lower values
+                                     make deep revtraces and rewinds faster and history larger.
+            store (SegmentLog): The log older entries are moved to. `None` keeps the whole history in memory.
+            budget (float): The memory the entries kept in memory may take with a `store`, in megabytes.
+            retention (RetentionPolicy): The retention policy of the whole program, `KeepAll` by default.
+            memory (MemoryManager): The manager every object logged is tracked by, and the entries in memory
+                are charged to, as a block resized whenever the policies are checked. `None` measures objects
+                with `sys.getsizeof` and charges nothing.
+            warn (callable): Called with a message whenever history is given up under memory pressure.
         """
+        if snapshot_interval < 0:
+            raise ValueError(f'The snapshot interval must not be negative, got {snapshot_interval}')
+        if not math.isfinite(budget) or budget <= 0:
+            raise ValueError(f'The history budget must be a positive, finite number, got {budget}')
+        self.snapshot_interval = snapshot_interval
+        self.store = store
+        self.budget = int(budget * 1024 * 1024)
+        self.resident = 0
+        self.counted = 0
+        self.spill_limit = self.budget if store is not None else NEVER
+        self.retention = retention if retention is not None else KeepAll()
+        self.retained = {}
+        self.discarded = 0
+        self.object_size = 0
+        self.lost = {}
+        self.journal_segments = []
+        self.journal_steps = array('Q')
         self.log = {}
-        self.last_pruned = time.time()
+        self.sequence = 0
+        self.journal = array('I')
+        self.first_step = 0
+        self.variables = []
+        self.check_at = 0
+        self.memory = memory
+        self.warn = warn
+        if memory is not None:
+            memory.on_pressure = self.check_now
+        self.schedule()
+
+    def history(self, var_name):
+        """
+        Returns the history of a variable, creating it on its first mutation.
+
+        Args:
+            var_name (str): The variable name.
+
+        Returns:
+            History: The history of the variable.
+        """
+        history = self.log.get(var_name)
+        if history is None:
+            history = self.log[var_name] = History(len(self.variables), self.store, self.memory)
+            self.variables.append(var_name)
+        return history
+
+    def retain(self, var_name, policy):
+        """
+        Sets the retention policy of a single variable, which applies on top of the policy of the program.
+
+        Args:
+            var_name (str): The variable name.
+            policy (RetentionPolicy): The policy, counting entries of the history of the variable.
+        """
+        self.retained[var_name] = policy
+        self.check_at = self.sequence
 
     def push(self, var_name, old_value):
         """
         Pushes the old value of a variable onto the log stack.
 
         If the variable does not have an existing log, a new entry is created.
-        The old value is stored along with the current timestamp.
 
         Args:
             var_name (str): The name of the variable whose value is being logged.
             old_value (Any): The old value of the variable to be pushed onto the log.
         """
-        if var_name not in self.log:
-            self.log[var_name] = []
-        self.log[var_name].append((old_value, time.time()))
+        history = self.log.get(var_name)
+        if history is None:
+            history = self.history(var_name)
+        if type(old_value) is int and INT_MIN <= old_value <= INT_MAX:
+            # the common case, inlined from History.append.
+            top = history.base + len(history.tags)
+            history.undo.append(top)
+            history.tops.append(top)
+            history.values.append(old_value)
+            history.tags.append(self.sequence << KIND_BITS)
+            history.deltas = 0
+        else:
+            size = history.append(old_value, self.sequence)
+            if size:
+                self.count_object(size)
+        self.journal.append(history.number)
+        self.sequence += 1
+        if self.sequence >= self.check_at:
+            self.maintain()
+
+    def push_delta(self, var_name, op, operand, old_value):
+        """
+        Logs a compound assignment of a variable.
+
+        Assignments that can be undone exactly from their result, such as `a += k` on integers, are logged as a delta
+        holding only the operand `k`. Destructive ones, like `/=`, and the update following `snapshot_interval`
+        consecutive deltas are logged as a snapshot of the old value, like `push` does. Deltas are undone on the current
+        value of the variable, so they may only be used for variables that are never written without being logged.
+
+        Args:
+            var_name (str): The name of the variable being assigned.
+            op (str): The compound operator: 'plus', 'minus', 'times' or 'over'.
+            operand (Any): The right-hand side of the assignment.
+            old_value (Any): The value of the variable before the assignment.
+        """
+        history = self.log.get(var_name)
+        if history is None:
+            history = self.history(var_name)
+        kind = delta_kind(op, old_value, operand) if history.deltas < self.snapshot_interval else None
+        if kind is None:
+            size = history.append(old_value, self.sequence)
+        else:
+            size = history.append_delta(kind, operand, self.sequence)
+        if size:
+            self.count_object(size)
+        self.journal.append(history.number)
+        self.sequence += 1
+        if self.sequence >= self.check_at:
+            self.maintain()
 
-    def pop(self, var_name):
+    def pop(self, var_name, current_value=None):
         """
         Pops the most recent value from the log stack for a given variable.
 
         If the variable has an entry in the log and it is not empty, the most recent
         value is removed and returned. If the log is empty or the variable does not
-        exist in the log, `None` is returned.
+        exist in the log, `None` is returned. The entry stays in the journal, and the
+        reversal is journaled as a step of its own. An entry logged while the variable
+        was unassigned is left in place, as undoing it would not change the variable.
 
         Args:
             var_name (str): The name of the variable whose most recent value is to be popped.
+            current_value (Any): The current value of the variable, from which a delta entry is undone.
 
         Returns:
             Any: The most recent old value of the variable, or `None` if no value is available.
         """
-        if var_name in self.log and self.log[var_name]:
-            return self.log[var_name].pop()[0]
-        return None
+        history = self.log.get(var_name)
+        if history is None or not history.undo:
+            return None
+        undo = history.undo
+        previous_value = history.get(undo[-1], current_value)
+        if previous_value is not None:
+            undo.pop()
+            if not undo and history.undo_segments:
+                history.load_undo()
+            size = history.append(current_value, self.sequence, undo[-1] if undo else -1)
+            if size:
+                self.count_object(size)
+            self.journal.append(history.number)
+            self.sequence += 1
+            if self.sequence >= self.check_at:
+                self.maintain()
+        return previous_value
 
-    def peek(self, var_name, index=1):
+    def peek(self, var_name, index=1, current_value=None):
         """
         Peeks at a specific previous value in the log stack for a given variable.
 
@@ -77,46 +919,366 @@ class LogStack:
         Args:
             var_name (str): The name of the variable to peek at.
             index (int): The position in the log stack to peek at (1 for the most recent).
+            current_value (Any): The current value of the variable, from which delta entries are undone.
 
         Returns:
             Any: The value at the specified position in the log stack, or `None` if the
                  position is out of range or the variable does not exist.
         """
-        if var_name in self.log and len(self.log[var_name]) >= index:
-            return self.log[var_name][-index][0]
+        history = self.log.get(var_name)
+        if history is not None:
+            undo = history.undo
+            # indexes the entries like a list indexed with -index would.
+            if len(undo) >= index:
+                return history.get(undo[-index], current_value)
+            if history.undo_ends and len(undo) + history.undo_ends[-1] >= index:
+                return history.get(history.spilled_undo(index - len(undo)), current_value)
         return None
 
-    def prune(self, retention_time=50000):
+    def changed_at(self, step):
+        """
+        Returns the variable changed by a step of the journal.
+
+        Args:
+            step (int): The step.
+
+        Returns:
+            str: The variable name, or `None` if the step is not in the journal.
+        """
+        if not self.first_step <= step < self.sequence:
+            return None
+        index = step - (self.sequence - len(self.journal))
+        if index >= 0:
+            return self.variables[self.journal[index]]
+        run = bisect_right(self.journal_steps, step) - 1
+        offset, count = self.journal_segments[run]
+        return self.variables[self.store.read_array('I', offset, count)[step - self.journal_steps[run]]]
+
+    def state_at(self, step, current_values):
         """
-        Prunes old log entries based on a specified retention time.
+        Rebuilds the values all variables had at a step, that is after the first `step` mutations were made.
 
-        This method removes any entries in the log that are older than the specified
-        `retention_time`. The default retention time is 50,000 seconds. Pruning is
-        only performed if enough time has passed since the last pruning.
+        Args:
+            step (int): The step, from `first_step` to `sequence`.
+            current_values (dict): The current values of the variables, by name.
+
+        Returns:
+            dict: The values of the variables assigned at that step, by name, or `None` if the step is not in
+                the journal.
+        """
+        if not self.first_step <= step <= self.sequence:
+            return None
+        state = {}
+        for var_name, history in self.log.items():
+            value = history.value_at(step, current_values.get(var_name))
+            if value is not None:
+                state[var_name] = value
+        if step == self.sequence:
+            # variables never logged, only written by loops, are known at the current step alone.
+            for var_name, value in current_values.items():
+                if value is not None:
+                    state.setdefault(var_name, value)
+        return state
+
+    def rewind(self, step, current_values):
+        """
+        Rewinds the variables to a step: every variable changed since is restored to the value it had then,
+        together with the entries `rev` can undo, each restoration being journaled as a step of its own.
+
+        Only the variables changed since the step are visited, and each is restored with one binary search in
+        its history, so the cost does not depend on how far back the step is. Entries logged in the rewound steps
+        cannot be undone by `rev` anymore, while those reversed in them can be again.
 
         Args:
-            retention_time (int, optional): The maximum age of log entries to retain, in seconds.
-                                            Entries older than this will be removed. Defaults to 50,000.
+            step (int): The step, from `first_step` to `sequence`.
+            current_values (dict): The current values of the variables, by name.
+
+        Returns:
+            dict: The values to be assigned to the variables changed since the step, `None` for variables that
+                were unassigned then, by name. `None` if the step is not in the journal.
+        """
+        if not self.first_step <= step <= self.sequence:
+            return None
+        bound = step << KIND_BITS
+        restored = {}
+        for var_name, history in self.log.items():
+            tags = history.tags
+            if not tags or tags[-1] < bound:
+                continue
+            position = history.position_at(step)
+            current_value = current_values.get(var_name)
+            restored[var_name] = history.get(position, current_value)
+            top = history.top(position - 1) if position > history.start else -1
+            history.restore_undo(top)
+            size = history.append(current_value, self.sequence, top)
+            if size:
+                self.count_object(size)
+            self.journal.append(history.number)
+            self.sequence += 1
+        if self.sequence >= self.check_at:
+            self.maintain()
+        return restored
+
+    def count_object(self, size):
+        """
+        Counts an object logged with an entry, which brings the next check forward.
+
+        Args:
+            size (int): The size of the object in bytes.
+        """
+        self.object_size += size
+        self.resident += size
+        self.check_at -= size // ENTRY_SIZE
+
+    def size(self):
+        """
+        Estimates the size of the whole history kept, in memory or in the segment log.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return (self.sequence - self.discarded) * ENTRY_SIZE + self.object_size
+
+    def maintain(self):
+        """
+        Enforces the retention policies and the memory budget, then schedules the next check.
+        """
+        self.resident += (self.sequence - self.counted) * ENTRY_SIZE
+        self.counted = self.sequence
+        discarded = self.discarded
+        excess = self.retention.excess(self.sequence - self.first_step, self.size())
+        if excess:
+            self.discard_steps(self.first_step + excess)
+        for var_name, policy in self.retained.items():
+            history = self.log.get(var_name)
+            if history is not None:
+                excess = policy.excess(len(history), history.size())
+                if excess:
+                    self.discard_entries(var_name, history, excess)
+        if self.store is not None:
+            if self.discarded != discarded:
+                self.resident = self.resident_size()
+            if self.resident > self.spill_limit:
+                self.spill()
+        if self.memory is not None:
+            if self.under_pressure():
+                self.relieve()
+            self.memory.reserve(self, self.resident_entries() * ENTRY_SIZE)
+        self.schedule()
+
+    def check_now(self):
+        """
+        Has the policies and the memory budget checked at the next step, as memory has come under pressure.
+        """
+        self.check_at = self.sequence
+
+    def schedule(self):
+        """
+        Sets `check_at` to the first step at which a policy, the memory budget or the memory limit may be exceeded.
+        """
+        steps = self.retention.steps_left(self.sequence - self.first_step, self.size(), ENTRY_SIZE)
+        for var_name, policy in self.retained.items():
+            history = self.log.get(var_name)
+            if history is None:
+                steps = min(steps, policy.steps_left(0, 0, ENTRY_SIZE))
+            else:
+                steps = min(steps, policy.steps_left(len(history), history.size(), ENTRY_SIZE))
+        if self.store is not None:
+            steps = min(steps, max(1, (self.spill_limit - self.resident) // ENTRY_SIZE + 1))
+        if self.memory is not None:
+            # the entries logged until the next check must not bring memory under pressure, or, if it could not be
+            # relieved, use more than half of what is left.
+            headroom = self.memory.get_headroom()
+            if headroom <= 0:
+                headroom = self.memory.get_remaining_memory() // 2
+            steps = min(steps, max(1, headroom // ENTRY_SIZE + 1))
+        self.check_at = self.sequence + steps
+
+    def discard_steps(self, step):
+        """
+        Discards the history of every variable before a step, which becomes the oldest step to rewind to.
+
+        Args:
+            step (int): The oldest step to keep.
+        """
+        for var_name, history in self.log.items():
+            self.count_discarded(var_name, *history.discard_before(step))
+        self.first_step = max(self.first_step, step)
+        self.trim_journal()
+
+    def discard_entries(self, var_name, history, count):
+        """
+        Discards the oldest entries of a variable. The program cannot be rewound to the steps they were logged at
+        anymore, as the values the variable had then are lost.
+
+        Args:
+            var_name (str): The variable name.
+            history (History): The history of the variable.
+            count (int): The number of entries to discard.
+        """
+        if count < len(history):
+            step = history.entry(history.start + count)[0] >> KIND_BITS
+        else:
+            step = self.sequence
+        self.count_discarded(var_name, *history.discard_before(step))
+        self.first_step = max(self.first_step, step)
+        self.trim_journal()
+
+    def count_discarded(self, var_name, count, size):
+        """
+        Records the entries of a variable discarded by a retention policy.
+
+        Args:
+            var_name (str): The variable name.
+            count (int): The number of entries discarded.
+            size (int): The size of their objects in bytes.
+        """
+        if count:
+            self.lost[var_name] = self.lost.get(var_name, 0) + count
+            self.discarded += count
+            self.object_size -= size
+
+    def trim_journal(self):
+        """
+        Discards the journal before `first_step` once that is at least half of it, so trimming costs amortised
+        constant time per step.
+        """
+        journal_start = self.journal_steps[0] if self.journal_steps else self.sequence - len(self.journal)
+        if 2 * (self.first_step - journal_start) >= self.sequence - journal_start:
+            self.discard_journal(self.first_step)
+
+    def discard_journal(self, step):
+        """
+        Discards the journal before a step. Runs of the journal in the segment log are discarded whole.
+
+        Args:
+            step (int): The oldest step to keep.
+        """
+        journal_steps = self.journal_steps
+        if journal_steps:
+            # a run can go once the run, or the part of the journal in memory, following it starts at `step` or before.
+            count = bisect_right(journal_steps, step)
+            if count and (count < len(journal_steps) or self.sequence - len(self.journal) > step):
+                count -= 1
+            del self.journal_segments[:count]
+            del journal_steps[:count]
+        if not journal_steps:
+            del self.journal[:step - (self.sequence - len(self.journal))]
+
+    def spill(self):
+        """
+        Moves all but the most recent entries of every variable, and all but the end of the journal, to the
+        segment log, leaving half of the memory budget to the entries kept.
+        """
+        store = self.store
+        keep = max(1, min(SEGMENT_ENTRIES, self.budget // (2 * ENTRY_SIZE * (len(self.log) + 1))))
+        for history in self.log.values():
+            history.spill(keep)
+        journal = self.journal
+        count = len(journal) - keep
+        if count > 0:
+            step = self.sequence - len(journal)
+            for first in range(0, count, SEGMENT_ENTRIES):
+                steps = journal[first:min(first + SEGMENT_ENTRIES, count)]
+                self.journal_segments.append((store.write_array(steps), len(steps)))
+                self.journal_steps.append(step + first)
+            del journal[:count]
+        self.resident = self.resident_size()
+        # what cannot be moved, such as the last entry of every variable, must not make every mutation spill.
+        self.spill_limit = max(self.budget, 2 * self.resident)
+
+    def under_pressure(self):
+        """
+        Tells whether memory is under pressure, counting the entries in memory not charged yet.
+
+        Returns:
+            bool: Whether memory is under pressure.
+        """
+        return self.memory.under_pressure(self.resident_entries() * ENTRY_SIZE - self.memory.blocks.get(self, 0))
+
+    def relieve(self):
+        """
+        Relieves memory pressure in stages, stopping as soon as memory is no longer under pressure:
+
+        1. compacts the history, see `History.compact`;
+        2. moves older entries to the segment log, starting one if the history is kept in memory, and halves the
+           memory budget of the entries kept;
+        3. discards the oldest half of the history, which can no longer be reversed or rewound to, with a warning.
+
+        Should memory still come under pressure, the next check relieves it again, until the memory manager raises
+        a `MemoryError` once its limit is reached.
+        """
+        freed = sum(history.compact() for history in self.log.values())
+        self.object_size -= freed
+        self.resident -= freed
+        if not self.under_pressure():
+            return
+        if self.store is None:
+            self.store = SegmentLog()
+            for history in self.log.values():
+                history.store = self.store
+        self.resident = self.resident_size()
+        self.budget = max(1, min(self.budget, self.resident // 2))
+        self.spill()
+        if not self.under_pressure() or self.sequence == self.first_step:
+            return
+        step = self.first_step + (self.sequence - self.first_step + 1) // 2
+        if self.warn is not None:
+            self.warn(f'Memory limit approached, discarding the history of steps {self.first_step} to {step - 1}; '
+                      f'they can no longer be reversed or rewound to')
+        self.discard_steps(step)
+        self.resident = self.resident_size()
+
+    def resident_size(self):
+        """
+        Estimates the memory taken by the entries in memory, as counted against the memory budget.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return sum(history.resident_size() for history in self.log.values())
+
+    def resident_entries(self):
+        """
+        Counts the entries in memory.
+
+        Returns:
+            int: The number of entries.
+        """
+        if self.store is None:
+            return self.sequence - self.discarded
+        return sum(len(history.tags) for history in self.log.values())
+
+    def unreserved_size(self):
+        """
+        Estimates the memory taken by the entries logged since the memory manager was last told how many entries
+        there are, in `maintain`. The checks are spaced apart so as not to cost anything on every step.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return (self.sequence - self.counted) * ENTRY_SIZE
+
+    def memory_size(self):
+        """
+        Estimates the memory taken by the entries in memory from the running counts, without visiting them.
+
+        Returns:
+            int: The size in bytes.
         """
-        current_time = time.time()
-        if current_time - self.last_pruned > retention_time:
-            for var_name in list(self.log.keys()):
-                self.log[var_name] = [val for val in self.log[var_name] if (current_time - val[1]) < retention_time]
-            self.last_pruned = current_time
+        if self.store is None:
+            return self.size()
+        return self.resident + (self.sequence - self.counted) * ENTRY_SIZE
 
     def get_memory_usage(self):
         """
         Calculates the memory usage of the log stack.
 
-        This method computes the total memory usage of the log stack, including the memory
-        used by the log dictionary, variable names, and their stored values.
+        The usage is kept up to date as entries are logged, discarded and moved to the segment log, so this
+        costs constant time however long the history grows. Every entry counts as `ENTRY_SIZE` bytes and every
+        object as its size when it was logged.
 
         Returns:
             float: The total memory usage of the log stack in megabytes (MB).
         """
-        total_size = sys.getsizeof(self.log)
-        for var_name, values in self.log.items():
-            total_size += sys.getsizeof(var_name)
-            for value, _ in values:
-                total_size += sys.getsizeof(value)
-        return total_size / (1024 * 1024)
\ No newline at end of file
+        return self.memory_size() / (1024 * 1024)
@@ -4,53 +4,346 @@
 #
 # Aman Thapa Magar <at719@sussex.ac.uk>
 
+import os
+import sys
+import math
+from src.core.lazyeval import LazyEval
+from src.core.vector import Vector, BITS
+
+# Allocations are rounded up to a multiple of ALIGNMENT bytes. Those of up to SMALL_LIMIT bytes are cells of a
+# size class, carved out of pools of POOL_SIZE bytes, while larger ones are blocks of their own.
+ALIGNMENT = 16
+SMALL_LIMIT = 512
+POOL_SIZE = 4096
+SIZE_CLASSES = SMALL_LIMIT // ALIGNMENT
+# The number of cells of every size class a pool holds.
+POOL_CELLS = tuple(POOL_SIZE // ((index + 1) * ALIGNMENT) for index in range(SIZE_CLASSES))
+# Every lazy value takes the same cell.
+LAZY_SIZE = sys.getsizeof(LazyEval(None, None))
+# The default memory limit in megabytes, and the environment variable overriding it.
+MEMORY_LIMIT = 50
+MEMORY_LIMIT_VARIABLE = 'ULTO_MEMORY_LIMIT'
+# The fraction of the limit past which memory is under pressure. What is left above it is room for the values
+# assigned while the history is relieved.
+PRESSURE = 0.875
+
+
+def resolve_memory_limit(limit_mb=None):
+    """
+    Resolves the memory limit of a program: the given one, else the one set by the environment variable
+    `ULTO_MEMORY_LIMIT`, else `MEMORY_LIMIT`.
+
+    Args:
+    limit_mb (float or str): The memory limit in megabytes, `None` for the default.
+
+    Returns:
+    float: The memory limit in megabytes.
+
+    Raises:
+    ValueError: If the limit is not a positive, finite number.
+    """
+    if limit_mb is None:
+        limit_mb = os.environ.get(MEMORY_LIMIT_VARIABLE) or MEMORY_LIMIT
+    try:
+        limit = float(limit_mb)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid memory limit "{limit_mb}", expected a number of megabytes') from None
+    if not limit > 0:
+        raise ValueError(f'The memory limit must be positive, got {limit_mb}')
+    if not math.isfinite(limit):
+        raise ValueError(f'The memory limit must be finite, got {limit_mb}')
+    return limit
+
+
 class MemoryManager:
     """
-    A class to manage memory allocation with a specified limit.
+    An accounting arena allocator for the values of a running Ulto program, with a memory limit.
 
-    The `MemoryManager` class allows for tracking and limiting memory allocation within a program.
-    It provides methods to allocate and deallocate memory, ensuring that the allocated memory does
-    not exceed a predefined limit. The class also allows querying the currently allocated memory
-    and the remaining available memory.
+    The values themselves live on the Python heap; the manager models how much of it they take, the way a
+    small-object allocator such as pymalloc would lay them out. Every allocation is rounded up to its size
+    class. Small ones are cells carved out of fixed-size pools, one size class per pool: a freed cell goes to
+    the free list of its class and is reused by the next allocation of that size, so integers, lazy values and
+    list chunks, which come in a handful of sizes, cycle through the same cells. A pool is handed back once its
+    class has a pool's worth of free cells. Larger values, such as long strings, are blocks of their own.
+
+    The limit applies to the memory reserved: the pools carved so far and the blocks in use. Going past it raises
+    a `MemoryError`, but before that memory comes under pressure, past a `PRESSURE` fraction of the limit, which
+    the `LogStack` is told of to give up history in stages while the program can still go on, see `LogStack.relieve`.
+
+    Values are tracked deeply with `track` and `release`. A `Vector` is charged for each node of its tree and
+    every value in its leaves, but the nodes it shares with other versions of the list are reference counted
+    and charged once, so logging every version of a growing list costs what the versions really take. A
+    `LazyEval` counts its own holders, and is charged for itself and, once it is evaluated, for its value.
 
     Attributes:
         limit (int): The memory limit in bytes.
-        allocated_memory (int): The total amount of currently allocated memory in bytes.
+        threshold (int): The memory reserved past which memory is under pressure, in bytes.
+        allocated_memory (int): The total amount of currently allocated memory in bytes, cells and blocks in use.
+        reserved (int): The memory taken by the pools and blocks, in bytes, which is kept under the limit.
+        carved (list): The number of cells carved out of pools for every size class.
+        free (list): The number of free cells of every size class, reused before new ones are carved.
+        refs (dict): The number of references to every vector and tree node tracked, by id. A tracked node is held
+                     by a tracked vector, so its id cannot be reused while it is counted here.
+        blocks (dict): The sizes of the blocks reserved by `reserve`, by owner.
+        on_pressure (callable or None): Called whenever memory comes under pressure, to have it relieved as soon as
+                                        it is safe to.
     """
     def __init__(self, limit_mb):
         """
         Initializes the MemoryManager with a memory limit.
 
         Args:
-        limit_mb (int): The memory limit in megabytes.
+        limit_mb (float): The memory limit in megabytes.
+
+        Raises:
+        ValueError: If the limit is not positive and finite.
         """
-        self.limit = limit_mb * 1024 * 1024
+        if not limit_mb > 0:
+            raise ValueError(f'The memory limit must be positive, got {limit_mb}')
+        if not math.isfinite(limit_mb):
+            raise ValueError(f'The memory limit must be finite, got {limit_mb}')
+        self.limit = int(limit_mb * 1024 * 1024)
+        self.threshold = int(self.limit * PRESSURE)
         self.allocated_memory = 0
+        self.reserved = 0
+        self.carved = [0] * SIZE_CLASSES
+        self.free = [0] * SIZE_CLASSES
+        self.refs = {}
+        self.blocks = {}
+        self.on_pressure = None
 
     def allocate(self, size):
         """
-        Allocates the given amount of memory.
+        Allocates the given amount of memory, reusing a free cell of its size class if there is one.
 
         Args:
         size (int): The amount of memory to allocate in bytes.
 
+        Returns:
+        int: The amount of memory allocated, rounded up to its size class.
+
         Raises:
         MemoryError: If the allocation exceeds the memory limit.
         """
-        if self.allocated_memory + size > self.limit:
-            raise MemoryError("Program exceeds the given malloc threshold")
+        if size > SMALL_LIMIT:
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            self.grow(size)
+            self.allocated_memory += size
+            return size
+        index = (size - 1) // ALIGNMENT if size > 0 else 0
+        free = self.free
+        if free[index]:
+            free[index] -= 1
+        else:
+            if not self.carved[index] % POOL_CELLS[index]:
+                self.grow(POOL_SIZE)
+            self.carved[index] += 1
+        size = (index + 1) * ALIGNMENT
         self.allocated_memory += size
+        return size
 
     def deallocate(self, size):
         """
-        Deallocates the given amount of memory.
+        Deallocates the given amount of memory, returning its cell to the free list of its size class.
+
+        Args:
+        size (int): The amount of memory to deallocate in bytes, as given to `allocate`.
+        """
+        if size > SMALL_LIMIT:
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            self.reserved -= size
+            self.allocated_memory -= size
+            return
+        index = (size - 1) // ALIGNMENT if size > 0 else 0
+        self.allocated_memory -= (index + 1) * ALIGNMENT
+        free = self.free
+        free[index] += 1
+        cells = POOL_CELLS[index]
+        if free[index] >= cells:
+            # a pool's worth of free cells is handed back.
+            free[index] -= cells
+            self.carved[index] -= cells
+            self.reserved -= POOL_SIZE
+
+    def grow(self, size):
+        """
+        Reserves more memory for pools or blocks.
+
+        Args:
+        size (int): The amount of memory in bytes.
+
+        Raises:
+        MemoryError: If the memory reserved would exceed the limit.
+        """
+        reserved = self.reserved + size
+        if reserved > self.limit:
+            raise MemoryError(f"Program exceeds the given malloc threshold of {self.limit / (1024 * 1024):g} MB")
+        if self.reserved <= self.threshold < reserved and self.on_pressure is not None:
+            self.on_pressure()
+        self.reserved = reserved
+
+    def reserve(self, owner, size):
+        """
+        Sets the size of the block of memory held by an owner, such as the entries of the `LogStack`.
+
+        Args:
+        owner (Any): The owner of the block.
+        size (int): The new size of the block in bytes, 0 to free it.
+
+        Raises:
+        MemoryError: If a larger block exceeds the memory limit.
+        """
+        growth = size - self.blocks.get(owner, 0)
+        if growth > 0:
+            self.grow(growth)
+        else:
+            self.reserved += growth
+        self.allocated_memory += growth
+        if size:
+            self.blocks[owner] = size
+        else:
+            self.blocks.pop(owner, None)
+
+    def track(self, value):
+        """
+        Charges a value held by a variable or the history, together with the values it holds.
+
+        Args:
+        value (Any): The value.
+
+        Returns:
+        int: The memory newly allocated for it in bytes, 0 if it was already tracked.
+
+        Raises:
+        MemoryError: If the value exceeds the memory limit.
+        """
+        kind = type(value)
+        if kind is LazyEval:
+            holders = value.holders
+            value.holders = holders + 1
+            if holders:
+                return 0
+            value.tracker = self
+            size = self.allocate(LAZY_SIZE)
+            if value.evaluated:
+                size += self.track(value.value)
+            return size
+        if kind is Vector:
+            refs = self.refs
+            count = refs.get(id(value), 0)
+            refs[id(value)] = count + 1
+            if count:
+                return 0
+            return (self.allocate(sys.getsizeof(value)) + self.track_node(value.root, value.shift)
+                    + self.track_node(value.tail, 0))
+        if value is None:
+            return 0
+        size = sys.getsizeof(value)
+        if size <= SMALL_LIMIT:
+            # the common case of a cell reused from the free list, inlined as it runs on every assignment.
+            index = (size - 1) // ALIGNMENT
+            free = self.free
+            if free[index]:
+                free[index] -= 1
+                size = (index + 1) * ALIGNMENT
+                self.allocated_memory += size
+                return size
+        return self.allocate(size)
+
+    def track_node(self, node, shift):
+        """
+        Charges a node of a `Vector` and everything below it, unless it is shared with a vector already tracked.
+
+        Args:
+        node (list): The node.
+        shift (int): The shift of the node, 0 for a leaf.
+
+        Returns:
+        int: The memory newly allocated in bytes.
+        """
+        refs = self.refs
+        count = refs.get(id(node), 0)
+        refs[id(node)] = count + 1
+        if count:
+            return 0
+        size = self.allocate(sys.getsizeof(node))
+        if shift:
+            for child in node:
+                size += self.track_node(child, shift - BITS)
+        else:
+            for value in node:
+                size += self.track(value)
+        return size
+
+    def track_evaluated(self, value):
+        """
+        Charges the value a tracked `LazyEval` has just been evaluated to.
+
+        Args:
+        value (LazyEval): The lazy value.
+        """
+        self.track(value.value)
+
+    def release(self, value):
+        """
+        Releases a value charged by `track`, freeing what no other tracked value shares.
+
+        Args:
+        value (Any): The value.
+        """
+        kind = type(value)
+        if kind is LazyEval:
+            holders = value.holders - 1
+            value.holders = holders
+            if holders:
+                return
+            value.tracker = None
+            self.deallocate(LAZY_SIZE)
+            if value.evaluated:
+                self.release(value.value)
+        elif kind is Vector:
+            if self.unref(value):
+                self.deallocate(sys.getsizeof(value))
+                self.release_node(value.root, value.shift)
+                self.release_node(value.tail, 0)
+        elif value is not None:
+            self.deallocate(sys.getsizeof(value))
+
+    def release_node(self, node, shift):
+        """
+        Releases a node of a `Vector` charged by `track_node`.
+
+        Args:
+        node (list): The node.
+        shift (int): The shift of the node, 0 for a leaf.
+        """
+        if not self.unref(node):
+            return
+        self.deallocate(sys.getsizeof(node))
+        if shift:
+            for child in node:
+                self.release_node(child, shift - BITS)
+        else:
+            for value in node:
+                self.release(value)
+
+    def unref(self, value):
+        """
+        Drops a reference to a vector or a node.
 
         Args:
-        size (int): The amount of memory to deallocate in bytes.
+        value (Vector or list): The vector or node.
+
+        Returns:
+        bool: Whether it was the last one.
         """
-        self.allocated_memory -= size
-        if self.allocated_memory < 0:
-            self.allocated_memory = 0
+        refs = self.refs
+        count = refs[id(value)] - 1
+        if count:
+            refs[id(value)] = count
+            return False
+        del refs[id(value)]
+        return True
 
     def get_allocated_memory(self):
         """
@@ -68,4 +361,25 @@ class MemoryManager:
         Returns:
         int: The remaining memory in bytes.
         """
-        return self.limit - self.allocated_memory
\ No newline at end of file
+        return self.limit - self.reserved
+
+    def get_headroom(self):
+        """
+        Returns the memory left before memory comes under pressure.
+
+        Returns:
+        int: The headroom in bytes, negative if memory is under pressure.
+        """
+        return self.threshold - self.reserved
+
+    def under_pressure(self, growth=0):
+        """
+        Tells whether the memory reserved is past the pressure threshold.
+
+        Args:
+        growth (int): Memory about to be reserved, in bytes, counted as reserved already.
+
+        Returns:
+        bool: Whether memory is under pressure.
+        """
+        return self.reserved + growth > self.threshold
@@ -0,0 +1,181 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# profiler.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+# Number of iterations a loop counts on its own before they are added up and its hotness is checked, so counting
+# costs a single increment per iteration.
+BATCH = 256
+
+# Number of iterations, over every time a loop is entered, past which it is hot and promoted to a faster tier by
+# the engines that have one.
+HOT_LOOP = 1024
+
+# Number of loops and statements listed in the execution log, hottest first.
+REPORT_SIZE = 10
+
+
+class LoopSite:
+    """
+    The runtime counters of a loop of the program.
+
+    Attributes:
+        kind (str): 'while' or 'for'.
+        node (While or For): The loop node.
+        line (int or None): The source line of the loop.
+        entries (int): The number of times the loop was entered.
+        iterations (int): The number of iterations added up so far, each a jump back to the start of the loop.
+        ticks (int): The number of iterations counted since they were last added up.
+        promoted (int or None): The number of iterations when the loop was promoted to a faster tier.
+        tier (callable or None): The faster version of the loop it was promoted to.
+        head (int): Where the loop starts in the instruction stream of the virtual machine.
+        exit (int): Where the virtual machine goes on once the faster version of the loop has run.
+    """
+    __slots__ = ('kind', 'node', 'line', 'entries', 'iterations', 'ticks', 'promoted', 'tier', 'head', 'exit')
+
+    def __init__(self, node):
+        self.kind = node.tag.name.lower()
+        self.node = node
+        self.line = node.line
+        self.entries = 0
+        self.iterations = 0
+        self.ticks = 0
+        self.promoted = None
+        self.tier = None
+        self.head = 0
+        self.exit = 0
+
+    def count(self):
+        """
+        Returns the number of iterations, counting those not added up yet.
+
+        Returns:
+        int: The number of iterations.
+        """
+        return self.iterations + self.ticks
+
+
+class StatementSite:
+    """
+    The runtime counters of a top-level statement of the program.
+
+    Attributes:
+        kind (str): The statement type, e.g. 'assign'.
+        line (int or None): The source line of the statement.
+        runs (int): The number of times it ran.
+        time (float): The time spent running it, loops and pruning the LogStack included, in seconds.
+    """
+    __slots__ = ('kind', 'line', 'runs', 'time')
+
+    def __init__(self, node):
+        self.kind = node.tag.name.lower()
+        self.line = node.line
+        self.runs = 0
+        self.time = 0.0
+
+    def record(self, elapsed):
+        """
+        Records a run of the statement.
+
+        Args:
+        elapsed (float): The time it took in seconds.
+        """
+        self.runs += 1
+        self.time += elapsed
+
+
+class Profiler:
+    """
+    Counts, while a program runs, how often its loops iterate and how long its top-level statements take.
+
+    Loops count their iterations on the jump back to their start. To keep that cheap, the counts are kept in the
+    loop's `LoopSite` and only added up every `BATCH` iterations, when the engine checks whether the loop has
+    become hot, see `flush`, and the virtual machine promotes hot loops to compiled closures. The counters are
+    written to the execution log, see `report`.
+
+    Attributes:
+        batch (int): The number of iterations counted between checks.
+        hot (int): The number of iterations past which a loop is hot.
+        loops (dict): The site of every loop, by node.
+        statements (dict): The site of every top-level statement, by node.
+    """
+    def __init__(self, batch=BATCH, hot=HOT_LOOP):
+        """
+        Creates a profiler with no sites.
+
+        Args:
+        batch (int): The number of iterations counted between checks.
+        hot (int): The number of iterations past which a loop is hot.
+        """
+        self.batch = batch
+        self.hot = hot
+        self.loops = {}
+        self.statements = {}
+
+    def loop(self, node):
+        """
+        Returns the site of a loop, created on first use, so both tiers of a loop count on the same site.
+
+        Args:
+        node (While or For): The loop node.
+
+        Returns:
+        LoopSite: The site.
+        """
+        site = self.loops.get(node)
+        if site is None:
+            site = self.loops[node] = LoopSite(node)
+        return site
+
+    def statement(self, node):
+        """
+        Returns the site of a top-level statement, created on first use.
+
+        Args:
+        node (Node): The statement node.
+
+        Returns:
+        StatementSite: The site.
+        """
+        site = self.statements.get(node)
+        if site is None:
+            site = self.statements[node] = StatementSite(node)
+        return site
+
+    def flush(self, site):
+        """
+        Adds up the iterations a loop counted since the last time.
+
+        Args:
+        site (LoopSite): The site of the loop.
+
+        Returns:
+        bool: Whether the loop has just become hot and is to be promoted.
+        """
+        site.iterations += site.ticks
+        site.ticks = 0
+        return site.tier is None and site.iterations >= self.hot
+
+    def report(self, limit=REPORT_SIZE):
+        """
+        Describes the hottest loops and the slowest top-level statements.
+
+        Args:
+        limit (int): The maximum number of loops and of statements described.
+
+        Returns:
+        list: One line per loop or statement, empty if nothing ran.
+        """
+        lines = []
+        loops = sorted((site for site in self.loops.values() if site.entries), key=LoopSite.count, reverse=True)
+        for site in loops[:limit]:
+            line = f"{site.kind} loop at line {site.line}: {site.count()} iterations in {site.entries} entries"
+            if site.promoted is not None:
+                line += f", promoted after {site.promoted} iterations"
+            lines.append(line)
+        statements = sorted((site for site in self.statements.values() if site.runs), key=lambda site: site.time,
+                            reverse=True)
+        for site in statements[:limit]:
+            lines.append(f"{site.kind} statement at line {site.line}: {site.time:.6f} seconds")
+        return lines
@@ -0,0 +1,150 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# retention.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+import sys
+import math
+
+# Number of steps after which a policy that never discards anything needs checking again.
+NEVER = sys.maxsize
+
+# Minimum number of entries a policy discards at once, so discarding costs amortised constant time per step.
+MIN_BATCH = 64
+
+
+class RetentionPolicy:
+    """
+    Decides how much history the `LogStack` keeps, either for the whole program or for a single variable.
+
+    A policy is given the size of the history it governs: for the whole program, the number of steps in the
+    journal and the estimated size of all histories; for a variable, the number of entries in its history and
+    their estimated size. It answers how many of the oldest steps or entries must be discarded, and how many
+    steps can be made before it needs to be asked again, so that the `LogStack` only checks its policies once
+    in a while. Policies discard in batches, leaving room for several more steps, as every discard costs time
+    in proportion to what is kept.
+
+    The base class keeps everything.
+    """
+    def excess(self, entries, size):
+        """
+        Returns how many of the oldest steps or entries must be discarded.
+
+        Args:
+        entries (int): The number of steps or entries kept.
+        size (int): Their estimated size in bytes.
+
+        Returns:
+        int: The number to discard, 0 if the history is within the policy.
+        """
+        return 0
+
+    def steps_left(self, entries, size, entry_size):
+        """
+        Returns how many steps can be made before the history may exceed the policy.
+
+        Args:
+        entries (int): The number of steps or entries kept.
+        size (int): Their estimated size in bytes.
+        entry_size (int): The size each step adds at least, in bytes.
+
+        Returns:
+        int: The number of steps.
+        """
+        return NEVER
+
+    def __str__(self):
+        return 'all'
+
+
+class KeepAll(RetentionPolicy):
+    """
+    Keeps the whole history, the default.
+    """
+
+
+class KeepLast(RetentionPolicy):
+    """
+    Keeps the last `count` versions: the last steps of the journal for the whole program, or the last entries of
+    the history of a variable. Up to `count` more are kept until they are discarded in one batch.
+
+    Attributes:
+        count (int): The number of versions always kept.
+        batch (int): The number of extra versions discarded at once.
+    """
+    def __init__(self, count):
+        """
+        Creates the policy.
+
+        Args:
+        count (int): The number of versions to keep.
+        """
+        if count < 0:
+            raise ValueError(f'The number of versions to keep must not be negative, got {count}')
+        self.count = count
+        self.batch = max(count, MIN_BATCH)
+
+    def excess(self, entries, size):
+        return entries - self.count if entries >= self.count + self.batch else 0
+
+    def steps_left(self, entries, size, entry_size):
+        return max(1, self.count + self.batch - entries)
+
+    def __str__(self):
+        return f'last:{self.count}'
+
+
+class KeepUnder(RetentionPolicy):
+    """
+    Keeps the history under a size: once it is estimated to take more, its oldest half is discarded.
+
+    Attributes:
+        megabytes (float): The size limit in megabytes.
+        limit (int): The size limit in bytes.
+    """
+    def __init__(self, megabytes):
+        """
+        Creates the policy.
+
+        Args:
+        megabytes (float): The size limit in megabytes.
+        """
+        if not math.isfinite(megabytes) or megabytes <= 0:
+            raise ValueError(f'The history size limit must be a positive, finite number, got {megabytes}')
+        self.megabytes = megabytes
+        self.limit = int(megabytes * 1024 * 1024)
+
+    def excess(self, entries, size):
+        if size <= self.limit:
+            return 0
+        return max(1, entries - entries * self.limit // (2 * size))
+
+    def steps_left(self, entries, size, entry_size):
+        return max(1, (self.limit - size) // entry_size + 1)
+
+    def __str__(self):
+        return f'under:{self.megabytes:g}'
+
+
+def parse_policy(spec):
+    """
+    Parses a retention policy: 'all', 'last:N' for the last N versions, or 'under:MB' for at most MB megabytes.
+
+    Args:
+    spec (str): The policy.
+
+    Returns:
+    RetentionPolicy: The policy.
+    """
+    kind, _, argument = spec.partition(':')
+    if kind == 'all' and not argument:
+        return KeepAll()
+    if kind == 'last' and argument.isdigit():
+        return KeepLast(int(argument))
+    if kind == 'under':
+        try:
+            return KeepUnder(float(argument))
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid retention policy "{spec}", expected all, last:N or under:MB')
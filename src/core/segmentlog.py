@@ -0,0 +1,199 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# segmentlog.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+import mmap
+import pickle
+import tempfile
+from array import array
+from collections import OrderedDict
+
+# Number of segments read back from the file that are kept decoded, most recently used first.
+CACHE_SIZE = 64
+
+
+class Segment:
+    """
+    A run of consecutive entries of a `History` moved to a `SegmentLog`.
+
+    Attributes:
+        position (int): The position of the first entry, counting discarded entries.
+        count (int): The number of entries.
+        values (int): The offset of the value column of the entries in the file.
+        tags (int): The offset of the tag column.
+        tops (int): The offset of the column of undo stack tops.
+        objects (int): The offset of the pickled object column, -1 if the entries have no objects.
+        length (int): The size of the pickled object column in bytes.
+        object_base (int): The position of the first object of the segment in the history's object column.
+        resident (dict): The objects that cannot be written to the file, such as unevaluated `LazyEval` values,
+                         by their index in the segment. They stay in memory.
+        size (int): The size the objects took in memory, in bytes.
+    """
+    __slots__ = ('position', 'count', 'values', 'tags', 'tops', 'objects', 'length', 'object_base', 'resident',
+                 'size')
+
+    def __init__(self, position, count, values, tags, tops, objects=-1, length=0, object_base=0, resident=None,
+                 size=0):
+        self.position = position
+        self.count = count
+        self.values = values
+        self.tags = tags
+        self.tops = tops
+        self.objects = objects
+        self.length = length
+        self.object_base = object_base
+        self.resident = resident
+        self.size = size
+
+
+class SegmentLog:
+    """
+    An append-only binary file holding the segments of history a `LogStack` moves out of memory.
+
+    Typed columns are written as their raw bytes and other values are pickled. The file is never rewritten:
+    it is read back through a read-only `mmap`, which is remapped whenever a read reaches past its end, and
+    the columns decoded from it are kept in a small cache, as `rev`, `revtrace` and `rewind` tend to read
+    neighbouring entries. Space used by discarded segments is only reclaimed when the log is closed.
+
+    Attributes:
+        file (file): The file, a temporary file deleted once closed unless a path is given.
+        size (int): The number of bytes written.
+        map (mmap or None): The read-only mapping of the file, created on the first read.
+        cache (OrderedDict): The decoded columns by offset, least recently used first.
+        cache_size (int): The maximum number of decoded columns kept.
+    """
+    def __init__(self, path=None, cache_size=CACHE_SIZE):
+        """
+        Creates an empty segment log.
+
+        Args:
+        path (str): The path of the file, truncated if it exists. `None` creates a temporary file.
+        cache_size (int): The maximum number of decoded columns kept in memory.
+        """
+        self.file = open(path, 'w+b') if path is not None else tempfile.TemporaryFile(prefix='ulto-history-')
+        self.size = 0
+        self.map = None
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def write(self, data):
+        """
+        Appends bytes to the file.
+
+        Args:
+        data (bytes): The bytes.
+
+        Returns:
+        int: The offset they were written at.
+        """
+        offset = self.size
+        self.file.write(data)
+        self.size += len(data)
+        return offset
+
+    def write_array(self, values):
+        """
+        Appends a typed column to the file.
+
+        Args:
+        values (array): The column.
+
+        Returns:
+        int: The offset it was written at.
+        """
+        return self.write(values.tobytes())
+
+    def write_objects(self, objects):
+        """
+        Appends a list of values to the file.
+
+        Args:
+        objects (list): The values, which must be picklable.
+
+        Returns:
+        tuple: The offset they were written at and the number of bytes written.
+        """
+        data = pickle.dumps(objects, pickle.HIGHEST_PROTOCOL)
+        return self.write(data), len(data)
+
+    def read(self, offset, length):
+        """
+        Reads bytes back through the mapping of the file.
+
+        Args:
+        offset (int): The offset of the bytes.
+        length (int): The number of bytes.
+
+        Returns:
+        bytes: The bytes.
+        """
+        if self.map is None or len(self.map) < offset + length:
+            self.file.flush()
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    def cached(self, offset, decode):
+        """
+        Returns a decoded column, decoding it on a cache miss.
+
+        Args:
+        offset (int): The offset of the column.
+        decode (callable): Reads and decodes the column.
+
+        Returns:
+        Any: The decoded column.
+        """
+        cache = self.cache
+        column = cache.get(offset)
+        if column is None:
+            column = cache[offset] = decode()
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(offset)
+        return column
+
+    def read_array(self, typecode, offset, count):
+        """
+        Reads a typed column back.
+
+        Args:
+        typecode (str): The type code of the column.
+        offset (int): The offset of the column.
+        count (int): The number of items in the column.
+
+        Returns:
+        array: The column, which must not be modified.
+        """
+        def decode():
+            column = array(typecode)
+            column.frombytes(self.read(offset, count * column.itemsize))
+            return column
+        return self.cached(offset, decode)
+
+    def read_objects(self, offset, length):
+        """
+        Reads a list of values back.
+
+        Args:
+        offset (int): The offset of the list.
+        length (int): The number of bytes it takes.
+
+        Returns:
+        list: The values, which must not be modified.
+        """
+        return self.cached(offset, lambda: pickle.loads(self.read(offset, length)))
+
+    def close(self):
+        """
+        Closes the file, deleting it if it is temporary.
+        """
+        self.cache.clear()
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
@@ -0,0 +1,216 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# vector.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+import functools
+import operator
+from itertools import chain
+
+# Every node of the tree has up to WIDTH children; an index is split into BITS-bit digits, one per level.
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+
+def new_path(shift, leaf):
+    """
+    Builds the chain of single-child nodes leading from a level down to a leaf.
+
+    Args:
+    shift (int): The shift of the topmost node, 0 for the leaf itself.
+    leaf (list): The leaf.
+
+    Returns:
+    list: The topmost node.
+    """
+    node = leaf
+    while shift:
+        node = [node]
+        shift -= BITS
+    return node
+
+
+def push_leaf(node, shift, leaf, size):
+    """
+    Adds a leaf after the last one below a node, copying only the nodes on the path to it.
+
+    Args:
+    node (list): The node, which is not modified.
+    shift (int): The shift of the node.
+    leaf (list): The leaf to add.
+    size (int): The number of values stored below the node.
+
+    Returns:
+    list: The copy of the node holding the leaf.
+    """
+    node = node[:]
+    if shift == BITS:
+        node.append(leaf)
+        return node
+    child = (size >> shift) & MASK
+    if child < len(node):
+        node[child] = push_leaf(node[child], shift - BITS, leaf, size)
+    else:
+        node.append(new_path(shift - BITS, leaf))
+    return node
+
+
+@functools.total_ordering
+class Vector:
+    """
+    An immutable list with structural sharing, the runtime representation of Ulto lists.
+
+    The values are kept in a tree of nodes with up to 32 children each, in leaves of 32 values, with the last
+    values in a separate tail. Appending copies the tail, or the path from the root to the new leaf, and shares
+    every other node with the original list, so `factors = factors + [i]` costs O(log n) time and memory instead
+    of a copy of the whole list. The versions of a list kept by the `LogStack` therefore share all but their
+    last few values. Indexing walks at most a handful of levels, and iteration runs over whole leaves.
+
+    Vectors behave like Python lists for the operations Ulto has: indexing, `len`, iteration, concatenation,
+    repetition, comparisons and printing.
+
+    Attributes:
+        count (int): The number of values.
+        shift (int): The shift of the root node, BITS times the number of levels above the leaves.
+        root (list): The root node of the tree, holding all values but the tail.
+        tail (list): The last values, up to 32.
+    """
+    __slots__ = ('count', 'shift', 'root', 'tail')
+    __hash__ = None
+
+    def __init__(self, values=()):
+        """
+        Initializes a vector holding the given values.
+
+        Args:
+        values (iterable): The values.
+        """
+        self.count = 0
+        self.shift = BITS
+        self.root = []
+        self.tail = []
+        if values:
+            self.append_all(values)
+
+    def append_all(self, values):
+        """
+        Appends values to a vector that is not shared yet. Only the tail is modified in place: full tails are
+        pushed into the tree by path copying.
+
+        Args:
+        values (iterable): The values.
+        """
+        tail = self.tail
+        for value in values:
+            if len(tail) == WIDTH:
+                self.push_tail(tail)
+                tail = self.tail = []
+            tail.append(value)
+            self.count += 1
+
+    def push_tail(self, leaf):
+        """
+        Moves a full tail into the tree, growing it by a level when the root is full.
+
+        Args:
+        leaf (list): The tail.
+        """
+        size = self.count - WIDTH
+        if size == 1 << (self.shift + BITS):
+            self.root = [self.root, new_path(self.shift, leaf)]
+            self.shift += BITS
+        else:
+            self.root = push_leaf(self.root, self.shift, leaf, size)
+
+    def extend(self, values):
+        """
+        Returns a new vector with values appended, sharing the tree of this one.
+
+        Args:
+        values (iterable): The values.
+
+        Returns:
+        Vector: The new vector.
+        """
+        result = Vector.__new__(Vector)
+        result.count = self.count
+        result.shift = self.shift
+        result.root = self.root
+        result.tail = self.tail[:]
+        result.append_all(values)
+        return result
+
+    def leaves(self):
+        """
+        Yields the leaves of the tree in order, followed by the tail.
+
+        Returns:
+        generator: The lists of values.
+        """
+        nodes = [self.root]
+        for _ in range(self.shift // BITS - 1):
+            nodes = [child for node in nodes for child in node]
+        for node in nodes:
+            yield from node
+        yield self.tail
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return chain.from_iterable(self.leaves())
+
+    def __getitem__(self, index):
+        if type(index) is not int:
+            if isinstance(index, slice):
+                return Vector(list(self)[index])
+            try:
+                index = operator.index(index)
+            except TypeError:
+                raise TypeError(f'list indices must be integers or slices, not {type(index).__name__}') from None
+        count = self.count
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError('list index out of range')
+        tail_offset = count - len(self.tail)
+        if index >= tail_offset:
+            return self.tail[index - tail_offset]
+        node = self.root
+        shift = self.shift
+        while shift:
+            node = node[(index >> shift) & MASK]
+            shift -= BITS
+        return node[index & MASK]
+
+    def __add__(self, other):
+        if isinstance(other, (Vector, list)):
+            return self.extend(other)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, list):
+            return Vector(chain(other, self))
+        return NotImplemented
+
+    def __mul__(self, times):
+        if not isinstance(times, int):
+            return NotImplemented
+        return Vector(chain.from_iterable([self] * times))
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        if isinstance(other, (Vector, list)):
+            return len(self) == len(other) and all(map(operator.eq, self, other))
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, (Vector, list)):
+            return tuple(self) < tuple(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"[{', '.join(map(repr, self))}]"
@@ -0,0 +1,387 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# dataflow.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+from src.core.lazyeval import scan_inputs
+from src.nodes import NodeType
+
+# Reads of a value are counted up to MANY: a value read that often, or read on every iteration of a loop, is
+# needed anyway and computed at once.
+MANY = 2
+
+# The reads of a value nothing reads: none, and none certain.
+UNREAD = (0, False)
+
+# A loop body is analysed until the reads flowing around the loop settle, at most this many times.
+MAX_PASSES = 8
+
+
+def read_names(expr):
+    """
+    Collects the variables an expression reads.
+
+    Args:
+    expr (Node): The expression, or a `Range`.
+
+    Returns:
+    list: The variable names, each once.
+    """
+    names = []
+    if expr.tag == NodeType.RANGE:
+        for bound in (expr.start, expr.end, expr.step):
+            if bound is not None:
+                scan_inputs(bound, names)
+    else:
+        scan_inputs(expr, names)
+    return names
+
+
+def add_reads(state, names, certain):
+    """
+    Adds a read of each of the given variables.
+
+    Args:
+    state (dict): The reads of the variables, as `(count, certain)` by name.
+    names (list): The variables read.
+    certain (bool): Whether the values are certainly read, rather than only possibly.
+
+    Returns:
+    dict: The new reads.
+    """
+    state = dict(state)
+    for name in names:
+        count, was_certain = state.get(name, UNREAD)
+        state[name] = (min(count + 1, MANY), was_certain or certain)
+    return state
+
+
+def merge(first, second):
+    """
+    Merges the reads of two paths the program may take: a value is read as many times as on the path reading it
+    most, and certainly read only if it is on both.
+
+    Args:
+    first (dict): The reads along one path.
+    second (dict): The reads along the other.
+
+    Returns:
+    dict: The merged reads.
+    """
+    state = {}
+    for name in first.keys() | second.keys():
+        count, certain = first.get(name, UNREAD)
+        other_count, other_certain = second.get(name, UNREAD)
+        state[name] = (max(count, other_count), certain and other_certain)
+    return state
+
+
+def uses_variable(statements, var_name):
+    """
+    Checks whether statements use a variable by name: read it, assign it, reverse it or trace it. `rewind`
+    counts as a use, as it may restore any variable.
+
+    Args:
+    statements (list): The statements.
+    var_name (str): The variable name.
+
+    Returns:
+    bool: True if the variable is used.
+    """
+    for node in statements:
+        tag = node.tag
+        if tag == NodeType.ASSIGN or tag == NodeType.COMPOUND_ASSIGN:
+            if node.name == var_name or var_name in read_names(node.value):
+                return True
+        elif tag == NodeType.REVERSE:
+            if node.name == var_name:
+                return True
+        elif tag == NodeType.REVTRACE:
+            if node.name == var_name or var_name in read_names(node.index):
+                return True
+        elif tag == NodeType.REWIND:
+            return True
+        elif tag == NodeType.PRINT:
+            if any(var_name in read_names(value) for value in node.values):
+                return True
+        elif tag == NodeType.IF:
+            if (var_name in read_names(node.condition) or uses_variable(node.body, var_name)
+                    or uses_variable(node.orelse, var_name)):
+                return True
+            for condition, body in node.elifs:
+                if var_name in read_names(condition) or uses_variable(body, var_name):
+                    return True
+        elif tag == NodeType.WHILE:
+            if var_name in read_names(node.condition) or uses_variable(node.body, var_name):
+                return True
+        elif tag == NodeType.FOR:
+            if (node.target == var_name or var_name in read_names(node.iterable)
+                    or uses_variable(node.body, var_name)):
+                return True
+    return False
+
+
+class DataFlowAnalyser:
+    """
+    A def-use analysis deciding, for every assignment of an Ulto program, whether its value is computed eagerly.
+
+    The program is walked backwards, tracking for every variable how its current value is read by the rest of
+    the program: how many times, up to `MANY`, and whether it is certainly read. An assignment defines a new
+    value, so the reads seen after it are the reads of the value it assigns. It is marked eager, in its `eager`
+    attribute, if its expression reads the variable it assigns, as `i = i + 1` does, since the thunks would
+    chain one another; or if its value is certainly read, or read `MANY` times, since the thunk would be forced
+    anyway. Other values are left to a `LazySite`: those nothing reads, and those only read on some paths.
+
+    Loops are analysed until the reads flowing from the end of their body back to its start settle, so a value
+    read on the next iteration counts as read, and every read in a loop body counts `MANY` times for the values
+    assigned before the loop. A value assigned in a loop and only read after it is read once, and not
+    certainly, as only the last iteration's value is. The reads of the value of a copy, `b = a`, are credited
+    to the value copied, which it shares. `rev` and `rewind` are treated as neither reading nor writing.
+
+    Attributes:
+        ast (list): The abstract syntax tree to be annotated.
+        exits (list): The reads after every loop enclosing the statement being analysed, innermost last, which
+                      is where a `break` goes on.
+        heads (list): The reads at the start of the next iteration of every loop enclosing the statement being
+                      analysed, innermost last, which is where a `continue` goes on.
+        statement_analysers (dict): Maps statement node types to the method analysing them.
+    """
+    def __init__(self, ast):
+        """
+        Initializes the DataFlowAnalyser with the given AST.
+
+        Args:
+        ast (list): The abstract syntax tree.
+        """
+        self.ast = ast
+        self.exits = []
+        self.heads = []
+        self.statement_analysers = {
+            NodeType.ASSIGN: self.analyse_assignment,
+            NodeType.COMPOUND_ASSIGN: self.analyse_compound_assignment,
+            NodeType.REVERSE: self.analyse_reverse,
+            NodeType.REVTRACE: self.analyse_revtrace,
+            NodeType.REWIND: self.analyse_rewind,
+            NodeType.IF: self.analyse_if,
+            NodeType.FOR: self.analyse_for,
+            NodeType.WHILE: self.analyse_while,
+            NodeType.PRINT: self.analyse_print,
+            NodeType.BREAK: self.analyse_break,
+            NodeType.CONTINUE: self.analyse_continue,
+        }
+
+    def analyse(self):
+        """
+        Annotates every assignment of the AST with whether it is eager.
+        """
+        self.analyse_block(self.ast, {})
+
+    def analyse_block(self, statements, after):
+        """
+        Analyses a list of statements.
+
+        Args:
+        statements (list): The statements.
+        after (dict): The reads of the variables after the statements.
+
+        Returns:
+        dict: The reads of the variables before the statements.
+        """
+        state = after
+        for node in reversed(statements):
+            state = self.statement_analysers[node.tag](node, state)
+        return state
+
+    def analyse_assignment(self, node, after):
+        """
+        Analyses an assignment, deciding whether it is eager.
+
+        Args:
+        node (Assign): The assignment node.
+        after (dict): The reads of the variables after it.
+
+        Returns:
+        dict: The reads of the variables before it.
+        """
+        var_name, value = node.name, node.value
+        reads = after.get(var_name, UNREAD)
+        before = dict(after)
+        before.pop(var_name, None)
+        if value.tag == NodeType.NAME:
+            # the copy shares the value it copies, whose reads it adds to.
+            node.eager = False
+            count, certain = before.get(value.id, UNREAD)
+            before[value.id] = (min(count + reads[0], MANY), certain or reads[1])
+            return before
+        names = read_names(value)
+        count, certain = reads
+        node.eager = var_name in names or certain or count >= MANY
+        return add_reads(before, names, node.eager)
+
+    def analyse_compound_assignment(self, node, after):
+        """
+        Analyses a compound assignment, which reads the variable it assigns.
+
+        Args:
+        node (CompoundAssign): The compound assignment node.
+        after (dict): The reads of the variables after it.
+
+        Returns:
+        dict: The reads of the variables before it.
+        """
+        before = dict(after)
+        before.pop(node.name, None)
+        return add_reads(before, [node.name] + read_names(node.value), True)
+
+    def analyse_reverse(self, node, after):
+        """
+        Analyses a reverse node.
+
+        Args:
+        node (Reverse): The reverse node.
+        after (dict): The reads of the variables after it.
+
+        Returns:
+        dict: The reads of the variables before it.
+        """
+        return after
+
+    def analyse_revtrace(self, node, after):
+        """
+        Analyses a revtrace node.
+
+        Args:
+        node (Revtrace): The revtrace node.
+        after (dict): The reads of the variables after it.
+
+        Returns:
+        dict: The reads of the variables before it.
+        """
+        return add_reads(after, read_names(node.index), True)
+
+    def analyse_rewind(self, node, after):
+        """
+        Analyses a rewind node.
+
+        Args:
+        node (Rewind): The rewind node.
+        after (dict): The reads of the variables after it.
+
+        Returns:
+        dict: The reads of the variables before it.
+        """
+        return add_reads(after, read_names(node.steps), True)
+
+    def analyse_print(self, node, after):
+        """
+        Analyses a print node.
+
+        Args:
+        node (Print): The print node.
+        after (dict): The reads of the variables after it.
+
+        Returns:
+        dict: The reads of the variables before it.
+        """
+        names = []
+        for value in node.values:
+            scan_inputs(value, names)
+        return add_reads(after, names, True)
+
+    def analyse_break(self, node, after):
+        """
+        Analyses a break statement, which goes on after the innermost loop.
+
+        Args:
+        node (Break): The break node.
+        after (dict): The reads of the variables after it, unreachable.
+
+        Returns:
+        dict: The reads of the variables after the loop.
+        """
+        return self.exits[-1]
+
+    def analyse_continue(self, node, after):
+        """
+        Analyses a continue statement, which goes on with the next iteration of the innermost loop.
+
+        Args:
+        node (Continue): The continue node.
+        after (dict): The reads of the variables after it, unreachable.
+
+        Returns:
+        dict: The reads of the variables at the start of the next iteration.
+        """
+        return self.heads[-1]
+
+    def analyse_if(self, node, after):
+        """
+        Analyses an if node together with its elif and else branches.
+
+        Args:
+        node (If): The if node.
+        after (dict): The reads of the variables after it.
+
+        Returns:
+        dict: The reads of the variables before it.
+        """
+        state = self.analyse_block(node.orelse, after)
+        for condition, body in reversed(node.elifs):
+            state = add_reads(merge(self.analyse_block(body, after), state), read_names(condition), True)
+        return add_reads(merge(self.analyse_block(node.body, after), state), read_names(node.condition), True)
+
+    def analyse_while(self, node, after):
+        """
+        Analyses a while node. The condition is read before every iteration and once more when the loop ends.
+
+        Args:
+        node (While): The while node.
+        after (dict): The reads of the variables after it.
+
+        Returns:
+        dict: The reads of the variables before it.
+        """
+        names = read_names(node.condition)
+        head = add_reads(after, names, True)
+        self.exits.append(after)
+        self.heads.append(head)
+        try:
+            for _ in range(MAX_PASSES):
+                self.heads[-1] = head
+                state = add_reads(merge(self.analyse_block(node.body, head), after), names, True)
+                if state == head:
+                    break
+                head = state
+        finally:
+            self.exits.pop()
+            self.heads.pop()
+        return head
+
+    def analyse_for(self, node, after):
+        """
+        Analyses a for loop. The iterable is read once, and the loop variable assigned before every iteration.
+
+        Args:
+        node (For): The for loop node.
+        after (dict): The reads of the variables after it.
+
+        Returns:
+        dict: The reads of the variables before it.
+        """
+        head = after
+        self.exits.append(after)
+        self.heads.append(head)
+        try:
+            for _ in range(MAX_PASSES):
+                self.heads[-1] = head
+                body = dict(self.analyse_block(node.body, head))
+                body.pop(node.target, None)
+                state = merge(body, after)
+                if state == head:
+                    break
+                head = state
+        finally:
+            self.exits.pop()
+            self.heads.pop()
+        return add_reads(head, read_names(node.iterable), True)
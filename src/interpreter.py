@@ -4,21 +4,25 @@
 #
 # Aman Thapa Magar <at719@sussex.ac.uk>
 
-import os
 import sys
+import math
 import time
 import threading
-import ctypes
-import platform
 from datetime import datetime
-from src.core.malloc import MemoryManager
-from src.core.lazyeval import LazyEval
-from src.core.logstack import LogStack
 from sortedcontainers import SortedDict
+from src.compiler import Compiler
+from src.dataflow import DataFlowAnalyser
+from src.core.frame import Frame
+from src.nodes import Node
+from src.core.kernel import ArithmeticKernel, OPERATORS
+from src.core.malloc import MemoryManager, resolve_memory_limit
+from src.core.lazyeval import LazyEval
+from src.core.logstack import LogStack, SNAPSHOT_INTERVAL, HISTORY_BUDGET
+from src.core.segmentlog import SegmentLog
+from src.core.profiler import Profiler
 
-
-class BreakException(Exception):
-    pass
+# History backends: the whole history in memory, or its older segments in a file read back through mmap.
+HISTORY_BACKENDS = ('memory', 'disk')
 
 
 class Interpreter:
@@ -29,116 +33,72 @@ class Interpreter:
         The `Interpreter` class is responsible for executing the abstract syntax tree (AST) of an Ulto program.
         It manages variable assignments, control flow (e.g., loops, conditionals), arithmetic operations, and
         reversible operations. The interpreter also handles memory management, profiling, and logging of
-        execution details. Additionally, it interfaces with a C library for optimized arithmetic and compound
-        assignment operations through foreign function interface (FFI) using `ctypes`.
+        execution details. Integer arithmetic is exact, switching to arbitrary precision only when a value
+        outgrows 64 bits, and is evaluated by an `ArithmeticKernel`, which fuses whole expressions into a single
+        call, optionally into a native batch kernel via `ctypes`.
 
         Attributes:
             ast (list): The abstract syntax tree representing the program.
-            symbol_table (SortedDict): A sorted dictionary used to store variable names and their associated values.
+            frame (Frame): Slot-indexed storage holding the value of every variable.
             history (list): A list to keep track of execution history.
             detailed_history (list): A list to store detailed execution history.
             assignments (int): A counter for the number of assignments performed.
             evaluations (int): A counter for the number of expressions evaluated.
             reversals (int): A counter for the number of reversals executed.
-            current_step (int): The current step number in the execution.
+            current_step (int): The number of steps journaled by the LogStack, i.e. mutations made so far.
             memory_manager (MemoryManager): An instance of the MemoryManager class for managing memory allocation.
-            eager_vars (set): A set of variables identified for eager evaluation.
-            profiling_data (dict): A dictionary to store profiling data for optimizing execution.
-            profile_batch_size (int): The batch size for profiling updates.
-            profile_counter (int): A counter to manage profiling updates.
+            profiler (Profiler): Counts the iterations of the loops and times the top-level statements as the
+                                 program runs.
             logstack (LogStack): An instance of the LogStack class to manage reversible operations.
-            lib (ctypes.CDLL): A C library loaded for performing arithmetic and compound assignments.
+            kernel (ArithmeticKernel): The kernel evaluating fused arithmetic expressions.
+            operators (dict): Binary operator implementations, dividing integers like C.
+            compiler (Compiler): The closure compiler used to turn the AST into executable closures.
         """
-    def __init__(self, ast):
+    def __init__(self, ast, snapshot_interval=SNAPSHOT_INTERVAL, history='memory', history_budget=HISTORY_BUDGET,
+                 retention=None, retain=None, memory_limit=None):
         """
         Initializes the ExecutionEngine with the given AST.
 
         Args:
         ast (list): The abstract syntax tree.
+        snapshot_interval (int): The maximum number of compound assignments of a variable the LogStack logs as
+                                 deltas in a row, which bounds the work of a deep revtrace or a rewind.
+        history (str): Where the LogStack keeps the history: 'memory', or 'disk' to move its older segments to
+                       a temporary file once it takes more than `history_budget`.
+        history_budget (float): The memory the history may take with the 'disk' backend, in megabytes.
+        retention (RetentionPolicy): How much history the LogStack keeps for the whole program, all of it by
+                                     default.
+        retain (dict): Retention policies of single variables, by name.
+        memory_limit (float): The memory limit of the program in megabytes, `ULTO_MEMORY_LIMIT` or 50 by default.
         """
         self.ast = ast
-        self.symbol_table = SortedDict()
+        self.frame = Frame()
         self.history = []
         self.detailed_history = []
         self.assignments = 0
         self.evaluations = 0
         self.reversals = 0
-        self.current_step = 0
-        # limiting programs to 50 MB for the moment. If exceeds throws malloc exception errors.
-        self.memory_manager = MemoryManager(50)
-        self.eager_vars = set()
-        self.profiling_data = {}
-        self.profile_batch_size = 250
-        self.profile_counter = 0
-        self.logstack = LogStack()
-
-        # Determining the OS family
-        system = platform.system()
-        # loading machine compiled arithmetic and compound assignment file.
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-
-        if system == "Windows":
-            lib_path = os.path.join(script_dir, 'operations.dll')
-        else:  # If Linux or other Unix-like systems
-            lib_path = os.path.join(script_dir, 'liboperations.so')
-
-        self.lib = ctypes.CDLL(lib_path)
-
-        # Here, arithmetic and compound assignments are handled via C compiler through FFI using ctypes
-        self.lib.execute_add.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_add.restype = ctypes.c_int
-
-        self.lib.execute_sub.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_sub.restype = ctypes.c_int
-
-        self.lib.execute_mul.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_mul.restype = ctypes.c_int
-
-        self.lib.execute_div.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_div.restype = ctypes.c_int
-
-        self.lib.execute_modulo.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_modulo.restype = ctypes.c_int
-
-        self.lib.execute_int_div.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_int_div.restype = ctypes.c_int
-
-        self.lib.execute_eq.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_eq.restype = ctypes.c_int
-
-        self.lib.execute_neq.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_neq.restype = ctypes.c_int
-
-        self.lib.execute_lt.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_lt.restype = ctypes.c_int
-
-        self.lib.execute_gt.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_gt.restype = ctypes.c_int
-
-        self.lib.execute_lte.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_lte.restype = ctypes.c_int
-
-        self.lib.execute_gte.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_gte.restype = ctypes.c_int
-
-        self.lib.execute_and.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_and.restype = ctypes.c_int
-
-        self.lib.execute_or.argtypes = [ctypes.c_int, ctypes.c_int]
-        self.lib.execute_or.restype = ctypes.c_int
-
-        # Define argument and return types for the compound assignment operations
-        self.lib.execute_add_assign.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.c_int]
-        self.lib.execute_add_assign.restype = ctypes.c_int
-
-        self.lib.execute_sub_assign.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.c_int]
-        self.lib.execute_sub_assign.restype = ctypes.c_int
-
-        self.lib.execute_mul_assign.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.c_int]
-        self.lib.execute_mul_assign.restype = ctypes.c_int
-
-        self.lib.execute_div_assign.argtypes = [ctypes.POINTER(ctypes.c_int), ctypes.c_int]
-        self.lib.execute_div_assign.restype = ctypes.c_int
+        # limiting programs to 50 MB unless told otherwise, values and history in memory alike. As the limit is
+        # approached the LogStack gives up history, and if it is exceeded anyway, throws malloc exception errors.
+        try:
+            self.memory_manager = MemoryManager(resolve_memory_limit(memory_limit))
+        except ValueError as error:
+            self.error(str(error))
+        self.profiler = Profiler()
+        if history not in HISTORY_BACKENDS:
+            self.error(f'Unknown history backend "{history}", expected one of {", ".join(HISTORY_BACKENDS)}')
+        if not math.isfinite(history_budget) or history_budget <= 0:
+            self.error(f'The history budget must be a positive, finite number, got {history_budget}')
+        self.logstack = LogStack(snapshot_interval, SegmentLog() if history == 'disk' else None, history_budget,
+                                 retention, self.memory_manager, self.warn)
+        for var_name, policy in (retain or {}).items():
+            self.logstack.retain(var_name, policy)
+
+        # Integer arithmetic is exact and divides like C. Whole arithmetic expressions are evaluated by the kernel in
+        # one call, on a native 64-bit path when available, instead of one FFI round trip per operator.
+        self.kernel = ArithmeticKernel()
+        self.operators = dict(OPERATORS)
+        self.compiler = Compiler(self)
 
     def execute(self):
         """
@@ -147,508 +107,123 @@ class Interpreter:
         print("\n~~~~~~~~~~~~~~~~~~~~OUTPUT~~~~~~~~~~~~~~~~~~~~\n")
         start_time = time.time()
         try:
-            # collecting profiling data to find hotspots and manage accordingly during runtime.
-            self.collect_profiling_data(self.ast)
-            # for detecting eager variables that are often used in the source code, preprocessing it at the start of AST execution.
-            self.detect_eager_vars()
-            for node in self.ast:
-                self.execute_node(node)
-                self.prune_logstack()
+            # every assignment is marked eager or lazy from how its value is read, once, before it is compiled.
+            DataFlowAnalyser(self.ast).analyse()
+            # every identifier gets its frame slot, then the AST is compiled into closures.
+            self.frame.resolve_program(self.ast)
+            program = self.compiler.compile_program(self.ast)
+            # the top-level statements are timed, the loops count their own iterations.
+            for node, statement in zip(self.ast, program):
+                site = self.profiler.statement(node)
+                started = time.perf_counter()
+                statement()
+                site.record(time.perf_counter() - started)
         finally:
             end_time = time.time()
             self.print_computation_cost()
             self.log_execution_details(start_time, end_time)
 
-    def collect_profiling_data(self, ast):
-        """
-        Collects profiling data from the AST.
-
-        Args:
-        ast (list): The abstract syntax tree.
-        """
-        for node in ast:
-            self.profile_node(node)
-
-    def profile_node(self, node):
+    @property
+    def symbol_table(self):
         """
-        Profiles a single node in the AST. For now, handling conditionals, assignments, reversals and prints.
+        A sorted snapshot of the assigned variables, built on demand from the frame.
 
-        Args:
-        node (tuple): The node to be profiled.
-        """
-        if node[0] == 'assign':
-            self.profile_assignment(node)
-        elif node[0] == 'reverse':
-            self.profile_reverse(node)
-        elif node[0] == 'revtrace':
-            self.profile_revtrace(node)
-        elif node[0] == 'if':
-            self.profile_if(node)
-        elif node[0] == 'while':
-            self.profile_while(node)
-        elif node[0] == 'print':
-            self.profile_print(node)
-
-    def profile_assignment(self, node):
-        """
-        Profiles an assignment node.
-
-        Args:
-        node (tuple): The assignment node.
-        """
-        _, var_name, value = node
-        self.update_profiling_data(var_name)
-        self.update_profiling_data(value)
-
-    def profile_reverse(self, node):
-        """
-        Profiles a reverse node.
-
-        Args:
-        node (tuple): The reverse node.
+        Returns:
+        SortedDict: The variables keyed by name.
         """
-        _, var_name = node
-        self.update_profiling_data(var_name)
+        return self.frame.sorted_view()
 
-    def profile_revtrace(self, node):
+    @property
+    def current_step(self):
         """
-        Profiles a revtrace node.
+        The current step number in the execution: every assignment and reversal is one step of the journal kept
+        by the LogStack.
 
-        Args:
-        node (tuple): The revtrace node.
+        Returns:
+        int: The number of steps made.
         """
-        _, var_name, index = node
-        self.update_profiling_data(var_name)
-        self.update_profiling_data(index)
+        return self.logstack.sequence
 
-    def profile_if(self, node):
+    def state_at(self, step):
         """
-        Profiles an if node.
+        Rebuilds the variables as they were at a step of the execution, without replaying it.
 
         Args:
-        node (tuple): The if node.
-        """
-        _, condition, true_branch, elif_branches, false_branch = node
-
-        self.update_profiling_data(condition)
-        for stmt in true_branch:
-            self.profile_node(stmt)
-
-        for elif_condition, elif_branch in elif_branches:
-            self.update_profiling_data(elif_condition)
-            for stmt in elif_branch:
-                self.profile_node(stmt)
+        step (int): The step, from the oldest step kept by the LogStack up to `current_step`.
 
-        for stmt in false_branch:
-            self.profile_node(stmt)
-
-    def profile_while(self, node):
+        Returns:
+        SortedDict: The variables assigned at that step, keyed by name, with lazy values evaluated.
         """
-        Profiles a while node.
+        state = self.logstack.state_at(step, dict(self.frame.items()))
+        if state is None:
+            self.error(f'Step {step} is not in the journal, steps {self.logstack.first_step} to '
+                       f'{self.current_step} are')
+        return SortedDict((var_name, value.evaluate() if isinstance(value, LazyEval) else value)
+                          for var_name, value in state.items())
 
-        Args:
-        node (tuple): The while node.
+    def rewind(self, steps):
         """
-        _, condition, body = node
-        self.update_profiling_data(condition)
-        for stmt in body:
-            self.profile_node(stmt)
+        Rewinds every variable by a number of steps of the journal, as the `rewind` statement does.
 
-    def profile_print(self, node):
-        """
-        Profiles a print node.
+        The variables changed in those steps are restored directly from their history, so the time taken depends
+        on the number of variables changed, not on the number of steps. The rewind is itself journaled, and can
+        be undone by rewinding again.
 
         Args:
-        node (tuple): The print node.
-        """
-        _, value = node
-        self.update_profiling_data(value)
+        steps (int): The number of steps.
+        """
+        if not isinstance(steps, int) or steps < 0:
+            self.error(f'rewind requires a non-negative number of steps, got {steps}')
+        restored = self.logstack.rewind(self.current_step - steps, dict(self.frame.items()))
+        if restored is None:
+            self.error(f'Cannot rewind {steps} steps, the journal holds '
+                       f'{self.current_step - self.logstack.first_step}')
+        self.reversals += 1
+        slots = self.frame.slots
+        for var_name, value in restored.items():
+            slot = self.frame.resolve(var_name)
+            slots[slot] = value
+            self.account(slot)
 
-    def update_profiling_data(self, expr):
+    def account(self, slot):
         """
-        Updates the profiling data with the given expression.
+        Charges the value of a slot to the memory manager in place of the value charged for it before. Loops
+        only account for the values they give their variable once they are left.
 
         Args:
-        expr (any): The expression to be profiled.
-        """
-        if isinstance(expr, tuple):
-            for item in expr:
-                self.update_profiling_data(item)
-        elif isinstance(expr, list):
-            for item in expr:
-                self.update_profiling_data(item)
-        elif isinstance(expr, str):
-            if expr in self.profiling_data:
-                self.profiling_data[expr] += 1
-            else:
-                self.profiling_data[expr] = 1
-
-        # Batch profiling updates
-        self.profile_counter += 1
-        if self.profile_counter >= self.profile_batch_size:
-            self.profile_counter = 0
-            self.detect_eager_vars()
-
-    def detect_eager_vars(self):
-        """
-        Detects eager variables based on the profiling data.
+        slot (int): The slot.
         """
-        # threshold set to 3 to avoid inaccuracy of dealing hotspots, can shift it to 5 for reducing overhead but for
-        # now is good. can be tweaked based on nature of application.
-        threshold = 3
-        for var, count in self.profiling_data.items():
-            if count > threshold:
-                self.eager_vars.add(var)
+        value = self.frame.slots[slot]
+        charged = self.frame.charged
+        self.memory_manager.track(value)
+        self.memory_manager.release(charged[slot])
+        charged[slot] = value
 
     def execute_node(self, node):
         """
-        Executes a single node in the AST.
-
-        Args:
-        node (tuple): The node to be executed.
-        """
-        node_type = node[0]
-        if node_type == 'assign':
-            self.execute_assignment(node)
-        elif node_type == 'reverse':
-            self.execute_reverse(node)
-        elif node_type == 'revtrace':
-            self.execute_revtrace(node)
-        elif node_type == 'if':
-            self.execute_if(node)
-        elif node_type == 'for':
-            self.execute_for(node)
-        elif node_type == 'while':
-            self.execute_while(node)
-        elif node_type == 'print':
-            self.execute_print(node)
-        elif node_type == 'plus_assign':
-            self.execute_plus_assign(node)
-        elif node_type == 'minus_assign':
-            self.execute_minus_assign(node)
-        elif node_type == 'times_assign':
-            self.execute_times_assign(node)
-        elif node_type == 'over_assign':
-            self.execute_over_assign(node)
-        elif node_type == 'break':
-            raise BreakException()
-        else:
-            self.error(f'Unknown node type: {node_type}')
-
-    def execute_assignment(self, node):
-        """
-        Executes an assignment node.
-
-        Args:
-        node (tuple): The assignment node.
-        """
-        self.assignments += 1
-        _, var_name, value = node
-
-        # Considering hybrid approach since, some programs developed can have circular dependency. Hence, based on the
-        # source code profile eager and lazy accordingly.
-        # for eg: "i = i + 1" meets the requirement of circular dependency causing infinite loops if lazily evaluated.
-        if var_name in self.eager_vars:
-            evaluated_value = self.evaluate_expression(value)
-            lazy_value = evaluated_value
-        else:
-            lazy_value = LazyEval(value, self)
-
-        previous_value = self.symbol_table.get(var_name, None)
-
-        # estimates memory use and pools itself for only what is required to perform operations below the set threshold.
-        size = sys.getsizeof(lazy_value)
-        self.memory_manager.allocate(size)
-
-        # deallocate memory based on previous value for re-usability on a different operation.
-        if previous_value is not None:
-            prev_size = sys.getsizeof(previous_value)
-            self.memory_manager.deallocate(prev_size)
-
-        self.logstack.push(var_name, previous_value)
-        self.symbol_table[var_name] = lazy_value
-
-    def execute_plus_assign(self, node):
-        """
-        Executes a plus assignment operation (`+=`) on a variable.
-
-        Args:
-            node (tuple): A tuple containing the operation and the variable name, and the value
-                          to be added. Expected format: (_, var_name, value).
-
-        Raises:
-            KeyError: If `var_name` is not found in the symbol table.
-        """
-        _, var_name, value = node
-        current_value = self.symbol_table.get(var_name)
-        if isinstance(current_value, LazyEval):
-            current_value = current_value.evaluate()
-        addition_value = self.evaluate_expression(value)
-        if isinstance(addition_value, LazyEval):
-            addition_value = addition_value.evaluate()
-        # Log current value for maybe reversal in logstack
-        self.logstack.push(var_name, current_value)
-        new_value = self.lib.execute_add_assign(ctypes.byref(ctypes.c_int(current_value)), addition_value)
-        # If lazy, wrap it in LazyEval again
-        if var_name in self.eager_vars:
-            self.symbol_table[var_name] = new_value
-        else:
-            self.symbol_table[var_name] = LazyEval(new_value, self)
-
-    def execute_minus_assign(self, node):
-        """
-        Executes a minus assignment operation (`-=`) on a variable.
-
-        Args:
-            node (tuple): A tuple containing the operation and the variable name, and the value
-                          to be subtracted. Expected format: (_, var_name, value).
-
-        Raises:
-            KeyError: If `var_name` is not found in the symbol table.
-        """
-        _, var_name, value = node
-        current_value = self.symbol_table.get(var_name)
-        if isinstance(current_value, LazyEval):
-            current_value = current_value.evaluate()
-        subtraction_value = self.evaluate_expression(value)
-        if isinstance(subtraction_value, LazyEval):
-            subtraction_value = subtraction_value.evaluate()
-        # Log current value for maybe reversal in logstack
-        self.logstack.push(var_name, current_value)
-        new_value = self.lib.execute_sub_assign(ctypes.byref(ctypes.c_int(current_value)), subtraction_value)
-        # If lazy, wrap it in LazyEval again
-        if var_name in self.eager_vars:
-            self.symbol_table[var_name] = new_value
-        else:
-            self.symbol_table[var_name] = LazyEval(new_value, self)
-
-    def execute_times_assign(self, node):
-        """
-        Executes a times assignment operation (`*=`) on a variable.
-
-        Args:
-            node (tuple): A tuple containing the operation and the variable name, and the value
-                          to be multiplied. Expected format: (_, var_name, value).
-
-        Raises:
-            KeyError: If `var_name` is not found in the symbol table.
-        """
-        _, var_name, value = node
-        current_value = self.symbol_table.get(var_name)
-        if isinstance(current_value, LazyEval):
-            current_value = current_value.evaluate()
-        multiplication_value = self.evaluate_expression(value)
-        if isinstance(multiplication_value, LazyEval):
-            multiplication_value = multiplication_value.evaluate()
-        # Log current value for maybe reversal in logstack
-        self.logstack.push(var_name, current_value)
-        new_value = self.lib.execute_mul_assign(ctypes.byref(ctypes.c_int(current_value)), multiplication_value)
-        # If lazy, wrap it in LazyEval again
-        if var_name in self.eager_vars:
-            self.symbol_table[var_name] = new_value
-        else:
-            self.symbol_table[var_name] = LazyEval(new_value, self)
-
-    def execute_over_assign(self, node):
-        """
-         Executes a division assignment operation (`/=`) on a variable.
-
-         Args:
-             node (tuple): A tuple containing the operation and the variable name, and the value
-                           to be divided. Expected format: (_, var_name, value).
-
-         Raises:
-             KeyError: If `var_name` is not found in the symbol table.
-         """
-        _, var_name, value = node
-        current_value = self.symbol_table.get(var_name)
-        if isinstance(current_value, LazyEval):
-            current_value = current_value.evaluate()
-        division_value = self.evaluate_expression(value)
-        if isinstance(division_value, LazyEval):
-            division_value = division_value.evaluate()
-        # Log current value for maybe reversal in logstack
-        self.logstack.push(var_name, current_value)
-        new_value = self.lib.execute_div_assign(ctypes.byref(ctypes.c_int(current_value)), division_value)
-        # If lazy, wrap it in LazyEval again
-        if var_name in self.eager_vars:
-            self.symbol_table[var_name] = new_value
-        else:
-            self.symbol_table[var_name] = LazyEval(new_value, self)
-
-    def execute_if(self, node):
-        """
-        Executes an if node.
-
-        Args:
-        node (tuple): The if node.
-        """
-        _, condition, true_branch, elif_branches, false_branch = node
-        condition_result = self.evaluate_expression(condition)
-        if condition_result:
-            branch = true_branch
-        else:
-            for elif_condition, elif_branch in elif_branches:
-                if self.evaluate_expression(elif_condition):
-                    branch = elif_branch
-                    break
-            else:
-                branch = false_branch
-
-        for stmt in branch:
-            self.execute_node(stmt)
-
-    def execute_while(self, node):
-        """
-        Executes a while node.
-
-        Args:
-        node (tuple): The while node.
-        """
-        _, condition, body = node
-
-        if isinstance(condition, tuple) and len(condition) == 3:
-            left, op, right = condition
-
-            if op == 'lt' and isinstance(right, int):
-                n_value = self.evaluate_expression(right)
-                while self.evaluate_expression(left) < n_value:
-                    for stmt in body:
-                        self.execute_node(stmt)
-                    # Eagerly evaluate i to avoid re-evaluation
-                    self.symbol_table[left] = self.evaluate_expression(self.symbol_table.get(left)) + 1
-            else:
-                while self.evaluate_expression(condition):
-                    try:
-                        for stmt in body:
-                            self.execute_node(stmt)
-                    except BreakException:
-                        break
-        else:
-            while self.evaluate_expression(condition):
-                try:
-                    for stmt in body:
-                        self.execute_node(stmt)
-                except BreakException:
-                    break
-
-    def execute_for(self, node):
-        """
-        Executes a for loop node.
+        Compiles and executes a single node in the AST.
 
         Args:
-        node (tuple): The for loop node.
-        """
-        _, var_name, iterable, body = node
-
-        if iterable[0] == 'range':
-            _, start_value, end_value, step_value = iterable
-            start_value = self.evaluate_expression(start_value)
-            end_value = self.evaluate_expression(end_value)
-            step_value = self.evaluate_expression(step_value) if step_value else 1
-
-            current_value = start_value
-            while current_value < end_value:
-                self.symbol_table[var_name] = current_value
-                try:
-                    for stmt in body:
-                        self.execute_node(stmt)
-                except BreakException:
-                    break
-                current_value += step_value
-        else:
-            if isinstance(iterable, list):
-                iterable_value = [self.evaluate_expression(item) for item in iterable]
-            else:
-                iterable_value = self.evaluate_expression(iterable)
-            if not isinstance(iterable_value, (list, str)):
-                self.error(f'Variable "{iterable}" is not an iterable')
-
-            for item in iterable_value:
-                self.symbol_table[var_name] = item
-                try:
-                    for stmt in body:
-                        self.execute_node(stmt)
-                except BreakException:
-                    break
-
-    def execute_print(self, node):
+        node (Node): The node to be executed.
         """
-        Executes a print node.
-
-        Args:
-        node (tuple): The print node.
-        """
-        _, values = node
-        output = []
-        for value in values:
-            evaluated_value = self.evaluate_expression(value)
-            if isinstance(evaluated_value, str) and evaluated_value.startswith('"') and evaluated_value.endswith('"'):
-                output.append(evaluated_value[1:-1])  # Strip the double quotations for displaying in the output
-            elif isinstance(evaluated_value, str) and evaluated_value.startswith('`') and evaluated_value.endswith('`'):
-                output.append(evaluated_value[1:-1])  # Strip the backticks for displaying in the output
-            else:
-                output.append(str(evaluated_value))
-        print(" ".join(output))
+        self.compiler.compile_statement(node)()
 
     def evaluate_expression(self, expr):
         """
-        Evaluates an expression.
+        Compiles and evaluates an expression.
 
         Args:
-        expr (any): The expression to be evaluated.
+        expr (Node or any): The expression to be evaluated, or an already computed value.
 
         Returns:
         The evaluated result.
         """
-        self.evaluations += 1
         if isinstance(expr, LazyEval):
-            if expr._evaluated_value is None:
-                expr._evaluated_value = self.evaluate_expression(expr.expression)
-            return expr._evaluated_value
-
-        if isinstance(expr, list):
-            return [self.evaluate_expression(item) for item in expr]
-
-        elif isinstance(expr, tuple):
-            if len(expr) == 3:
-                left, op, right = expr
-                if op == 'index':
-                    left_val = self.evaluate_expression(left)
-                    right_val = self.evaluate_expression(right)
-                    if isinstance(left_val, list):
-                        return left_val[right_val]
-                    else:
-                        self.error(f"Cannot index non-list type: {left_val}")
-                else:
-                    left_val = self.evaluate_expression(left)
-                    right_val = self.evaluate_expression(right)
-                    return self.apply_operator(op, left_val, right_val)
-            elif len(expr) == 2 and expr[0] == 'len':
-                _, inner_expr = expr
-                evaluated_expr = self.evaluate_expression(inner_expr)
-                if isinstance(evaluated_expr, str) or isinstance(evaluated_expr, list):
-                    return len(evaluated_expr)
-                else:
-                    self.error(f"len() function requires a string or list, got {type(evaluated_expr).__name__}")
-            else:
-                self.error(f"Unexpected tuple structure: {expr}")
-
-        elif isinstance(expr, int) or isinstance(expr, bool):
+            return expr.evaluate()
+        self.evaluations += 1
+        if not isinstance(expr, Node):
             return expr
-
-        elif isinstance(expr, str):
-            if expr.startswith('`') and expr.endswith('`'):
-                return expr
-            elif expr.isnumeric() is False and not expr.startswith('"'):
-                value = self.symbol_table.get(expr)
-                if isinstance(value, LazyEval):
-                    return value.evaluate()
-                return value
-        else:
-            self.error(f"Unknown expression type: {expr}")
-
-        return expr
+        return self.compiler.compile_expression(expr)()
 
     def apply_operator(self, op, left, right):
         """
@@ -666,167 +241,36 @@ class Interpreter:
             left = left.evaluate()
         if isinstance(right, LazyEval):
             right = right.evaluate()
-        if op == 'plus':
-            try:
-                result = self.lib.execute_add(left, right)
-                if result is None:
-                    raise ValueError("execute_add returned None")
-            except Exception:
-                result = left + right
-            return result
-        elif op == 'minus':
-            try:
-                result = self.lib.execute_sub(left, right)
-                if result is None:
-                    raise ValueError("execute_sub returned None")
-            except Exception:
-                result = left - right
-            return result
-        elif op == 'times':
-            try:
-                result = self.lib.execute_mul(left, right)
-                if result is None:
-                    raise ValueError("execute_mul returned None")
-            except Exception:
-                result = left * right
-            return result
-        elif op == 'over':
-            try:
-                result = self.lib.execute_div(left, right)
-                if result is None:
-                    raise ValueError("execute_div returned None")
-            except Exception:
-                result = left / right
-            return result
-        elif op == 'modulo':
-            try:
-                result = self.lib.execute_modulo(left, right)
-                if result is None:
-                    raise ValueError("execute_modulo returned None")
-            except Exception:
-                result = left % right
-            return result
-        elif op == 'int_div':
-            try:
-                result = self.lib.execute_int_div(left, right)
-                if result is None:
-                    raise ValueError("execute_int_div returned None")
-            except Exception:
-                result = left // right
-            return result
-        elif op == 'eq':
-            try:
-                result = self.lib.execute_eq(left, right)
-                if result is None:
-                    raise ValueError("execute_eq returned None")
-            except Exception:
-                result = left == right
-            return result
-        elif op == 'neq':
-            try:
-                result = self.lib.execute_neq(left, right)
-                if result is None:
-                    raise ValueError("execute_neq returned None")
-            except Exception:
-                result = left != right
-            return result
-        elif op == 'lt':
-            try:
-                result = self.lib.execute_lt(left, right)
-                if result is None:
-                    raise ValueError("execute_lt returned None")
-            except Exception:
-                result = left < right
-            return result
-        elif op == 'gt':
-            try:
-                result = self.lib.execute_gt(left, right)
-                if result is None:
-                    raise ValueError("execute_gt returned None")
-            except Exception:
-                result = left > right
-            return result
-        elif op == 'lte':
-            try:
-                result = self.lib.execute_lte(left, right)
-                if result is None:
-                    raise ValueError("execute_lte returned None")
-            except Exception:
-                result = left <= right
-            return result
-        elif op == 'gte':
-            try:
-                result = self.lib.execute_gte(left, right)
-                if result is None:
-                    raise ValueError("execute_gte returned None")
-            except Exception:
-                result = left >= right
-            return result
-        elif op == 'and':
-            try:
-                result = self.lib.execute_and(left, right)
-
-                if result is None:
-                    raise ValueError("execute_and returned None")
-            except Exception:
-                result = left and right
-            return result
-        elif op == 'or':
-            try:
-                result = self.lib.execute_or(left, right)
-                if result is None:
-                    raise ValueError("execute_or returned None")
-            except Exception:
-                result = left or right
-            return result
-        else:
+        apply = self.operators.get(op)
+        if apply is None:
             self.error(f'Unknown operator: {op}')
+        return apply(left, right)
 
-    def execute_reverse(self, node):
+    def print_values(self, values):
         """
-        Executes a reverse node.
+        Prints evaluated values on one line, stripping the quotes of string literals.
 
         Args:
-        node (tuple): The reverse node.
+        values (list): The evaluated values to print.
         """
-        self.reversals += 1
-        if node[0] == 'reversible_block':
-            _, block = node
-            for stmt in reversed(block):
-                self.execute_node(stmt)
-        else:
-            _, var_name = node
-            previous_value = self.logstack.pop(var_name)
-            if previous_value is not None:
-                self.symbol_table[var_name] = previous_value
-
-                # memory estimation required since, reversal keeps track of history consuming space.
-                current_size = sys.getsizeof(self.symbol_table[var_name])
-                prev_size = sys.getsizeof(previous_value)
-                self.memory_manager.deallocate(current_size)
-                self.memory_manager.allocate(prev_size)
-
-    def execute_revtrace(self, node):
-        """
-        Executes a revtrace node.
+        output = []
+        for evaluated_value in values:
+            if isinstance(evaluated_value, str) and evaluated_value.startswith('"') and evaluated_value.endswith('"'):
+                output.append(evaluated_value[1:-1])  # Strip the double quotations for displaying in the output
+            elif isinstance(evaluated_value, str) and evaluated_value.startswith('`') and evaluated_value.endswith('`'):
+                output.append(evaluated_value[1:-1])  # Strip the backticks for displaying in the output
+            else:
+                output.append(str(evaluated_value))
+        print(" ".join(output))
 
-        Args:
-        node (tuple): The revtrace node.
+    def warn(self, message):
         """
-        _, var_name, index_expr = node
-        index = self.evaluate_expression(index_expr)  # support for both iterable variables and integers
-
-        # Retrieve the previous value from the reverse log stack
-        previous_value = self.logstack.peek(var_name, index)
-        if previous_value is not None:
-            print(f"Reverse Tracepath state {index} of {var_name}: {previous_value}")
-        else:
-            print(f"No state found for {var_name} at index {index}")
+        Prints a warning, to standard error so as not to mix with the output of the program.
 
-    def prune_logstack(self):
-        self.logstack.prune()
-        if self.logstack.get_memory_usage() > 50:
-            print("Warning: Memory usage exceeded 50 MB")
+        Args:
+        message (str): The warning.
+        """
+        print(f"Warning: {message}", file=sys.stderr)
 
     def print_computation_cost(self):
         """
@@ -838,19 +282,35 @@ class Interpreter:
         print(f"Reversals: {self.reversals}")
         memory_usage = self.get_memory_usage()
         print(f"Memory Usage: {memory_usage} MB")
+        discarded = self.describe_discarded_history()
+        if discarded:
+            print(f"Discarded History: {discarded}")
+
+    def describe_discarded_history(self):
+        """
+        Describes the reversibility given up by the retention policies of the LogStack.
+
+        Returns:
+        str: The number of versions discarded per variable and the oldest step `rewind` can reach, or `None` if
+             nothing was discarded.
+        """
+        lost = self.logstack.lost
+        if not lost:
+            return None
+        versions = ', '.join(f'{count} versions of {var_name}' for var_name, count in lost.items())
+        return f'{versions}; rewind reaches back to step {self.logstack.first_step}'
 
     def get_memory_usage(self):
         """
-        Gets the current memory usage.
+        Gets the current memory usage of the variables and their history, as charged to the memory manager, in
+        constant time. The history entries logged since the LogStack last reserved memory for them are added.
 
         Returns:
         float: The memory usage in megabytes.
         """
-        symbol_table_size = sys.getsizeof(self.symbol_table)
-        total_size = symbol_table_size
-        for key, value in self.symbol_table.items():
-            total_size += sys.getsizeof(key)
-            total_size += sys.getsizeof(value)
+        frame = self.frame
+        total_size = (sys.getsizeof(frame.slots) + frame.name_size + self.memory_manager.get_allocated_memory()
+                      + self.logstack.unreserved_size())
         return total_size / (1024 * 1024)
 
     def log_execution_details(self, start_time, end_time):
@@ -871,6 +331,14 @@ class Interpreter:
             log_file.write(f"Evaluations: {self.evaluations}\n")
             log_file.write(f"Reversals: {self.reversals}\n")
             log_file.write(f"Memory Usage: {self.get_memory_usage()} MB\n")
+            discarded = self.describe_discarded_history()
+            if discarded:
+                log_file.write(f"Discarded History: {discarded}\n")
+            hotness = self.profiler.report()
+            if hotness:
+                log_file.write("Hotness:\n")
+                for line in hotness:
+                    log_file.write(f"    {line}\n")
             log_file.write("\n")
 
     def error(self, message):
@@ -6,107 +6,141 @@
 
 import re
 
-def tokenize(code):
+# Order matters where patterns share a prefix: the first alternative that matches wins.
+TOKEN_SPECIFICATION = [
+    ('LBRACE', r'\{'),  # Left brace for opening a code block
+    ('RBRACE', r'\}'),  # Right brace for closing a code block
+    ('PLUS_ASSIGN', r'\+='),  # Addition assignment
+    ('MINUS_ASSIGN', r'-='),  # Subtraction assignment
+    ('TIMES_ASSIGN', r'\*='),  # Multiplication assignment
+    ('OVER_ASSIGN', r'/='),  # Division assignment
+    ('MODULO', r'%'),  # Modulo operator
+    ('INT_DIV', r'//'),  # Integer division
+    ('EQ', r'=='),  # Equality
+    ('NEQ', r'!='),  # Not equal
+    ('LTE', r'<='),  # Less than or equal
+    ('GTE', r'>='),  # Greater than or equal
+    ('LT', r'<'),  # Less than
+    ('GT', r'>'),  # Greater than
+    ('NUMBER', r'\d+'),  # Integer
+    ('ASSIGN', r'='),  # Assignment
+    ('ID', r'[A-Za-z_][A-Za-z0-9_]*'),  # Identifiers and keywords, see KEYWORDS
+    ('PLUS', r'\+'),  # Addition
+    ('MINUS', r'-'),  # Subtraction
+    ('TIMES', r'\*'),  # Multiplication
+    ('OVER', r'/'),  # Division
+    ('LPAREN', r'\('),  # Left parenthesis
+    ('RPAREN', r'\)'),  # Right parenthesis
+    ('LBRACKET', r'\['),  # Left bracket
+    ('RBRACKET', r'\]'),  # Right bracket
+    ('COLON', r':'),  # Colon
+    ('STRING', r'(?:"[^"]*"|`[^`]*`)'),  # String literals with both " and `
+    ('COMMA', r','),  # Comma for parameter separation
+    ('COMMENT', r'#.*'),  # Comment
+    ('SKIP', r'[ \t]+'),  # Skip over spaces / tabs
+    ('NEWLINE', r'\r?\n'),  # Line end
+    ('MISMATCH', r'.'),  # Any other character
+]
+
+# Keywords are scanned as identifiers and then looked up here, which keeps the master pattern free of
+# alternatives that can only ever match as a prefix of an identifier.
+KEYWORDS = {
+    'if': 'IF',  # If keyword
+    'elif': 'ELIF',  # Elif keyword
+    'else': 'ELSE',  # Else keyword
+    'for': 'FOR',  # For loop keyword
+    'in': 'IN',  # In keyword for iteration
+    'range': 'RANGE',  # Range keyword for numeric ranges
+    'while': 'WHILE',  # While keyword
+    'print': 'PRINT',  # Print keyword
+    'rev': 'REV',  # Reverse keyword
+    'revtrace': 'REVTRACE',  # reverse tracepath for accessing history
+    'rewind': 'REWIND',  # rewind every variable by a number of steps
+    'and': 'AND',  # Logical AND
+    'or': 'OR',  # Logical OR
+    'True': 'TRUE',  # Boolean True
+    'False': 'FALSE',  # Boolean False
+    'break': 'BREAK',  # Break keyword
+    'continue': 'CONTINUE',  # Continue keyword
+    'len': 'LEN',  # 'len' keyword
+}
+
+# Compiled once at import. Group numbers are mapped back to token kinds through `lastindex`, which is cheaper
+# than resolving `lastgroup` names for every token. The bytes variants scan memory-mapped source files in place.
+TOKEN_PATTERN = '|'.join('(%s)' % pattern for _, pattern in TOKEN_SPECIFICATION)
+TOKEN_REGEX = re.compile(TOKEN_PATTERN)
+TOKEN_REGEX_BYTES = re.compile(TOKEN_PATTERN.encode())
+TOKEN_KINDS = (None,) + tuple(kind for kind, _ in TOKEN_SPECIFICATION)
+INDENT_REGEX = re.compile(r'[ \t]*')
+INDENT_REGEX_BYTES = re.compile(rb'[ \t]*')
+
+
+def generate_tokens(code):
     """
-    Tokenizes the given code into a list of tokens.
+    Scans the given code in a single pass, yielding tokens as they are recognised.
+
+    The source is never sliced: the master pattern and the indentation pattern are matched at offsets into the
+    original string, so the work done is linear in the length of the code. Besides a string, the code can be
+    any UTF-8 encoded bytes-like object such as an `mmap` of the source file, which is scanned without reading
+    it into memory first.
 
     Args:
-    code (str): The source code to be tokenized.
+    code (str or bytes-like): The source code to be tokenized.
 
-    Returns:
-    list: A list of tokens.
+    Yields:
+    tuple: Tokens of the form (kind, value, line, column).
     """
-    tokens = []
-    token_specification = [
-        ('LBRACE', r'\{'),  # Left brace for opening a code block
-        ('RBRACE', r'\}'),  # Right brace for closing a code block
-        ('PLUS_ASSIGN', r'\+='),  # Addition assignment
-        ('MINUS_ASSIGN', r'-='),  # Subtraction assignment
-        ('TIMES_ASSIGN', r'\*='),  # Multiplication assignment
-        ('OVER_ASSIGN', r'/='),  # Division assignment
-        ('MODULO', r'%'),  # Modulo operator
-        ('INT_DIV', r'//'),  # Integer division
-        ('EQ', r'=='),  # Equality
-        ('NEQ', r'!='),  # Not equal
-        ('LTE', r'<='),  # Less than or equal
-        ('GTE', r'>='),  # Greater than or equal
-        ('LT', r'<'),  # Less than
-        ('GT', r'>'),  # Greater than
-        ('NUMBER', r'\d+'),  # Integer
-        ('ASSIGN', r'='),  # Assignment
-        ('ID', r'[A-Za-z_][A-Za-z0-9_]*'),  # Identifiers
-        ('PLUS', r'\+'),  # Addition
-        ('MINUS', r'-'),  # Subtraction
-        ('TIMES', r'\*'),  # Multiplication
-        ('OVER', r'/'),  # Division
-        ('LPAREN', r'\('),  # Left parenthesis
-        ('RPAREN', r'\)'),  # Right parenthesis
-        ('LBRACKET', r'\['),  # Left bracket
-        ('RBRACKET', r'\]'),  # Right bracket
-        ('COLON', r':'),  # Colon
-        ('IF', r'if'),  # If keyword
-        ('ELIF', r'elif'),  # Elif keyword
-        ('ELSE', r'else'),  # Else keyword
-        ('FOR', r'for'),  # For loop keyword
-        ('IN', r'in'),  # In keyword for iteration
-        ('RANGE', r'range'),  # Range keyword for numeric ranges
-        ('WHILE', r'while'),  # While keyword
-        ('PRINT', r'print'),  # Print keyword
-        ('REV', r'rev'),  # Reverse keyword
-        ('REVTRACE', r'revtrace'),  # reverse tracepath for accessing history
-        ('STRING', r'(?:"[^"]*"|`[^`]*`)'),  # String literals with both " and `
-        ('COMMA', r','),  # Comma for parameter separation
-        ('COMMENT', r'#.*'),  # Comment
-        ('SKIP', r'[ \t]+'),  # Skip over spaces / tabs
-        ('NEWLINE', r'\n'),  # Line end
-        ('MISMATCH', r'.'),  # Any other character
-        ('AND', r'and'),  # Logical AND
-        ('OR', r'or'),  # Logical OR
-        ('TRUE', r'True'),  # Boolean True
-        ('FALSE', r'False'),  # Boolean False
-        ('BREAK', r'break'),  # Break keyword
-        ('LEN', r'len')  # 'len' keyword
-    ]
-    tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in token_specification)
+    binary = not isinstance(code, str)
+    token_regex = TOKEN_REGEX_BYTES if binary else TOKEN_REGEX
+    match_indent = (INDENT_REGEX_BYTES if binary else INDENT_REGEX).match
+    kinds = TOKEN_KINDS
+    keywords = KEYWORDS
     line_num = 1
     line_start = 0
     current_indent_level = 0
     indent_stack = [0]
-    for mo in re.finditer(tok_regex, code):
-        kind = mo.lastgroup
+    for mo in token_regex.finditer(code):
+        kind = kinds[mo.lastindex]
+        if kind == 'SKIP' or kind == 'COMMENT':
+            continue
         value = mo.group()
+        if binary:
+            value = value.decode('utf-8', 'backslashreplace' if kind == 'MISMATCH' else 'strict')
         column = mo.start() - line_start
-        if kind == 'NUMBER':
+        if kind == 'ID':
+            kind = keywords.get(value, 'ID')
+        elif kind == 'NUMBER':
             value = int(value)
-        elif kind == 'STRING':
-            value = value
-        elif kind == 'COMMENT':
-            continue
-        elif kind == 'ID' and value in ('if', 'else', 'while', 'print', 'rev', 'revtrace', 'for', 'in', 'range', 'and', 'or', 'break', 'True', 'False', 'len'):
-            kind = value.upper()
         elif kind == 'NEWLINE':
             line_start = mo.end()
             line_num += 1
 
-            next_match = re.match(r'[ \t]*', code[line_start:])
-            if next_match:
-                indent = len(next_match.group())
-                if indent > current_indent_level:
-                    indent_stack.append(indent)
-                    tokens.append(('INDENT', indent, line_num, column))
-                    current_indent_level = indent
-                while indent < current_indent_level:
-                    indent_stack.pop()
-                    tokens.append(('DEDENT', indent, line_num, column))
-                    current_indent_level = indent_stack[-1]
-            continue
-        elif kind == 'SKIP':
+            indent = match_indent(code, line_start).end() - line_start
+            if indent > current_indent_level:
+                indent_stack.append(indent)
+                yield 'INDENT', indent, line_num, column
+                current_indent_level = indent
+            while indent < current_indent_level:
+                indent_stack.pop()
+                yield 'DEDENT', indent, line_num, column
+                current_indent_level = indent_stack[-1]
             continue
         elif kind == 'MISMATCH':
             raise RuntimeError(f'{value!r} unexpected on line {line_num}, column {column}')
-        tokens.append((kind, value, line_num, column))
+        yield kind, value, line_num, column
 
     while len(indent_stack) > 1:
-        tokens.append(('DEDENT', indent_stack.pop(), line_num, 0))
-    return tokens
+        yield 'DEDENT', indent_stack.pop(), line_num, 0
+
+
+def tokenize(code):
+    """
+    Tokenizes the given code into a list of tokens.
 
+    Args:
+    code (str): The source code to be tokenized.
+
+    Returns:
+    list: A list of tokens.
+    """
+    return list(generate_tokens(code))
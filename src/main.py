@@ -5,37 +5,118 @@
 # Aman Thapa Magar <at719@sussex.ac.uk>
 
 import sys
-from src.lexer import tokenize
+import math
+import mmap
+import argparse
+from src.lexer import generate_tokens
 from src.parser import Parser
-from src.interpreter import Interpreter
+from src.interpreter import Interpreter, HISTORY_BACKENDS
+from src.core.logstack import SNAPSHOT_INTERVAL, HISTORY_BUDGET
+from src.core.retention import parse_policy
+from src.core.malloc import MEMORY_LIMIT, MEMORY_LIMIT_VARIABLE, resolve_memory_limit
+from src.optimiser import Optimiser
 from src.semantic_analyser import SemanticAnalyser
+from src.vm.machine import VirtualMachine
+
+ENGINES = {
+    'interpreter': Interpreter,
+    'vm': VirtualMachine,
+}
+
+
+def parse_file(filename):
+    """
+    Parses a source file, streaming tokens from the lexer straight into the parser.
+
+    The file is memory-mapped and scanned in place, so neither the source text nor its token list is ever
+    held in memory as a whole.
+
+    Args:
+    filename (str): The path of the .ul file.
+
+    Returns:
+    list: The parsed AST.
+    """
+    with open(filename, 'rb') as file:
+        try:
+            source = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return Parser(generate_tokens(file.read())).parse()
+        with source:
+            tokens = generate_tokens(source)
+            try:
+                return Parser(tokens).parse()
+            finally:
+                # a syntax error leaves the scanner suspended with a view of the mapping, which would keep it from
+                # being closed.
+                tokens.close()
 
 
 def main():
     """
     Main function to run the Ulto program.
     """
-    if len(sys.argv) != 2:
-        print("Usage: ulto <filename>.ul")
-        sys.exit(1)
+    arg_parser = argparse.ArgumentParser(prog='ulto',
+                                         usage='ulto [--engine={interpreter,vm}] [--no-optimise] '
+                                               '[--snapshot-interval=N] [--history={memory,disk}] '
+                                               '[--history-budget=MB] [--retention=POLICY] [--retain NAME=POLICY ...] '
+                                               '[--memory-limit=MB] <filename>.ul')
+    arg_parser.add_argument('filename')
+    arg_parser.add_argument('--engine', choices=ENGINES, default='interpreter',
+                            help='execute with the closure compiling interpreter (default) or the bytecode VM')
+    arg_parser.add_argument('--no-optimise', dest='optimise', action='store_false',
+                            help='execute the program as written, without constant folding or loop-invariant hoisting')
+    arg_parser.add_argument('--snapshot-interval', type=int, default=SNAPSHOT_INTERVAL, metavar='N',
+                            help='log a full value after at most N compound assignments of a variable logged as '
+                                 f'deltas, bounding the work of revtrace and rewind (default {SNAPSHOT_INTERVAL})')
+    arg_parser.add_argument('--history', choices=HISTORY_BACKENDS, default='memory',
+                            help='keep the whole reversal history in memory (default), or move its older segments to a '
+                                 'temporary file read back when rev, revtrace or rewind reach them')
+    arg_parser.add_argument('--history-budget', type=float, default=HISTORY_BUDGET, metavar='MB',
+                            help=f'memory the history may take with --history=disk (default {HISTORY_BUDGET} MB)')
+    arg_parser.add_argument('--retention', default='all', metavar='POLICY',
+                            help='how much reversal history to keep: all (default), last:N for the last N steps, or '
+                                 'under:MB for at most MB megabytes; older history cannot be reversed or rewound to')
+    arg_parser.add_argument('--retain', action='append', default=[], metavar='NAME=POLICY',
+                            help='retention policy of a single variable, counting its own versions, e.g. x=last:100')
+    arg_parser.add_argument('--memory-limit', metavar='MB',
+                            help='memory the values and history of the program may take; once it is approached, '
+                                 'history is compacted, moved to disk and finally given up before the program is '
+                                 f'stopped (default ${MEMORY_LIMIT_VARIABLE} or {MEMORY_LIMIT} MB)')
+    args = arg_parser.parse_args()
+    if args.snapshot_interval < 0:
+        arg_parser.error('--snapshot-interval must not be negative')
+    if not math.isfinite(args.history_budget) or args.history_budget <= 0:
+        arg_parser.error('--history-budget must be a positive, finite number')
+    try:
+        retention = parse_policy(args.retention)
+        retain = {}
+        for option in args.retain:
+            var_name, separator, policy = option.partition('=')
+            if not separator or not var_name:
+                raise ValueError(f'Invalid --retain "{option}", expected NAME=POLICY')
+            retain[var_name] = parse_policy(policy)
+        memory_limit = resolve_memory_limit(args.memory_limit)
+    except ValueError as error:
+        arg_parser.error(str(error))
 
-    filename = sys.argv[1]
+    filename = args.filename
     if not filename.endswith('.ul'):
         print("Error: The file must have a .ul extension")
         sys.exit(1)
 
-    with open(filename, 'r') as file:
-        code = file.read()
-
-    tokens = tokenize(code)
-
-    parser = Parser(tokens)
-    ast = parser.parse()
+    ast = parse_file(filename)
 
     analyser = SemanticAnalyser(ast)
     analyser.analyse()
 
-    engine = Interpreter(ast)
+    if args.optimise:
+        ast = Optimiser(ast).optimise()
+
+    engine = ENGINES[args.engine](ast, snapshot_interval=args.snapshot_interval, history=args.history,
+                                  history_budget=args.history_budget, retention=retention, retain=retain,
+                                  memory_limit=memory_limit)
     engine.execute()
 
 
@@ -0,0 +1,141 @@
+/*
+ * Ulto - Imperative Reversible Programming Language
+ *
+ * ultokernel.c
+ *
+ * Aman Thapa Magar <at719@sussex.ac.uk>
+ *
+ * Batched arithmetic kernel. Evaluates a whole postfix expression in a single call instead of one FFI round trip per
+ * binary operator. Values are 64-bit; any result that does not fit is reported as STATUS_OVERFLOW so the caller can
+ * redo the expression with arbitrary precision integers. Loaded optionally by src/core/kernel.py; build it next to
+ * liboperations with
+ *
+ *     gcc -O2 -shared -fPIC -o src/libultokernel.so src/native/ultokernel.c
+ *     cl /O2 /LD src\native\ultokernel.c /Fe:src\ultokernel.dll
+ */
+
+#include <stdint.h>
+
+#ifdef _WIN32
+#define ULTO_EXPORT __declspec(dllexport)
+#else
+#define ULTO_EXPORT
+#endif
+
+#define ULTO_STACK_DEPTH 64
+
+enum {
+    OP_PUSH = 0,
+    OP_PLUS, OP_MINUS, OP_TIMES, OP_OVER, OP_MODULO, OP_INT_DIV,
+    OP_EQ, OP_NEQ, OP_LT, OP_GT, OP_LTE, OP_GTE, OP_AND, OP_OR
+};
+
+enum {
+    STATUS_OK = 0,
+    STATUS_ZERO_DIVISION = 1,
+    STATUS_BAD_PROGRAM = 2,
+    STATUS_OVERFLOW = 3
+};
+
+/* Checked 64-bit arithmetic, returning non-zero when the exact result does not fit. */
+#if defined(__GNUC__) || defined(__clang__)
+#define checked_add(a, b, out) __builtin_add_overflow(a, b, out)
+#define checked_sub(a, b, out) __builtin_sub_overflow(a, b, out)
+#define checked_mul(a, b, out) __builtin_mul_overflow(a, b, out)
+#else
+static int checked_add(int64_t a, int64_t b, int64_t *out)
+{
+    if ((b > 0 && a > INT64_MAX - b) || (b < 0 && a < INT64_MIN - b))
+        return 1;
+    *out = a + b;
+    return 0;
+}
+
+static int checked_sub(int64_t a, int64_t b, int64_t *out)
+{
+    if ((b < 0 && a > INT64_MAX + b) || (b > 0 && a < INT64_MIN + b))
+        return 1;
+    *out = a - b;
+    return 0;
+}
+
+static int checked_mul(int64_t a, int64_t b, int64_t *out)
+{
+    if (a > 0) {
+        if (b > 0 ? a > INT64_MAX / b : b < INT64_MIN / a)
+            return 1;
+    } else {
+        if (b > 0 ? a < INT64_MIN / b : (a != 0 && b < INT64_MAX / a))
+            return 1;
+    }
+    *out = a * b;
+    return 0;
+}
+#endif
+
+/*
+ * program: (opcode, argument) pairs. OP_PUSH pushes values[argument], every other opcode pops two operands
+ * and pushes the result.
+ * Returns a STATUS_* code and stores the value left on the stack in *result.
+ */
+ULTO_EXPORT int ulto_eval(const int32_t *program, int32_t length, const int64_t *values, int64_t *result)
+{
+    int64_t stack[ULTO_STACK_DEPTH];
+    int32_t top = 0;
+
+    for (int32_t pc = 0; pc < length; pc += 2) {
+        int32_t op = program[pc];
+        if (op == OP_PUSH) {
+            if (top == ULTO_STACK_DEPTH)
+                return STATUS_BAD_PROGRAM;
+            stack[top++] = values[program[pc + 1]];
+            continue;
+        }
+        if (top < 2)
+            return STATUS_BAD_PROGRAM;
+        int64_t right = stack[--top];
+        int64_t left = stack[top - 1];
+        int64_t value;
+        switch (op) {
+        case OP_PLUS:
+            if (checked_add(left, right, &value))
+                return STATUS_OVERFLOW;
+            break;
+        case OP_MINUS:
+            if (checked_sub(left, right, &value))
+                return STATUS_OVERFLOW;
+            break;
+        case OP_TIMES:
+            if (checked_mul(left, right, &value))
+                return STATUS_OVERFLOW;
+            break;
+        case OP_OVER:
+        case OP_INT_DIV:
+            if (right == 0)
+                return STATUS_ZERO_DIVISION;
+            if (left == INT64_MIN && right == -1)
+                return STATUS_OVERFLOW;
+            value = left / right;
+            break;
+        case OP_MODULO:
+            if (right == 0)
+                return STATUS_ZERO_DIVISION;
+            value = (right == -1) ? 0 : left % right;
+            break;
+        case OP_EQ: value = left == right; break;
+        case OP_NEQ: value = left != right; break;
+        case OP_LT: value = left < right; break;
+        case OP_GT: value = left > right; break;
+        case OP_LTE: value = left <= right; break;
+        case OP_GTE: value = left >= right; break;
+        case OP_AND: value = left && right; break;
+        case OP_OR: value = left || right; break;
+        default: return STATUS_BAD_PROGRAM;
+        }
+        stack[top - 1] = value;
+    }
+    if (top != 1)
+        return STATUS_BAD_PROGRAM;
+    *result = stack[0];
+    return STATUS_OK;
+}
@@ -0,0 +1,353 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# nodes.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+from enum import Enum, IntEnum
+
+
+class NodeType(IntEnum):
+    """
+    Type tags of the AST nodes. Tree walkers dispatch on `node.tag` instead of probing tuple shapes.
+    """
+    ASSIGN = 0
+    COMPOUND_ASSIGN = 1
+    REVERSE = 2
+    REVTRACE = 3
+    IF = 4
+    FOR = 5
+    WHILE = 6
+    PRINT = 7
+    BREAK = 8
+    NAME = 9
+    CONSTANT = 10
+    BINARY = 11
+    INDEX = 12
+    LEN = 13
+    LIST = 14
+    RANGE = 15
+    INVARIANT = 16
+    REWIND = 17
+    CONTINUE = 18
+
+
+class Operator(str, Enum):
+    """
+    Binary operators. Members compare and hash equal to the operator names of the tuple AST ('plus', 'lt', ...),
+    so tables keyed by those names accept them directly.
+    """
+    PLUS = 'plus'
+    MINUS = 'minus'
+    TIMES = 'times'
+    OVER = 'over'
+    MODULO = 'modulo'
+    INT_DIV = 'int_div'
+    EQ = 'eq'
+    NEQ = 'neq'
+    LT = 'lt'
+    GT = 'gt'
+    LTE = 'lte'
+    GTE = 'gte'
+    AND = 'and'
+    OR = 'or'
+
+
+class Node:
+    """
+    Base class of the AST nodes.
+
+    Nodes use `__slots__`, so they carry no per-instance dictionary. Every node records the line and column of
+    the token it starts at.
+
+    Attributes:
+        line (int or None): The source line of the node.
+        column (int or None): The source column of the node.
+    """
+    __slots__ = ('line', 'column')
+    tag = None
+    fields = ()
+
+    def __repr__(self):
+        args = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.fields)
+        return f'{type(self).__name__}({args})'
+
+    def to_tuple(self):
+        """
+        Converts the node to the tuple form the parser used to emit.
+
+        Returns:
+        The tuple (or plain value) representation of the node.
+        """
+        return to_tuple(self)
+
+
+class Assign(Node):
+    """
+    An assignment. `eager` tells whether its value is computed as it runs or lazily, as decided for the site by
+    the `DataFlowAnalyser`; assignments are lazy until it has run.
+    """
+    __slots__ = ('name', 'value', 'eager')
+    fields = ('name', 'value')
+    tag = NodeType.ASSIGN
+
+    def __init__(self, name, value, line=None, column=None):
+        self.name = name
+        self.value = value
+        self.eager = False
+        self.line = line
+        self.column = column
+
+
+class CompoundAssign(Node):
+    __slots__ = fields = ('op', 'name', 'value')
+    tag = NodeType.COMPOUND_ASSIGN
+
+    def __init__(self, op, name, value, line=None, column=None):
+        self.op = op
+        self.name = name
+        self.value = value
+        self.line = line
+        self.column = column
+
+
+class Reverse(Node):
+    __slots__ = fields = ('name',)
+    tag = NodeType.REVERSE
+
+    def __init__(self, name, line=None, column=None):
+        self.name = name
+        self.line = line
+        self.column = column
+
+
+class Revtrace(Node):
+    __slots__ = fields = ('name', 'index')
+    tag = NodeType.REVTRACE
+
+    def __init__(self, name, index, line=None, column=None):
+        self.name = name
+        self.index = index
+        self.line = line
+        self.column = column
+
+
+class If(Node):
+    __slots__ = fields = ('condition', 'body', 'elifs', 'orelse')
+    tag = NodeType.IF
+
+    def __init__(self, condition, body, elifs, orelse, line=None, column=None):
+        self.condition = condition
+        self.body = body
+        self.elifs = elifs
+        self.orelse = orelse
+        self.line = line
+        self.column = column
+
+
+class For(Node):
+    """
+    A for loop. `invariants` lists the `Invariant` expressions hoisted into the loop by the optimiser.
+    """
+    __slots__ = fields = ('target', 'iterable', 'body', 'invariants')
+    tag = NodeType.FOR
+
+    def __init__(self, target, iterable, body, invariants=(), line=None, column=None):
+        self.target = target
+        self.iterable = iterable
+        self.body = body
+        self.invariants = invariants
+        self.line = line
+        self.column = column
+
+
+class Range(Node):
+    __slots__ = fields = ('start', 'end', 'step')
+    tag = NodeType.RANGE
+
+    def __init__(self, start, end, step, line=None, column=None):
+        self.start = start
+        self.end = end
+        self.step = step
+        self.line = line
+        self.column = column
+
+
+class While(Node):
+    """
+    A while loop. `invariants` lists the `Invariant` expressions hoisted into the loop by the optimiser.
+    """
+    __slots__ = fields = ('condition', 'body', 'invariants')
+    tag = NodeType.WHILE
+
+    def __init__(self, condition, body, invariants=(), line=None, column=None):
+        self.condition = condition
+        self.body = body
+        self.invariants = invariants
+        self.line = line
+        self.column = column
+
+
+class Rewind(Node):
+    """
+    Rewinds every variable by a number of steps of the journal, see `LogStack.rewind`.
+    """
+    __slots__ = fields = ('steps',)
+    tag = NodeType.REWIND
+
+    def __init__(self, steps, line=None, column=None):
+        self.steps = steps
+        self.line = line
+        self.column = column
+
+
+class Print(Node):
+    __slots__ = fields = ('values',)
+    tag = NodeType.PRINT
+
+    def __init__(self, values, line=None, column=None):
+        self.values = values
+        self.line = line
+        self.column = column
+
+
+class Break(Node):
+    __slots__ = ()
+    tag = NodeType.BREAK
+
+    def __init__(self, line=None, column=None):
+        self.line = line
+        self.column = column
+
+
+class Continue(Node):
+    __slots__ = ()
+    tag = NodeType.CONTINUE
+
+    def __init__(self, line=None, column=None):
+        self.line = line
+        self.column = column
+
+
+class Name(Node):
+    __slots__ = fields = ('id',)
+    tag = NodeType.NAME
+
+    def __init__(self, id, line=None, column=None):
+        self.id = id
+        self.line = line
+        self.column = column
+
+
+class Constant(Node):
+    """
+    A literal: an integer, a boolean, or a string still enclosed in its double quotes or backticks.
+    """
+    __slots__ = fields = ('value',)
+    tag = NodeType.CONSTANT
+
+    def __init__(self, value, line=None, column=None):
+        self.value = value
+        self.line = line
+        self.column = column
+
+
+class Binary(Node):
+    __slots__ = fields = ('left', 'op', 'right')
+    tag = NodeType.BINARY
+
+    def __init__(self, left, op, right, line=None, column=None):
+        self.left = left
+        self.op = op
+        self.right = right
+        self.line = line
+        self.column = column
+
+
+class Index(Node):
+    __slots__ = fields = ('target', 'index')
+    tag = NodeType.INDEX
+
+    def __init__(self, target, index, line=None, column=None):
+        self.target = target
+        self.index = index
+        self.line = line
+        self.column = column
+
+
+class Len(Node):
+    __slots__ = fields = ('value',)
+    tag = NodeType.LEN
+
+    def __init__(self, value, line=None, column=None):
+        self.value = value
+        self.line = line
+        self.column = column
+
+
+class ListLiteral(Node):
+    __slots__ = fields = ('elements',)
+    tag = NodeType.LIST
+
+    def __init__(self, elements, line=None, column=None):
+        self.elements = elements
+        self.line = line
+        self.column = column
+
+
+class Invariant(Node):
+    """
+    An expression none of whose variables is written inside the loop listing it in its `invariants`. It is
+    evaluated when first needed after the loop is entered, and that value is reused until the loop is entered
+    again.
+    """
+    __slots__ = fields = ('value',)
+    tag = NodeType.INVARIANT
+
+    def __init__(self, value, line=None, column=None):
+        self.value = value
+        self.line = line
+        self.column = column
+
+
+TUPLE_CONVERTERS = {
+    NodeType.ASSIGN: lambda node: ('assign', node.name, to_tuple(node.value)),
+    NodeType.COMPOUND_ASSIGN: lambda node: (f'{node.op.value}_assign', node.name, to_tuple(node.value)),
+    NodeType.REVERSE: lambda node: ('reverse', node.name),
+    NodeType.REVTRACE: lambda node: ('revtrace', node.name, to_tuple(node.index)),
+    NodeType.REWIND: lambda node: ('rewind', to_tuple(node.steps)),
+    NodeType.IF: lambda node: ('if', to_tuple(node.condition), to_tuple(node.body),
+                               [(to_tuple(condition), to_tuple(body)) for condition, body in node.elifs],
+                               to_tuple(node.orelse)),
+    NodeType.FOR: lambda node: ('for', node.target, to_tuple(node.iterable), to_tuple(node.body)),
+    NodeType.RANGE: lambda node: ('range', to_tuple(node.start), to_tuple(node.end), to_tuple(node.step)),
+    NodeType.WHILE: lambda node: ('while', to_tuple(node.condition), to_tuple(node.body)),
+    NodeType.PRINT: lambda node: ('print', to_tuple(node.values)),
+    NodeType.BREAK: lambda node: ('break',),
+    NodeType.CONTINUE: lambda node: ('continue',),
+    NodeType.NAME: lambda node: node.id,
+    NodeType.CONSTANT: lambda node: node.value,
+    NodeType.BINARY: lambda node: (to_tuple(node.left), node.op.value, to_tuple(node.right)),
+    NodeType.INDEX: lambda node: (node.target.id, 'index', to_tuple(node.index)),
+    NodeType.LEN: lambda node: ('len', to_tuple(node.value)),
+    NodeType.LIST: lambda node: to_tuple(node.elements),
+    NodeType.INVARIANT: lambda node: to_tuple(node.value),
+}
+
+
+def to_tuple(node):
+    """
+    Converts a node, a list of nodes or a whole program to the tuple form the parser used to emit, e.g.
+    `('assign', 'x', ('y', 'plus', 1))`.
+
+    Args:
+    node (Node, list or None): The node(s) to convert.
+
+    Returns:
+    The tuple representation.
+    """
+    if isinstance(node, list):
+        return [to_tuple(item) for item in node]
+    if isinstance(node, Node):
+        return TUPLE_CONVERTERS[node.tag](node)
+    return node
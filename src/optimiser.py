@@ -0,0 +1,581 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# optimiser.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+from collections import Counter
+from src.core.kernel import OPERATORS
+from src.nodes import (NodeType, Assign, CompoundAssign, Revtrace, Rewind, If, For, Range, While, Print,
+                       Constant, Binary, Index, Len, ListLiteral, Invariant)
+
+# Sub-expressions are hoisted out of a loop from this many operators on. Below it, reading the cached value costs
+# about as much as computing it, and the expression would no longer be fused by the ArithmeticKernel. A whole
+# statement expression is hoisted from one operator on.
+MIN_HOISTED_OPERATORS = 2
+
+# The key `count_writes` counts `rewind` statements under, as they may write any variable. It is not a valid
+# identifier, so it never clashes with a variable name.
+EVERY_VARIABLE = '*'
+
+
+def is_constant(node):
+    """
+    Checks whether a node is an integer or boolean literal, the only constants the optimiser computes with.
+
+    Args:
+    node (Node): The node.
+
+    Returns:
+    bool: True if the node is a numeric constant.
+    """
+    return node.tag == NodeType.CONSTANT and isinstance(node.value, int)
+
+
+def count_writes(statements, writes):
+    """
+    Counts the statements writing each variable, including the implicit writes of loops and of `rev`. `rewind`
+    statements are counted under EVERY_VARIABLE.
+
+    Args:
+    statements (list): The statements to be scanned.
+    writes (Counter): The counter to be updated.
+
+    Returns:
+    Counter: `writes`.
+    """
+    for node in statements:
+        tag = node.tag
+        if tag == NodeType.ASSIGN or tag == NodeType.COMPOUND_ASSIGN or tag == NodeType.REVERSE:
+            writes[node.name] += 1
+        elif tag == NodeType.REWIND:
+            writes[EVERY_VARIABLE] += 1
+        elif tag == NodeType.FOR:
+            writes[node.target] += 1
+            count_writes(node.body, writes)
+        elif tag == NodeType.WHILE:
+            count_writes(node.body, writes)
+        elif tag == NodeType.IF:
+            count_writes(node.body, writes)
+            for _, branch in node.elifs:
+                count_writes(branch, writes)
+            count_writes(node.orelse, writes)
+    return writes
+
+
+def scan_expression(expr, names):
+    """
+    Collects the variables an expression reads and counts its operators.
+
+    Args:
+    expr (Node): The expression.
+    names (set): The set collecting the variable names.
+
+    Returns:
+    int: The number of operators, or -1 if the expression builds a list and must be evaluated every time.
+    """
+    tag = expr.tag
+    if tag == NodeType.NAME:
+        names.add(expr.id)
+        return 0
+    elif tag == NodeType.BINARY:
+        left = scan_expression(expr.left, names)
+        right = scan_expression(expr.right, names)
+        return -1 if left < 0 or right < 0 else left + right + 1
+    elif tag == NodeType.INDEX:
+        names.add(expr.target.id)
+        index = scan_expression(expr.index, names)
+        return -1 if index < 0 else index + 1
+    elif tag == NodeType.LEN:
+        value = scan_expression(expr.value, names)
+        return -1 if value < 0 else value + 1
+    elif tag == NodeType.CONSTANT:
+        return 0
+    return -1
+
+
+class Optimiser:
+    """
+    An optimisation pass rewriting the AST of an Ulto program before it is executed.
+
+    The `Optimiser` folds constant sub-expressions, including comparisons and logical operators, with the operator
+    implementations the interpreter uses, so a folded value is exactly the value the program would have computed.
+    Variables assigned a constant exactly once, at the top level of the program, and never reversed are propagated into
+    the statements following their assignment, unless the program rewinds. `if`, `elif` and `while` statements whose
+    condition folds to a constant lose the branches that can never run. Expressions whose evaluation raises, such as a
+    division by zero, are left for the runtime to report.
+
+    A second pass hoists loop-invariant expressions: an expression none of whose variables is written anywhere
+    in a loop, counting the loop variable and every variable reversed with `rev`, and in a loop without
+    `rewind`, is wrapped in an `Invariant` listed by the outermost such loop. The engines evaluate it when it
+    is first needed after entering that loop and reuse the value until the loop is entered again, so it is
+    never evaluated where the original program would not have evaluated it.
+
+    The original AST is not modified; rewritten statements are new nodes keeping the source positions of the
+    nodes they replace.
+
+    Attributes:
+        ast (list): The abstract syntax tree to be optimised.
+        writes (Counter): The number of statements writing each variable.
+        constants (dict): Variables known to hold a constant, mapped to their value.
+        depth (int): The nesting depth of the statement being optimised.
+        folded (int): The number of expressions folded into a constant.
+        propagated (int): The number of variable reads replaced by a constant.
+        eliminated (int): The number of branches and loops removed as unreachable.
+        hoisted (int): The number of loop-invariant expressions hoisted.
+        loops (list): The (written variables, hoisted invariants) of every loop enclosing the statement being
+                      hoisted, outermost first.
+        statement_optimisers (dict): Maps statement node types to the method optimising them.
+        statement_hoisters (dict): Maps statement node types to the method hoisting their invariants.
+    """
+    def __init__(self, ast):
+        """
+        Initializes the Optimiser with the given AST.
+
+        Args:
+        ast (list): The abstract syntax tree.
+        """
+        self.ast = ast
+        self.writes = Counter()
+        self.constants = {}
+        self.depth = 0
+        self.folded = 0
+        self.propagated = 0
+        self.eliminated = 0
+        self.hoisted = 0
+        self.loops = []
+        self.statement_hoisters = {
+            NodeType.ASSIGN: self.hoist_assignment,
+            NodeType.COMPOUND_ASSIGN: self.hoist_compound_assignment,
+            NodeType.REVTRACE: self.hoist_revtrace,
+            NodeType.REWIND: self.hoist_rewind,
+            NodeType.IF: self.hoist_if,
+            NodeType.FOR: self.hoist_for,
+            NodeType.WHILE: self.hoist_while,
+            NodeType.PRINT: self.hoist_print,
+        }
+        self.statement_optimisers = {
+            NodeType.ASSIGN: self.optimise_assignment,
+            NodeType.COMPOUND_ASSIGN: self.optimise_compound_assignment,
+            NodeType.REVTRACE: self.optimise_revtrace,
+            NodeType.REWIND: self.optimise_rewind,
+            NodeType.IF: self.optimise_if,
+            NodeType.FOR: self.optimise_for,
+            NodeType.WHILE: self.optimise_while,
+            NodeType.PRINT: self.optimise_print,
+        }
+
+    def optimise(self):
+        """
+        Optimises the AST.
+
+        Returns:
+        list: The optimised abstract syntax tree.
+        """
+        count_writes(self.ast, self.writes)
+        return self.hoist_block(self.optimise_block(self.ast))
+
+    def optimise_block(self, statements):
+        """
+        Optimises a list of statements.
+
+        Args:
+        statements (list): The statements.
+
+        Returns:
+        list: The optimised statements.
+        """
+        optimised = []
+        for node in statements:
+            optimise = self.statement_optimisers.get(node.tag)
+            if optimise is None:
+                optimised.append(node)
+            else:
+                optimised.extend(optimise(node))
+        return optimised
+
+    def optimise_nested_block(self, statements):
+        """
+        Optimises the statements of a branch or loop body, one level deeper than the enclosing statement.
+
+        Args:
+        statements (list): The statements.
+
+        Returns:
+        list: The optimised statements.
+        """
+        self.depth += 1
+        try:
+            return self.optimise_block(statements)
+        finally:
+            self.depth -= 1
+
+    def optimise_assignment(self, node):
+        """
+        Folds the assigned value, recording it as a constant if the variable is never written again.
+
+        Args:
+        node (Assign): The assignment node.
+
+        Returns:
+        list: The optimised statement.
+        """
+        value = self.fold(node.value)
+        if (self.depth == 0 and is_constant(value) and self.writes[node.name] == 1
+                and not self.writes[EVERY_VARIABLE]):
+            self.constants[node.name] = value.value
+        if value is node.value:
+            return [node]
+        return [Assign(node.name, value, node.line, node.column)]
+
+    def optimise_compound_assignment(self, node):
+        """
+        Folds the value of a compound assignment.
+
+        Args:
+        node (CompoundAssign): The compound assignment node.
+
+        Returns:
+        list: The optimised statement.
+        """
+        value = self.fold(node.value)
+        if value is node.value:
+            return [node]
+        return [CompoundAssign(node.op, node.name, value, node.line, node.column)]
+
+    def optimise_revtrace(self, node):
+        """
+        Folds the index of a revtrace node.
+
+        Args:
+        node (Revtrace): The revtrace node.
+
+        Returns:
+        list: The optimised statement.
+        """
+        index = self.fold(node.index)
+        if index is node.index:
+            return [node]
+        return [Revtrace(node.name, index, node.line, node.column)]
+
+    def optimise_rewind(self, node):
+        """
+        Folds the number of steps of a rewind node.
+
+        Args:
+        node (Rewind): The rewind node.
+
+        Returns:
+        list: The optimised statement.
+        """
+        steps = self.fold(node.steps)
+        if steps is node.steps:
+            return [node]
+        return [Rewind(steps, node.line, node.column)]
+
+    def optimise_print(self, node):
+        """
+        Folds the values of a print node.
+
+        Args:
+        node (Print): The print node.
+
+        Returns:
+        list: The optimised statement.
+        """
+        values = [self.fold(value) for value in node.values]
+        if all(value is original for value, original in zip(values, node.values)):
+            return [node]
+        return [Print(values, node.line, node.column)]
+
+    def optimise_if(self, node):
+        """
+        Folds the conditions of an if node, dropping branches that can never run.
+
+        A branch whose condition is constantly true replaces the remaining branches; when it is the first one
+        left, its statements replace the whole if statement.
+
+        Args:
+        node (If): The if node.
+
+        Returns:
+        list: The optimised statements.
+        """
+        branches = []
+        orelse = node.orelse
+        for condition, body in [(node.condition, node.body)] + list(node.elifs):
+            condition = self.fold(condition)
+            if not is_constant(condition):
+                branches.append((condition, self.optimise_nested_block(body)))
+                continue
+            self.eliminated += 1
+            if condition.value:
+                orelse = body
+                break
+
+        if not branches:
+            return self.optimise_nested_block(orelse)
+        (condition, body), elifs = branches[0], branches[1:]
+        return [If(condition, body, elifs, self.optimise_nested_block(orelse), node.line, node.column)]
+
+    def optimise_while(self, node):
+        """
+        Folds the condition of a while node, removing the loop if it never runs.
+
+        Args:
+        node (While): The while node.
+
+        Returns:
+        list: The optimised statements.
+        """
+        condition = self.fold(node.condition)
+        if is_constant(condition) and not condition.value:
+            self.eliminated += 1
+            return []
+        return [While(condition, self.optimise_nested_block(node.body), [], node.line, node.column)]
+
+    def optimise_for(self, node):
+        """
+        Folds the range bounds or the iterated expression of a for loop node.
+
+        Args:
+        node (For): The for loop node.
+
+        Returns:
+        list: The optimised statement.
+        """
+        iterable = node.iterable
+        if iterable.tag == NodeType.RANGE:
+            step = self.fold(iterable.step) if iterable.step else iterable.step
+            iterable = Range(self.fold(iterable.start), self.fold(iterable.end), step, iterable.line, iterable.column)
+        elif iterable.tag != NodeType.NAME:
+            iterable = self.fold(iterable)
+        return [For(node.target, iterable, self.optimise_nested_block(node.body), [], node.line, node.column)]
+
+    def fold(self, expr):
+        """
+        Folds the constant sub-expressions of an expression, substituting the values of constant variables.
+
+        Args:
+        expr (Node): The expression.
+
+        Returns:
+        Node: The folded expression, `expr` itself if nothing changed.
+        """
+        tag = expr.tag
+        if tag == NodeType.NAME:
+            if expr.id in self.constants:
+                self.propagated += 1
+                return Constant(self.constants[expr.id], expr.line, expr.column)
+            return expr
+        elif tag == NodeType.BINARY:
+            left = self.fold(expr.left)
+            right = self.fold(expr.right)
+            if is_constant(left) and is_constant(right):
+                try:
+                    value = OPERATORS[expr.op](left.value, right.value)
+                except ZeroDivisionError:
+                    pass
+                else:
+                    self.folded += 1
+                    return Constant(value, expr.line, expr.column)
+            if left is expr.left and right is expr.right:
+                return expr
+            return Binary(left, expr.op, right, expr.line, expr.column)
+        elif tag == NodeType.INDEX:
+            index = self.fold(expr.index)
+            return expr if index is expr.index else Index(expr.target, index, expr.line, expr.column)
+        elif tag == NodeType.LEN:
+            value = self.fold(expr.value)
+            return expr if value is expr.value else Len(value, expr.line, expr.column)
+        elif tag == NodeType.LIST:
+            elements = [self.fold(element) for element in expr.elements]
+            if all(element is original for element, original in zip(elements, expr.elements)):
+                return expr
+            return ListLiteral(elements, expr.line, expr.column)
+        return expr
+
+    def hoist_block(self, statements):
+        """
+        Hoists the loop-invariant expressions of a list of statements.
+
+        Args:
+        statements (list): The statements.
+
+        Returns:
+        list: The statements with their invariant expressions wrapped.
+        """
+        hoisted = []
+        for node in statements:
+            hoist = self.statement_hoisters.get(node.tag)
+            hoisted.append(node if hoist is None else hoist(node))
+        return hoisted
+
+    def hoist_assignment(self, node):
+        """
+        Hoists the invariant expressions of the value of an assignment.
+
+        Args:
+        node (Assign): The assignment node.
+
+        Returns:
+        Assign: The assignment, `node` itself if nothing was hoisted.
+        """
+        value = self.hoist(node.value, True)
+        return node if value is node.value else Assign(node.name, value, node.line, node.column)
+
+    def hoist_compound_assignment(self, node):
+        """
+        Hoists the invariant expressions of the value of a compound assignment.
+
+        Args:
+        node (CompoundAssign): The compound assignment node.
+
+        Returns:
+        CompoundAssign: The compound assignment, `node` itself if nothing was hoisted.
+        """
+        value = self.hoist(node.value, True)
+        return node if value is node.value else CompoundAssign(node.op, node.name, value, node.line, node.column)
+
+    def hoist_revtrace(self, node):
+        """
+        Hoists the invariant expressions of the index of a revtrace node.
+
+        Args:
+        node (Revtrace): The revtrace node.
+
+        Returns:
+        Revtrace: The revtrace node, `node` itself if nothing was hoisted.
+        """
+        index = self.hoist(node.index, True)
+        return node if index is node.index else Revtrace(node.name, index, node.line, node.column)
+
+    def hoist_rewind(self, node):
+        """
+        Hoists the invariant expressions of the number of steps of a rewind node.
+
+        Args:
+        node (Rewind): The rewind node.
+
+        Returns:
+        Rewind: The rewind node, `node` itself if nothing was hoisted.
+        """
+        steps = self.hoist(node.steps, True)
+        return node if steps is node.steps else Rewind(steps, node.line, node.column)
+
+    def hoist_print(self, node):
+        """
+        Hoists the invariant expressions of the values of a print node.
+
+        Args:
+        node (Print): The print node.
+
+        Returns:
+        Print: The print node, `node` itself if nothing was hoisted.
+        """
+        values = [self.hoist(value, True) for value in node.values]
+        if all(value is original for value, original in zip(values, node.values)):
+            return node
+        return Print(values, node.line, node.column)
+
+    def hoist_if(self, node):
+        """
+        Hoists the invariant expressions of the conditions and branches of an if node.
+
+        Args:
+        node (If): The if node.
+
+        Returns:
+        If: The if node with its conditions and branches hoisted.
+        """
+        elifs = [(self.hoist(condition, True), self.hoist_block(body)) for condition, body in node.elifs]
+        return If(self.hoist(node.condition, True), self.hoist_block(node.body), elifs,
+                  self.hoist_block(node.orelse), node.line, node.column)
+
+    def hoist_while(self, node):
+        """
+        Hoists the invariant expressions of a while loop, its condition included.
+
+        Args:
+        node (While): The while node.
+
+        Returns:
+        While: The loop, listing the invariants hoisted into it.
+        """
+        invariants = []
+        self.loops.append((count_writes([node], Counter()), invariants))
+        try:
+            condition = self.hoist(node.condition, True)
+            body = self.hoist_block(node.body)
+        finally:
+            self.loops.pop()
+        return While(condition, body, invariants, node.line, node.column)
+
+    def hoist_for(self, node):
+        """
+        Hoists the invariant expressions of a for loop. The iterable is evaluated once, before the loop starts,
+        so only enclosing loops can take its invariants.
+
+        Args:
+        node (For): The for loop node.
+
+        Returns:
+        For: The loop, listing the invariants hoisted into it.
+        """
+        iterable = node.iterable
+        if iterable.tag == NodeType.RANGE:
+            step = self.hoist(iterable.step, True) if iterable.step else iterable.step
+            iterable = Range(self.hoist(iterable.start, True), self.hoist(iterable.end, True), step,
+                             iterable.line, iterable.column)
+        else:
+            iterable = self.hoist(iterable, True)
+        invariants = []
+        self.loops.append((count_writes([node], Counter()), invariants))
+        try:
+            body = self.hoist_block(node.body)
+        finally:
+            self.loops.pop()
+        return For(node.target, iterable, body, invariants, node.line, node.column)
+
+    def hoist(self, expr, whole=False):
+        """
+        Wraps the largest loop-invariant sub-expressions of an expression in `Invariant` nodes.
+
+        Args:
+        expr (Node): The expression.
+        whole (bool): Whether the expression is the whole value of a statement.
+
+        Returns:
+        Node: The expression with its invariant parts wrapped, `expr` itself if nothing changed.
+        """
+        if not self.loops:
+            return expr
+        names = set()
+        operators = scan_expression(expr, names)
+        if operators >= (1 if whole else MIN_HOISTED_OPERATORS):
+            for written, invariants in self.loops:
+                if EVERY_VARIABLE not in written and names.isdisjoint(written):
+                    invariant = Invariant(expr, expr.line, expr.column)
+                    invariants.append(invariant)
+                    self.hoisted += 1
+                    return invariant
+
+        tag = expr.tag
+        if tag == NodeType.BINARY:
+            left = self.hoist(expr.left)
+            right = self.hoist(expr.right)
+            if left is expr.left and right is expr.right:
+                return expr
+            return Binary(left, expr.op, right, expr.line, expr.column)
+        elif tag == NodeType.INDEX:
+            index = self.hoist(expr.index)
+            return expr if index is expr.index else Index(expr.target, index, expr.line, expr.column)
+        elif tag == NodeType.LEN:
+            value = self.hoist(expr.value)
+            return expr if value is expr.value else Len(value, expr.line, expr.column)
+        elif tag == NodeType.LIST:
+            elements = [self.hoist(element) for element in expr.elements]
+            if all(element is original for element, original in zip(elements, expr.elements)):
+                return expr
+            return ListLiteral(elements, expr.line, expr.column)
+        return expr
@@ -4,34 +4,52 @@
 #
 # Aman Thapa Magar <at719@sussex.ac.uk>
 
-# Ulto - Imperative Reversible Programming Language
-#
-# parser.py
-#
-# Aman Thapa Magar <at719@sussex.ac.uk>
+from collections import deque
+from src.nodes import (Assign, CompoundAssign, Reverse, Revtrace, Rewind, If, For, Range, While, Print, Break, Continue,
+                       Name, Constant, Binary, Index, Len, ListLiteral, Operator)
+
+COMPOUND_OPERATORS = {
+    'PLUS_ASSIGN': Operator.PLUS,
+    'MINUS_ASSIGN': Operator.MINUS,
+    'TIMES_ASSIGN': Operator.TIMES,
+    'OVER_ASSIGN': Operator.OVER,
+}
+
+BINARY_OPERATORS = {
+    'PLUS': Operator.PLUS, 'MINUS': Operator.MINUS, 'TIMES': Operator.TIMES, 'OVER': Operator.OVER,
+    'EQ': Operator.EQ, 'NEQ': Operator.NEQ, 'LT': Operator.LT, 'GT': Operator.GT, 'LTE': Operator.LTE,
+    'GTE': Operator.GTE, 'AND': Operator.AND, 'OR': Operator.OR, 'MODULO': Operator.MODULO,
+    'INT_DIV': Operator.INT_DIV,
+}
+
 
 class Parser:
     """
     A parser for the Ulto programming language.
 
-    The `Parser` class is responsible for converting a list of tokens, generated by the lexical analyzer,
-    into an abstract syntax tree (AST) representing the structure of the Ulto program. It supports various
+    The `Parser` class is responsible for converting the tokens generated by the lexical analyzer into an
+    abstract syntax tree (AST) representing the structure of the Ulto program. It supports various
     statements such as assignments, loops, conditional branches, and more, and ensures that the syntax of
-    the input program is valid according to the language's grammar.
+    the input program is valid according to the language's grammar. Tokens are pulled from an iterator as the
+    parser advances, with a small lookahead buffer for `peek_next_token`, so the token stream of a program
+    never has to be held in memory as a whole. The AST is built from the node classes of `src.nodes`, each
+    carrying the line and column it starts at; `to_tuple` converts it to the older tuple form.
 
     Attributes:
-        tokens (list): The list of tokens to be parsed.
+        tokens (iterator): The tokens still to be parsed.
+        lookahead (deque): Tokens already pulled from the iterator by peeking, but not consumed yet.
         current_token (tuple or None): The current token being processed.
-        pos (int): The current position in the token list.
+        pos (int): The number of tokens consumed so far.
     """
     def __init__(self, tokens):
         """
         Initializes the parser with the given tokens.
 
         Args:
-        tokens (list): The list of tokens.
+        tokens (iterable): The tokens, for example a list or the generator returned by `generate_tokens`.
         """
-        self.tokens = tokens
+        self.tokens = iter(tokens)
+        self.lookahead = deque()
         self.current_token = None
         self.pos = 0
         self.advance()
@@ -40,53 +58,63 @@ class Parser:
         """
         Advances to the next token.
         """
-        if self.pos < len(self.tokens):
-            self.current_token = self.tokens[self.pos]
-            self.pos += 1
+        if self.lookahead:
+            self.current_token = self.lookahead.popleft()
         else:
-            self.current_token = None
+            self.current_token = next(self.tokens, None)
+        if self.current_token is not None:
+            self.pos += 1
 
     def parse(self):
         """
         Parses the tokens into an abstract syntax tree (AST).
 
         Returns:
-        list: The parsed AST.
+        list: The parsed AST, a list of statement nodes.
+        """
+        return list(self.parse_statements())
+
+    def parse_statements(self):
+        """
+        Parses the tokens one top-level statement at a time.
+
+        Yields:
+        Node: The parsed statement nodes, in program order.
         """
-        statements = []
         while self.current_token is not None:
             if self.current_token[0] == 'ID':
                 next_token_type = self.peek_next_token()[0]
                 if next_token_type in ['ASSIGN', 'PLUS_ASSIGN', 'MINUS_ASSIGN', 'TIMES_ASSIGN', 'OVER_ASSIGN']:
-                    statements.append(self.parse_assignment())
+                    yield self.parse_assignment()
                 else:
                     self.error()
             elif self.current_token[0] == 'REV':
-                statements.append(self.parse_reverse())
+                yield self.parse_reverse()
             elif self.current_token[0] == 'REVTRACE':
-                statements.append(self.parse_revtrace())
+                yield self.parse_revtrace()
+            elif self.current_token[0] == 'REWIND':
+                yield self.parse_rewind()
             elif self.current_token[0] == 'IF':
-                statements.append(self.parse_if())
+                yield self.parse_if()
             elif self.current_token[0] == 'FOR':
-                statements.append(self.parse_for())
+                yield self.parse_for()
             elif self.current_token[0] == 'WHILE':
-                statements.append(self.parse_while())
+                yield self.parse_while()
             elif self.current_token[0] == 'PRINT':
-                statements.append(self.parse_print())
+                yield self.parse_print()
             elif self.current_token[0] == 'INDENT':
                 self.consume('INDENT')
-                statements.extend(self.parse_block())
+                yield from self.parse_block()
                 self.consume('DEDENT')
             else:
                 self.error()
-        return statements
 
     def parse_statement(self):
         """
         Parses a single statement.
 
         Returns:
-        tuple: The parsed statement node.
+        Node: The parsed statement node.
         """
         if self.current_token[0] == 'ID':
             next_token = self.peek_next_token()[0]
@@ -100,6 +128,8 @@ class Parser:
             return self.parse_reverse()
         elif self.current_token[0] == 'REVTRACE':
             return self.parse_revtrace()
+        elif self.current_token[0] == 'REWIND':
+            return self.parse_rewind()
         elif self.current_token[0] == 'IF':
             return self.parse_if()
         elif self.current_token[0] == 'FOR':
@@ -110,6 +140,8 @@ class Parser:
             return self.parse_print()
         elif self.current_token[0] == 'BREAK':
             return self.parse_break()
+        elif self.current_token[0] == 'CONTINUE':
+            return self.parse_continue()
         else:
             self.error()
 
@@ -118,29 +150,19 @@ class Parser:
         Parses an assignment statement.
 
         Returns:
-        tuple: The parsed assignment node.
+        Assign or CompoundAssign: The parsed assignment node.
         """
+        line, column = self.position()
         var_name = self.consume('ID')
         if self.current_token[0] == 'ASSIGN':
             self.consume('ASSIGN')
             value = self.parse_expression()
-            return ('assign', var_name, value)
-        elif self.current_token[0] == 'PLUS_ASSIGN':
-            self.consume('PLUS_ASSIGN')
-            value = self.parse_expression()
-            return ('plus_assign', var_name, value)
-        elif self.current_token[0] == 'MINUS_ASSIGN':
-            self.consume('MINUS_ASSIGN')
-            value = self.parse_expression()
-            return ('minus_assign', var_name, value)
-        elif self.current_token[0] == 'TIMES_ASSIGN':
-            self.consume('TIMES_ASSIGN')
-            value = self.parse_expression()
-            return ('times_assign', var_name, value)
-        elif self.current_token[0] == 'OVER_ASSIGN':
-            self.consume('OVER_ASSIGN')
+            return Assign(var_name, value, line, column)
+        elif self.current_token[0] in COMPOUND_OPERATORS:
+            op = COMPOUND_OPERATORS[self.current_token[0]]
+            self.advance()
             value = self.parse_expression()
-            return ('over_assign', var_name, value)
+            return CompoundAssign(op, var_name, value, line, column)
         else:
             self.error()
 
@@ -149,25 +171,25 @@ class Parser:
         Parses an expression.
 
         Returns:
-        tuple: The parsed expression node.
+        Node: The parsed expression node.
         """
         if self.current_token[0] == 'LEN':
+            line, column = self.position()
             self.advance()
             self.consume('LPAREN')
             expr = self.parse_expression()  # Parse the expression inside len()
             self.consume('RPAREN')
-            return ('len', expr)
+            return Len(expr, line, column)
         else:
             left = self.parse_primary_expression()
 
-            while self.current_token and self.current_token[0] in (
-                    'PLUS', 'MINUS', 'TIMES', 'OVER', 'EQ', 'NEQ', 'LT', 'GT', 'LTE', 'GTE', 'DOT', 'AND', 'OR', 'MODULO', 'INT_DIV'):
-                op = self.current_token[0].lower()
+            while self.current_token and self.current_token[0] in BINARY_OPERATORS:
+                op = BINARY_OPERATORS[self.current_token[0]]
                 self.advance()
 
                 right = self.parse_primary_expression()
 
-                left = (left, op, right)
+                left = Binary(left, op, right, left.line, left.column)
 
             return left
 
@@ -177,6 +199,7 @@ class Parser:
         Returns:
         The parsed expression.
         """
+        line, column = self.position()
         if self.current_token[0] == 'LPAREN':
             self.consume('LPAREN')
             expr = self.parse_expression()  # Parse the entire sub-expression within parentheses
@@ -187,15 +210,15 @@ class Parser:
             self.consume('LPAREN')
             expr = self.parse_expression()
             self.consume('RPAREN')
-            return ('len', expr)
+            return Len(expr, line, column)
         elif self.current_token[0] == 'ID':
-            id_token = self.consume('ID')
+            id_token = Name(self.consume('ID'), line, column)
 
             if self.current_token and self.current_token[0] == 'LBRACKET':
                 self.consume('LBRACKET')
                 index_expr = self.parse_expression()  # Parse the expression inside the brackets
                 self.consume('RBRACKET')
-                return (id_token, 'index', index_expr)
+                return Index(id_token, index_expr, line, column)
 
             return id_token
 
@@ -207,49 +230,76 @@ class Parser:
         Parses a break statement.
 
         Returns:
-        tuple: The parsed break node.
+        Break: The parsed break node.
         """
+        line, column = self.position()
         self.consume('BREAK')
-        return ('break',)
+        return Break(line, column)
+
+    def parse_continue(self):
+        """
+        Parses a continue statement.
+
+        Returns:
+        Continue: The parsed continue node.
+        """
+        line, column = self.position()
+        self.consume('CONTINUE')
+        return Continue(line, column)
 
     def parse_reverse(self):
         """
         Parses a reverse statement.
 
         Returns:
-        tuple: The parsed reverse node.
+        Reverse: The parsed reverse node.
         """
+        line, column = self.position()
         self.consume('REV')
         var_name = self.consume('ID')
-        return ('reverse', var_name)
+        return Reverse(var_name, line, column)
 
     def parse_revtrace(self):
         """
         Parses a revtrace statement.
 
         Returns:
-        tuple: The parsed revtrace node.
+        Revtrace: The parsed revtrace node.
         """
+        line, column = self.position()
         self.consume('REVTRACE')
         var_name = self.consume('ID')
         index = self.parse_expression()
-        return ('revtrace', var_name, index)
+        return Revtrace(var_name, index, line, column)
+
+    def parse_rewind(self):
+        """
+        Parses a rewind statement.
+
+        Returns:
+        Rewind: The parsed rewind node.
+        """
+        line, column = self.position()
+        self.consume('REWIND')
+        steps = self.parse_expression()
+        return Rewind(steps, line, column)
 
     def parse_if(self):
         """
         Parses an if statement.
 
         Returns:
-        tuple: The parsed if node.
+        If: The parsed if node.
         """
+        line, column = self.position()
         self.consume('IF')
         condition = self.parse_expression()
 
         while self.current_token and self.current_token[0] in ['AND', 'OR']:
-            op = self.current_token[0].lower()
+            op = BINARY_OPERATORS[self.current_token[0]]
             self.advance()
             right_condition = self.parse_expression()
-            condition = (condition, op, right_condition)
+            condition = Binary(condition, op, right_condition, condition.line, condition.column)
 
         self.consume('COLON')
         true_branch = self.parse_block()
@@ -269,7 +319,7 @@ class Parser:
             self.consume('COLON')
             false_branch = self.parse_block()
 
-        result = ('if', condition, true_branch, elif_branches, false_branch)
+        result = If(condition, true_branch, elif_branches, false_branch, line, column)
         return result
 
     def parse_for(self):
@@ -277,8 +327,9 @@ class Parser:
         Parses a for loop statement.
 
         Returns:
-        tuple: The parsed for loop node.
+        For: The parsed for loop node.
         """
+        line, column = self.position()
         self.consume('FOR')
         var_name = self.consume('ID')
         self.consume('IN')
@@ -287,6 +338,7 @@ class Parser:
             iterable = self.consume_value()
 
         elif self.current_token[0] == 'RANGE':
+            range_line, range_column = self.position()
             self.consume('RANGE')
             self.consume('LPAREN')
             start_value = self.parse_expression()
@@ -300,26 +352,27 @@ class Parser:
                     step_value = self.parse_expression()
             else:
                 end_value = start_value
-                start_value = ('NUMBER', 0)
+                start_value = Constant(0, range_line, range_column)
                 step_value = None
 
             self.consume('RPAREN')
-            iterable = ('range', start_value, end_value, step_value)
+            iterable = Range(start_value, end_value, step_value, range_line, range_column)
 
         else:
             iterable = self.parse_expression()
 
         self.consume('COLON')
         body = self.parse_block()
-        return ('for', var_name, iterable, body)
+        return For(var_name, iterable, body, [], line, column)
 
     def parse_while(self):
         """
         Parses a while statement.
 
         Returns:
-        tuple: The parsed while node.
+        While: The parsed while node.
         """
+        line, column = self.position()
         self.consume('WHILE')
         condition = self.parse_expression()
         # support for both { } and indent/dedent codeblocks
@@ -331,14 +384,16 @@ class Parser:
         else:
             self.error()
 
-        return ('while', condition, body)
+        return While(condition, body, [], line, column)
+
     def parse_print(self):
         """
         Parses a print statement.
 
         Returns:
-        tuple: The parsed print node.
+        Print: The parsed print node.
         """
+        line, column = self.position()
         self.consume('PRINT')
         self.consume('LPAREN')
         values = [self.parse_expression()]
@@ -346,7 +401,7 @@ class Parser:
             self.consume('COMMA')
             values.append(self.parse_expression())
         self.consume('RPAREN')
-        return ('print', values)
+        return Print(values, line, column)
 
     def parse_block(self):
         """
@@ -407,6 +462,7 @@ class Parser:
         if self.current_token is None:
             raise SyntaxError("Unexpected end of input")
 
+        line, column = self.position()
         if self.current_token[0] == 'LBRACKET':
             self.consume('LBRACKET')
             elements = []
@@ -415,18 +471,31 @@ class Parser:
                 if self.current_token[0] == 'COMMA':
                     self.consume('COMMA')
             self.consume('RBRACKET')
-            return elements
-        elif self.current_token[0] in ('NUMBER', 'ID', 'STRING'):
-            return self.consume(self.current_token[0])
+            return ListLiteral(elements, line, column)
+        elif self.current_token[0] == 'ID':
+            return Name(self.consume('ID'), line, column)
+        elif self.current_token[0] in ('NUMBER', 'STRING'):
+            return Constant(self.consume(self.current_token[0]), line, column)
         elif self.current_token[0] == 'TRUE':
             self.consume('TRUE')
-            return True
+            return Constant(True, line, column)
         elif self.current_token[0] == 'FALSE':
             self.consume('FALSE')
-            return False
+            return Constant(False, line, column)
         else:
             self.error()
 
+    def position(self):
+        """
+        Returns the source position of the current token.
+
+        Returns:
+        tuple: The line and column, or (None, None) at the end of the input.
+        """
+        if self.current_token is None:
+            return None, None
+        return self.current_token[2], self.current_token[3]
+
     def peek_next_token(self):
         """
         Peeks at the next token without consuming it.
@@ -434,10 +503,12 @@ class Parser:
         Returns:
         tuple: The next token.
         """
-        if self.pos < len(self.tokens):
-            return self.tokens[self.pos]
-        else:
-            return None
+        if not self.lookahead:
+            next_token = next(self.tokens, None)
+            if next_token is None:
+                return None
+            self.lookahead.append(next_token)
+        return self.lookahead[0]
 
     def error(self):
         """
@@ -4,6 +4,9 @@
 #
 # Aman Thapa Magar <at719@sussex.ac.uk>
 
+from src.nodes import NodeType, Node, to_tuple
+
+
 class SemanticAnalyser:
     """
     A semantic analyzer for the Ulto programming language.
@@ -16,6 +19,8 @@ class SemanticAnalyser:
     Attributes:
         ast (list): The abstract syntax tree to be analyzed.
         symbol_table (dict): A symbol table to track variable declarations and their values during analysis.
+        loop_depth (int): The number of loops enclosing the node being analysed.
+        node_processors (dict): Maps statement node types to the method processing them.
     """
     def __init__(self, ast):
         """
@@ -26,6 +31,21 @@ class SemanticAnalyser:
         """
         self.ast = ast
         self.symbol_table = {}
+        self.loop_depth = 0
+        self.node_processors = {
+            NodeType.ASSIGN: self.process_assignment,
+            NodeType.REVERSE: self.process_reverse,
+            NodeType.REVTRACE: self.process_revtrace,
+            NodeType.REWIND: self.process_rewind,
+            NodeType.IF: self.process_if,
+            NodeType.FOR: self.process_for,
+            NodeType.WHILE: self.process_while,
+            NodeType.PRINT: self.process_print,
+            NodeType.COMPOUND_ASSIGN: self.process_compound_assignment,
+            NodeType.BREAK: self.process_break,
+            NodeType.CONTINUE: self.process_continue,
+            NodeType.LEN: self.process_len,
+        }
 
     def analyse(self):
         """
@@ -39,205 +59,145 @@ class SemanticAnalyser:
         Analyzes a single node in the AST.
 
         Args:
-        node (tuple): The node to be analyzed.
-        """
-        if node[0] == 'assign':
-            self.process_assignment(node)
-        elif node[0] == 'reverse':
-            self.process_reverse(node)
-        elif node[0] == 'revtrace':
-            self.process_revtrace(node)
-        elif node[0] == 'if':
-            self.process_if(node)
-        elif node[0] == 'for':
-            self.process_for(node)
-        elif node[0] == 'while':
-            self.process_while(node)
-        elif node[0] == 'print':
-            self.process_print(node)
-        elif node[0] == 'plus_assign':
-            self.process_plus_assign(node)
-        elif node[0] == 'minus_assign':
-            self.process_minus_assign(node)
-        elif node[0] == 'times_assign':
-            self.process_times_assign(node)
-        elif node[0] == 'over_assign':
-            self.process_over_assign(node)
-        elif node[0] == 'break':
-            self.process_break(node)
-        elif node[0] == 'len':
-            self.process_len(node)
-        else:
-            self.error(f'Unknown node type: {node[0]}')
+        node (Node): The node to be analyzed.
+        """
+        process = self.node_processors.get(node.tag) if isinstance(node, Node) else None
+        if process is None:
+            self.error(f'Unknown node type: {to_tuple(node)}')
+        process(node)
 
     def process_len(self, node):
         """
         Processes a len function node.
 
         Args:
-        node (tuple): The len function node.
+        node (Len): The len function node.
         """
-        _, expr = node
-        self.inline_expression(expr)
+        self.inline_expression(node.value)
 
     def process_break(self, node):
         """
         Processes a break statement node.
 
         Args:
-        node (tuple): The break statement node.
+        node (Break): The break statement node.
         """
         # Ensure that the break statement is used inside a loop
         if not self.is_inside_loop():
             self.error("Break statement not inside a loop")
 
+    def process_continue(self, node):
+        """
+        Processes a continue statement node.
+
+        Args:
+        node (Continue): The continue statement node.
+        """
+        # Ensure that the continue statement is used inside a loop
+        if not self.is_inside_loop():
+            self.error("Continue statement not inside a loop")
+
     def is_inside_loop(self):
         """
-        Checks if the current context is inside a loop.
-        This function would need to track the current context
-        to ensure 'break' is within a loop.
+        Checks if the current context is inside a loop, where `break` and `continue` may be used.
 
         Returns:
         bool: True if inside a loop, False otherwise.
         """
-        return True
+        return self.loop_depth > 0
 
     def process_assignment(self, node):
         """
         Processes an assignment node.
 
         Args:
-        node (tuple): The assignment node.
+        node (Assign): The assignment node.
         """
-        _, var_name, value = node
-        self.symbol_table[var_name] = self.inline_expression(value)
+        self.symbol_table[node.name] = self.inline_expression(node.value)
 
     def process_revtrace(self, node):
         """
         Processes a revtrace node.
 
         Args:
-        node (tuple): The revtrace node.
-        """
-        _, var_name, index = node
-        if var_name not in self.symbol_table:
-            self.error(f'Variable "{var_name}" used before declaration')
-
-    def process_plus_assign(self, node):
-        _, var_name, value = node
-        if var_name not in self.symbol_table:
-            self.error(f'Variable "{var_name}" used before declaration')
-        self.inline_expression(value)
-
-    def process_minus_assign(self, node):
-        _, var_name, value = node
-        if var_name not in self.symbol_table:
-            self.error(f'Variable "{var_name}" used before declaration')
-        self.inline_expression(value)
-
-    def process_times_assign(self, node):
-        _, var_name, value = node
-        if var_name not in self.symbol_table:
-            self.error(f'Variable "{var_name}" used before declaration')
-        self.inline_expression(value)
-
-    def process_over_assign(self, node):
-        _, var_name, value = node
-        if var_name not in self.symbol_table:
-            self.error(f'Variable "{var_name}" used before declaration')
-        self.inline_expression(value)
+        node (Revtrace): The revtrace node.
+        """
+        if node.name not in self.symbol_table:
+            self.error(f'Variable "{node.name}" used before declaration')
 
-    def inline_expression(self, expr):
+    def process_rewind(self, node):
         """
-        Inlines an expression.
+        Processes a rewind node.
 
         Args:
-        expr (tuple or any): The expression to be inlined.
+        node (Rewind): The rewind node.
+        """
+        self.evaluate_expression(node.steps)
 
-        Returns:
-        The inlined expression.
+    def process_compound_assignment(self, node):
         """
-        if isinstance(expr, tuple):
-            if len(expr) == 3:
-                left, op, right = expr
-                left = self.inline_expression(left)
-                right = self.inline_expression(right)
-                if isinstance(left, int) and isinstance(right, int):
-                    return self.evaluate_operation(op, left, right)
-                return (left, op, right)
-            elif len(expr) == 2:  # Handle tuples with 2 elements
-                left, op = expr
-                left = self.inline_expression(left)
-                if isinstance(left, int):
-                    return (left, op)
-                return (left, op)
-            else:
-                # Handle a single value tuple (or malformed expression)
-                return expr[0] if len(expr) == 1 else expr
-        elif isinstance(expr, list):
-            return [self.inline_expression(item) for item in expr]
-        return expr
+        Processes a compound assignment (`+=`, `-=`, `*=`, `/=`) node.
 
-    def evaluate_operation(self, op, left, right):
+        Args:
+        node (CompoundAssign): The compound assignment node.
         """
-        Evaluates a simple arithmetic operation.
+        if node.name not in self.symbol_table:
+            self.error(f'Variable "{node.name}" used before declaration')
+        self.inline_expression(node.value)
+
+    def inline_expression(self, expr):
+        """
+        Inlines an expression, resolving literals to their value. Constant folding is left to the `Optimiser`, so
+        expressions failing at runtime, such as a division by zero, are reported when they are executed.
 
         Args:
-        op (str): The operation to be performed.
-        left (int): The left operand.
-        right (int): The right operand.
+        expr (Node or list): The expression to be inlined.
 
         Returns:
-        int: The result of the operation.
-        """
-        if op == 'plus':
-            return left + right
-        elif op == 'minus':
-            return left - right
-        elif op == 'times':
-            return left * right
-        elif op == 'over':
-            return left / right
-        elif op == 'modulo':
-            return left % right
-        elif op == 'int_div':
-            return left // right
-        return None
+        The inlined expression.
+        """
+        if isinstance(expr, list):
+            return [self.inline_expression(item) for item in expr]
+        tag = expr.tag
+        if tag == NodeType.CONSTANT:
+            return expr.value
+        elif tag == NodeType.BINARY:
+            self.inline_expression(expr.left)
+            self.inline_expression(expr.right)
+        elif tag == NodeType.INDEX:
+            self.inline_expression(expr.index)
+        elif tag == NodeType.LIST:
+            return self.inline_expression(expr.elements)
+        return expr
 
     def process_reverse(self, node):
         """
         Processes a reverse node.
 
         Args:
-        node (tuple): The reverse node.
+        node (Reverse): The reverse node.
         """
-        _, var_name = node
-        if var_name not in self.symbol_table:
-            self.error(f'Variable "{var_name}" used before declaration')
+        if node.name not in self.symbol_table:
+            self.error(f'Variable "{node.name}" used before declaration')
 
     def process_if(self, node):
         """
         Processes an if node.
 
         Args:
-        node (tuple): The if node.
+        node (If): The if node.
         """
-        if node[0] != 'if':
-            self.error("Expected 'if' node")
+        self.evaluate_expression(node.condition)
 
-        condition, true_branch, elif_branches, false_branch = node[1], node[2], node[3], node[4]
-
-        self.evaluate_expression(condition)
-
-        for stmt in true_branch:
+        for stmt in node.body:
             self.analyse_node(stmt)
 
-        for elif_condition, elif_branch in elif_branches:
+        for elif_condition, elif_branch in node.elifs:
             self.evaluate_expression(elif_condition)
             for stmt in elif_branch:
                 self.analyse_node(stmt)
 
-        for stmt in false_branch:
+        for stmt in node.orelse:
             self.analyse_node(stmt)
 
     def process_for(self, node):
@@ -245,26 +205,28 @@ class SemanticAnalyser:
         Processes a for loop node.
 
         Args:
-        node (tuple): The for loop node.
-        """
-        _, var_name, iterable, body = node
-
-        if iterable[0] == 'range':
-            _, start_value, end_value, step_value = iterable
-            self.inline_expression(start_value)
-            self.inline_expression(end_value)
-            if step_value:
-                self.inline_expression(step_value)
-        elif isinstance(iterable, list):
-            for element in iterable:
-                if isinstance(element, int) or isinstance(element, str):
+        node (For): The for loop node.
+        """
+        var_name, iterable = node.target, node.iterable
+
+        if iterable.tag == NodeType.RANGE:
+            self.inline_expression(iterable.start)
+            self.inline_expression(iterable.end)
+            if iterable.step:
+                self.inline_expression(iterable.step)
+        elif iterable.tag == NodeType.LIST:
+            for element in iterable.elements:
+                if element.tag == NodeType.NAME or element.tag == NodeType.CONSTANT:
                     continue
                 else:
-                    self.error(f'Invalid type in iterable: {element}')
+                    self.error(f'Invalid type in iterable: {to_tuple(element)}')
         else:
             self.inline_expression(iterable)
-            if isinstance(iterable, str) and iterable not in self.symbol_table:
-                self.error(f'Variable "{iterable}" used before declaration')
+            if iterable.tag == NodeType.NAME and iterable.id not in self.symbol_table:
+                self.error(f'Variable "{iterable.id}" used before declaration')
+            if iterable.tag == NodeType.CONSTANT and isinstance(iterable.value, str) \
+                    and iterable.value not in self.symbol_table:
+                self.error(f'Variable "{iterable.value}" used before declaration')
 
         # Ensure the loop variable is added to the symbol table
         if var_name in self.symbol_table:
@@ -274,8 +236,10 @@ class SemanticAnalyser:
             shadowed = False
         self.symbol_table[var_name] = None
 
-        for stmt in body:
+        self.loop_depth += 1
+        for stmt in node.body:
             self.analyse_node(stmt)
+        self.loop_depth -= 1
 
         # Remove the loop variable from the symbol table after the loop is processed
         if not shadowed:
@@ -286,22 +250,22 @@ class SemanticAnalyser:
         Processes a while node.
 
         Args:
-        node (tuple): The while node.
+        node (While): The while node.
         """
-        _, condition, body = node
-        self.evaluate_expression(condition)
-        for stmt in body:
+        self.evaluate_expression(node.condition)
+        self.loop_depth += 1
+        for stmt in node.body:
             self.analyse_node(stmt)
+        self.loop_depth -= 1
 
     def process_print(self, node):
         """
         Processes a print node.
 
         Args:
-        node (tuple): The print node.
+        node (Print): The print node.
         """
-        _, values = node
-        for value in values:
+        for value in node.values:
             self.evaluate_expression(value)
 
     def evaluate_expression(self, expr):
@@ -309,30 +273,25 @@ class SemanticAnalyser:
         Evaluates an expression.
 
         Args:
-        expr (tuple): The expression to be evaluated.
+        expr (Node): The expression to be evaluated.
         """
-        if isinstance(expr, list):
-            for item in expr:
+        tag = expr.tag
+        if tag == NodeType.LIST:
+            for item in expr.elements:
                 self.evaluate_expression(item)
-        elif isinstance(expr, tuple):
-            if expr[0] == 'len':
-                _, value = expr
-                self.evaluate_expression(value)
-            elif len(expr) == 3:
-                left, op, right = expr
-                self.evaluate_expression(left)
-                self.evaluate_expression(right)
-            else:
-                self.error(f"Unexpected tuple structure: {expr}")
-        elif isinstance(expr, str):
-            # Skip string literals and backtick-enclosed comments
-            if expr.startswith('`') and expr.endswith('`'):
-                return
-            if isinstance(expr, str) and expr.isnumeric() is False and (
-                    expr.startswith('"') and expr.endswith('"')) == False:
-                if expr not in self.symbol_table:
-                    self.error(f'Variable "{expr}" used before declaration')
-        elif not isinstance(expr, int):
+        elif tag == NodeType.LEN:
+            self.evaluate_expression(expr.value)
+        elif tag == NodeType.BINARY:
+            self.evaluate_expression(expr.left)
+            self.evaluate_expression(expr.right)
+        elif tag == NodeType.INDEX:
+            self.evaluate_expression(expr.target)
+            self.evaluate_expression(expr.index)
+        elif tag == NodeType.NAME:
+            if expr.id not in self.symbol_table:
+                self.error(f'Variable "{expr.id}" used before declaration')
+        elif tag != NodeType.CONSTANT:
+            # string literals, including backtick-enclosed ones, and numbers need no declaration
             self.error(f'Invalid expression type: {type(expr)}')
 
     def error(self, message):
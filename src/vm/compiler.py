@@ -0,0 +1,562 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# compiler.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+from array import array
+from src.core.frame import Frame
+from src.core.kernel import ArithmeticKernel
+from src.core.lazyeval import LazySite
+from src.core.profiler import Profiler
+from src.nodes import NodeType, Constant, to_tuple
+from src.vm.opcodes import (LOAD_NAME, LOAD_CONST, BINARY_OP, JUMP_IF_FALSE, JUMP, ASSIGN, FOR_ITER, SET_LOOP_VAR,
+                            PRINT, REVERSE, REVTRACE, MAKE_THUNK, BUILD_LIST, INDEX, LEN, GET_ITER, GET_RANGE, POP_TOP,
+                            END_STATEMENT, RETURN_VALUE, CALL_KERNEL, LOAD_INVARIANT, RESET_INVARIANT, REWIND,
+                            ACCOUNT_NAME, COPY_NAME, ASSIGN_EAGER, LOOP, ENTER_LOOP, OPERATORS, COMPOUND_ASSIGN,
+                            OPNAMES)
+
+# Marks a hoisted loop invariant that has not been evaluated since its loop was entered.
+UNSET = object()
+
+
+class CodeObject:
+    """
+    A compiled chunk of Ulto bytecode.
+
+    Instructions are stored flat in a signed integer array, two slots per instruction (opcode, argument), with
+    jump targets given as absolute positions in that array. Literal values and variable names live in separate
+    tables that instructions refer to by index.
+
+    Attributes:
+        instructions (array): The opcode/argument stream.
+        constants (list): The constant table.
+        names (list): The variable name table, indexed by frame slot.
+        handlers (list): The eager assignments, as `(start, end, depth, site)`: the instructions from `start` to
+                         `end` compute the value with `depth` values below it on the stack, and the `LazySite`
+                         constants[site] defers it if they raise.
+    """
+    def __init__(self, instructions, constants, names, handlers=()):
+        """
+        Initializes the code object.
+
+        Args:
+        instructions (array): The opcode/argument stream.
+        constants (list): The constant table.
+        names (list): The variable name table.
+        handlers (list): The eager assignments deferred if their expression raises.
+        """
+        self.instructions = instructions
+        self.constants = constants
+        self.names = names
+        self.handlers = handlers
+
+    def disassemble(self):
+        """
+        Renders the instruction stream in a human readable form.
+
+        Returns:
+        str: One line per instruction.
+        """
+        lines = []
+        for pc in range(0, len(self.instructions), 2):
+            op, arg = self.instructions[pc], self.instructions[pc + 1]
+            line = f'{pc:>6} {OPNAMES[op]:<16} {arg}'
+            if op in (LOAD_CONST, MAKE_THUNK, CALL_KERNEL, GET_ITER):
+                line += f' ({self.constants[arg]!r})'
+            elif op in (LOAD_NAME, COPY_NAME, ASSIGN, ASSIGN_EAGER, SET_LOOP_VAR, REVERSE, REVTRACE, ACCOUNT_NAME) \
+                    or op in COMPOUND_ASSIGN.values():
+                line += f' ({self.names[arg]})'
+            elif op == BINARY_OP:
+                line += f' ({OPERATORS[arg]})'
+            elif op == LOOP or op == ENTER_LOOP:
+                site = self.constants[arg]
+                line += f' ({site.kind} loop, head {site.head}, exit {site.exit})'
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class InvariantCache:
+    """
+    The cached value of a hoisted loop invariant.
+
+    Attributes:
+        code (CodeObject): The compiled invariant expression.
+        value (any): The value, `UNSET` until evaluated after the loop was last entered.
+    """
+    __slots__ = ('code', 'value')
+
+    def __init__(self):
+        self.code = None
+        self.value = UNSET
+
+
+class BytecodeCompiler:
+    """
+    A compiler lowering the parser's AST into Ulto bytecode.
+
+    Statements are emitted into one flat instruction stream, so loops and conditionals become jumps, `break` becomes a
+    jump to the end of the innermost loop and `continue` a jump to its `LOOP` instruction. Expressions assigned lazily,
+    unless the `DataFlowAnalyser` marked the assignment eager, are compiled into separate code objects run by a
+    `LazySite`, which the virtual machine asks for the value, computed or a `LazyEval` thunk. Variables are resolved to
+    slots of a `Frame`, and the frame's name list doubles as the name table, so name arguments index the frame's slots
+    directly. The constant and name tables are shared between the program and all of its thunks. When given an
+    `ArithmeticKernel`, purely arithmetic expressions are fused into a single `CALL_KERNEL` instruction. Loop invariants
+    hoisted by the `Optimiser` are cached in an `InvariantCache` which their loop clears on entry.
+
+    Attributes:
+        frame (Frame): The frame variables are resolved against.
+        kernel (ArithmeticKernel or None): The kernel fusing arithmetic expressions.
+        run (callable): Executes a code object, used by fused expressions to fall back to bytecode.
+        profiler (Profiler): The profiler holding the sites of the loops and statements.
+        constants (list): The constant table being built.
+        names (list): The variable name table, shared with the frame.
+        invariant_caches (dict): Maps hoisted `Invariant` nodes to the constant index of their cache.
+        iterators (int): The number of for loop iterators on the stack where the code being compiled runs.
+        handlers (list): The eager assignments of the program, see `CodeObject.handlers`.
+        hoisting (bool): Whether compiled expressions use the cached value of hoisted invariants.
+    """
+    def __init__(self, frame=None, kernel=None, run=None, profiler=None):
+        """
+        Initializes the bytecode compiler.
+
+        Args:
+        frame (Frame): The frame to resolve variables against, a new one by default.
+        kernel (ArithmeticKernel): The kernel fusing arithmetic expressions, none by default.
+        run (callable): Executes a code object, required together with `kernel` and to evaluate lazy values.
+        profiler (Profiler): The profiler holding the sites of the loops and statements, a new one by default.
+        """
+        self.frame = frame if frame is not None else Frame()
+        self.kernel = kernel
+        self.run = run
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.constants = []
+        self.names = self.frame.names
+        self.constant_index = {}
+        self.instructions = array('l')
+        self.break_jumps = []
+        self.continue_jumps = []
+        self.iterators = 0
+        self.handlers = []
+        self.invariant_caches = {}
+        self.hoisting = True
+        self.statement_compilers = {
+            NodeType.ASSIGN: self.compile_assignment,
+            NodeType.COMPOUND_ASSIGN: self.compile_compound_assignment,
+            NodeType.REVERSE: self.compile_reverse,
+            NodeType.REVTRACE: self.compile_revtrace,
+            NodeType.REWIND: self.compile_rewind,
+            NodeType.IF: self.compile_if,
+            NodeType.FOR: self.compile_for,
+            NodeType.WHILE: self.compile_while,
+            NodeType.PRINT: self.compile_print,
+            NodeType.BREAK: self.compile_break,
+            NodeType.CONTINUE: self.compile_continue,
+        }
+
+    def compile_program(self, ast):
+        """
+        Compiles a whole program.
+
+        Args:
+        ast (list): The abstract syntax tree.
+
+        Returns:
+        CodeObject: The compiled program.
+        """
+        self.frame.resolve_program(ast)
+        for node in ast:
+            self.compile_statement(node)
+            self.emit(END_STATEMENT, self.constant(self.profiler.statement(node)))
+        self.emit(LOAD_CONST, self.constant(None))
+        self.emit(RETURN_VALUE)
+        return CodeObject(self.instructions, self.constants, self.names, self.handlers)
+
+    def emit(self, op, arg=0):
+        """
+        Appends an instruction.
+
+        Args:
+        op (int): The opcode.
+        arg (int): The argument.
+
+        Returns:
+        int: The position of the instruction, for patching jumps.
+        """
+        position = len(self.instructions)
+        self.instructions.append(op)
+        self.instructions.append(arg)
+        return position
+
+    def patch(self, position, target=None):
+        """
+        Points a previously emitted jump at a target, by default the current end of the stream.
+
+        Args:
+        position (int): The position of the jump instruction.
+        target (int): The jump target.
+        """
+        self.instructions[position + 1] = len(self.instructions) if target is None else target
+
+    def constant(self, value):
+        """
+        Returns the constant table index of a value, adding it if needed.
+
+        Args:
+        value (any): The constant value.
+
+        Returns:
+        int: The index in the constant table.
+        """
+        key = (type(value), value) if isinstance(value, (int, str)) or value is None else None
+        if key is not None and key in self.constant_index:
+            return self.constant_index[key]
+        self.constants.append(value)
+        if key is not None:
+            self.constant_index[key] = len(self.constants) - 1
+        return len(self.constants) - 1
+
+    def name(self, var_name):
+        """
+        Returns the name table index of a variable, which is its frame slot.
+
+        Args:
+        var_name (str): The variable name.
+
+        Returns:
+        int: The index in the name table.
+        """
+        return self.frame.resolve(var_name)
+
+    def compile_block(self, statements):
+        """
+        Compiles a list of statements in order.
+
+        Args:
+        statements (list): The statements.
+        """
+        for stmt in statements:
+            self.compile_statement(stmt)
+
+    def compile_statement(self, node):
+        """
+        Compiles a single statement node.
+
+        Args:
+        node (Node): The statement node.
+        """
+        compile_method = self.statement_compilers.get(node.tag)
+        if compile_method is None:
+            self.error(f'Unknown node type: {node.tag.name}')
+        compile_method(node)
+
+    def compile_assignment(self, node):
+        """
+        Compiles an assignment: a copy of another variable, an eager value or a thunk, as classified by the data
+        flow analysis.
+
+        Args:
+        node (Assign): The assignment node.
+        """
+        var_name, value = node.name, node.value
+        if value.tag == NodeType.NAME:
+            # a copy shares the value of the variable, evaluated or not.
+            self.emit(COPY_NAME, self.name(value.id))
+            self.emit(ASSIGN, self.name(var_name))
+        elif node.eager:
+            start = len(self.instructions)
+            self.compile_expression(value)
+            # should the expression raise, the virtual machine assigns a thunk instead, see `CodeObject.handlers`.
+            self.handlers.append((start, len(self.instructions), self.iterators, self.constant(self.lazy_site(value))))
+            self.emit(ASSIGN_EAGER, self.name(var_name))
+        else:
+            self.emit(MAKE_THUNK, self.constant(self.lazy_site(value)))
+            self.emit(ASSIGN, self.name(var_name))
+
+    def lazy_site(self, expr):
+        """
+        Compiles an assigned expression into a `LazySite` making its values, run as a code object of its own.
+
+        Args:
+        expr (Node): The expression.
+
+        Returns:
+        LazySite: The site.
+        """
+        # a thunk can be forced after its loop has been left, when the cached invariants are stale.
+        hoisting, self.hoisting = self.hoisting, False
+        try:
+            thunk = self.compile_thunk(expr)
+        finally:
+            self.hoisting = hoisting
+        run = self.run
+        return LazySite(expr, lambda: run(thunk), self.frame)
+
+    def compile_thunk(self, expr):
+        """
+        Compiles an expression into its own code object, to be evaluated lazily.
+
+        Args:
+        expr (Node): The expression.
+
+        Returns:
+        CodeObject: The compiled expression, leaving its value on the stack.
+        """
+        outer_instructions = self.instructions
+        self.instructions = array('l')
+        self.compile_expression(expr)
+        self.emit(RETURN_VALUE)
+        thunk = CodeObject(self.instructions, self.constants, self.names)
+        self.instructions = outer_instructions
+        return thunk
+
+    def compile_compound_assignment(self, node):
+        """
+        Compiles a compound assignment into its in-place opcode.
+
+        Args:
+        node (CompoundAssign): The compound assignment node.
+        """
+        self.compile_expression(node.value)
+        self.emit(COMPOUND_ASSIGN[node.op], self.name(node.name))
+
+    def compile_reverse(self, node):
+        """
+        Compiles a reverse node, restoring the previous value of a variable.
+
+        Args:
+        node (Reverse): The reverse node.
+        """
+        self.emit(REVERSE, self.name(node.name))
+
+    def compile_revtrace(self, node):
+        """
+        Compiles a revtrace node, its index evaluated onto the stack.
+
+        Args:
+        node (Revtrace): The revtrace node.
+        """
+        self.compile_expression(node.index)
+        self.emit(REVTRACE, self.name(node.name))
+
+    def compile_rewind(self, node):
+        """
+        Compiles a rewind node, its number of steps evaluated onto the stack.
+
+        Args:
+        node (Rewind): The rewind node.
+        """
+        self.compile_expression(node.steps)
+        self.emit(REWIND)
+
+    def compile_if(self, node):
+        """
+        Compiles an if node into conditional jumps.
+
+        Args:
+        node (If): The if node.
+        """
+        condition, true_branch, elif_branches, false_branch = node.condition, node.body, node.elifs, node.orelse
+        end_jumps = []
+        for branch_condition, branch in [(condition, true_branch)] + list(elif_branches):
+            self.compile_expression(branch_condition, condition=True)
+            skip = self.emit(JUMP_IF_FALSE)
+            self.compile_block(branch)
+            end_jumps.append(self.emit(JUMP))
+            self.patch(skip)
+        self.compile_block(false_branch)
+        for jump in end_jumps:
+            self.patch(jump)
+
+    def compile_while(self, node):
+        """
+        Compiles a while node into a conditional backward jump.
+
+        Args:
+        node (While): The while node.
+        """
+        condition, body = node.condition, node.body
+        site = self.profiler.loop(node)
+        site_index = self.constant(site)
+        self.compile_invariant_resets(node)
+        self.emit(ENTER_LOOP, site_index)
+        self.break_jumps.append([])
+        self.continue_jumps.append([])
+        site.head = len(self.instructions)
+        self.compile_expression(condition, condition=True)
+        exit_jump = self.emit(JUMP_IF_FALSE)
+        self.compile_block(body)
+        for jump in self.continue_jumps.pop():
+            self.patch(jump)
+        self.emit(LOOP, site_index)
+        self.patch(exit_jump)
+        for jump in self.break_jumps.pop():
+            self.patch(jump)
+        site.exit = len(self.instructions)
+
+    def compile_for(self, node):
+        """
+        Compiles a for loop node over a range, a list literal or an iterable expression.
+
+        Args:
+        node (For): The for loop node.
+        """
+        var_name, iterable, body = node.target, node.iterable, node.body
+        if iterable.tag == NodeType.RANGE:
+            self.compile_expression(iterable.start)
+            self.compile_expression(iterable.end)
+            self.compile_expression(iterable.step if iterable.step else Constant(1))
+            # the interpreter only counts the step as an evaluation when it is given.
+            self.emit(GET_RANGE, 1 if iterable.step else 0)
+        else:
+            self.compile_expression(iterable)
+            self.emit(GET_ITER, self.constant(to_tuple(iterable)))
+
+        site = self.profiler.loop(node)
+        site_index = self.constant(site)
+        self.compile_invariant_resets(node)
+        self.emit(ENTER_LOOP, site_index)
+        self.break_jumps.append([])
+        self.continue_jumps.append([])
+        loop_start = site.head = self.emit(FOR_ITER)
+        self.emit(SET_LOOP_VAR, self.name(var_name))
+        # the iterator stays on the stack while the body runs.
+        self.iterators += 1
+        self.compile_block(body)
+        self.iterators -= 1
+        for jump in self.continue_jumps.pop():
+            self.patch(jump)
+        self.emit(LOOP, site_index)
+        break_jumps = self.break_jumps.pop()
+        if break_jumps:
+            skip_pop = self.emit(JUMP)
+            for jump in break_jumps:
+                self.patch(jump)
+            # leaving the loop through break leaves its iterator on the stack.
+            self.emit(POP_TOP)
+            self.patch(skip_pop)
+        self.patch(loop_start)
+        # the faster tier consumes the iterator, the loop variable is accounted for here.
+        site.exit = len(self.instructions)
+        self.emit(ACCOUNT_NAME, self.name(var_name))
+
+    def compile_invariant_resets(self, node):
+        """
+        Creates the caches of the invariants hoisted into a loop and clears them before the loop is entered.
+
+        Args:
+        node (While or For): The loop node.
+        """
+        for invariant in node.invariants:
+            index = self.invariant_caches[invariant] = self.constant(InvariantCache())
+            self.emit(RESET_INVARIANT, index)
+
+    def compile_print(self, node):
+        """
+        Compiles a print node, its values evaluated onto the stack in order.
+
+        Args:
+        node (Print): The print node.
+        """
+        values = node.values
+        for value in values:
+            self.compile_expression(value)
+        self.emit(PRINT, len(values))
+
+    def compile_break(self, node):
+        """
+        Compiles a break node into a jump patched to the end of the enclosing loop.
+
+        Args:
+        node (Break): The break node.
+        """
+        if not self.break_jumps:
+            self.error('Break statement not inside a loop')
+        self.break_jumps[-1].append(self.emit(JUMP))
+
+    def compile_continue(self, node):
+        """
+        Compiles a continue node into a jump patched to the backward jump of the enclosing loop.
+
+        Args:
+        node (Continue): The continue node.
+        """
+        if not self.continue_jumps:
+            self.error('Continue statement not inside a loop')
+        self.continue_jumps[-1].append(self.emit(JUMP))
+
+    def compile_expression(self, expr, condition=False):
+        """
+        Compiles an expression, leaving its value on the stack.
+
+        Args:
+        expr (Node): The expression to be compiled.
+        condition (bool): Whether the value is only tested for truthiness.
+        """
+        tag = expr.tag
+        if self.kernel is not None and tag == NodeType.BINARY and ArithmeticKernel.is_fusable(expr):
+            self.compile_kernel_call(expr, condition)
+
+        elif tag == NodeType.LIST:
+            for item in expr.elements:
+                self.compile_expression(item)
+            self.emit(BUILD_LIST, len(expr.elements))
+
+        elif tag == NodeType.BINARY:
+            self.compile_expression(expr.left)
+            self.compile_expression(expr.right)
+            if expr.op in OPERATORS:
+                self.emit(BINARY_OP, OPERATORS.index(expr.op))
+            else:
+                self.error(f'Unknown operator: {expr.op}')
+
+        elif tag == NodeType.INDEX:
+            self.compile_expression(expr.target)
+            self.compile_expression(expr.index)
+            self.emit(INDEX)
+
+        elif tag == NodeType.LEN:
+            self.compile_expression(expr.value)
+            self.emit(LEN)
+
+        elif tag == NodeType.CONSTANT:
+            self.emit(LOAD_CONST, self.constant(expr.value))
+
+        elif tag == NodeType.NAME:
+            self.emit(LOAD_NAME, self.name(expr.id))
+
+        elif tag == NodeType.INVARIANT:
+            index = self.invariant_caches.get(expr)
+            if index is None or not self.hoisting:
+                self.compile_expression(expr.value, condition)
+            else:
+                self.constants[index].code = self.compile_thunk(expr.value)
+                self.emit(LOAD_INVARIANT, index)
+
+        else:
+            self.error(f"Unknown expression type: {expr}")
+
+    def compile_kernel_call(self, expr, condition):
+        """
+        Fuses an arithmetic expression into a single kernel call, with its bytecode kept as the fallback.
+
+        Args:
+        expr (Binary): The binary expression.
+        condition (bool): Whether the value is only tested for truthiness.
+        """
+        kernel = self.kernel
+        self.kernel = None
+        code = self.compile_thunk(expr)
+        self.kernel = kernel
+        run = self.run
+        fused = kernel.fuse(expr, self.frame, lambda: run(code), condition)
+        self.emit(CALL_KERNEL, self.constant(fused))
+
+    def error(self, message):
+        """
+        Raises an error with the given message.
+
+        Args:
+        message (str): The error message.
+        """
+        raise Exception(f'Compilation error: {message}')
@@ -0,0 +1,334 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# machine.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+import time
+from src.compiler import Compiler, UNSET as UNSET_CELL, count_range
+from src.dataflow import DataFlowAnalyser
+from src.interpreter import Interpreter
+from src.core.lazyeval import LazyEval
+from src.core.vector import Vector
+from src.nodes import NodeType
+from src.vm.compiler import BytecodeCompiler, UNSET
+from src.vm.opcodes import (LOAD_NAME, LOAD_CONST, BINARY_OP, JUMP_IF_FALSE, JUMP, ASSIGN, PLUS_ASSIGN, MINUS_ASSIGN,
+                            TIMES_ASSIGN, OVER_ASSIGN, FOR_ITER, SET_LOOP_VAR, PRINT, REVERSE, REVTRACE, MAKE_THUNK,
+                            BUILD_LIST, INDEX, LEN, GET_ITER, GET_RANGE, POP_TOP, END_STATEMENT, RETURN_VALUE,
+                            CALL_KERNEL, LOAD_INVARIANT, RESET_INVARIANT, REWIND, ACCOUNT_NAME, COPY_NAME, ASSIGN_EAGER,
+                            LOOP, ENTER_LOOP, OPERATORS, COMPOUND_ASSIGN)
+
+
+class VirtualMachine(Interpreter):
+    """
+    A stack-based virtual machine for Ulto bytecode.
+
+    The `VirtualMachine` shares its runtime state with the `Interpreter` it extends (frame, LogStack, memory manager,
+    operators, arithmetic kernel, profiling and logging), so `rev`, `revtrace` and the computation costs behave the
+    same. Instead of a tree of closures it lowers the AST once with the `BytecodeCompiler` and executes the flat
+    instruction stream in a single dispatch loop, avoiding recursive calls for every expression node.
+
+    Loops count their iterations on the `Profiler` of the interpreter as they jump back to their start. Once a loop
+    has become hot it is promoted, see `promote`: compiled to closures, which run without dispatching an
+    instruction at a time, and from then on run in that tier, from the next iteration on and whenever the loop is
+    entered again.
+
+    Attributes:
+        code (CodeObject): The compiled program, available once `execute` has run.
+        delta_slots (list): Per frame slot, whether compound assignments of the variable may be logged as deltas.
+    """
+    def __init__(self, ast, **options):
+        """
+        Initializes the virtual machine with the given AST.
+
+        Args:
+        ast (list): The abstract syntax tree.
+        options: The options of the `Interpreter`, e.g. `snapshot_interval`.
+        """
+        super().__init__(ast, **options)
+        self.code = None
+        self.delta_slots = []
+        self.operator_table = tuple(self.operators[op] for op in OPERATORS)
+        self.compound_operations = {
+            PLUS_ASSIGN: self.operators['plus'],
+            MINUS_ASSIGN: self.operators['minus'],
+            TIMES_ASSIGN: self.operators['times'],
+            OVER_ASSIGN: self.operators['int_div'],
+        }
+        self.compound_operators = {opcode: op for op, opcode in COMPOUND_ASSIGN.items()}
+
+    def execute(self):
+        """
+        Compiles the AST to bytecode and runs it.
+        """
+        print("\n~~~~~~~~~~~~~~~~~~~~OUTPUT~~~~~~~~~~~~~~~~~~~~\n")
+        start_time = time.time()
+        try:
+            DataFlowAnalyser(self.ast).analyse()
+            compiler = BytecodeCompiler(self.frame, self.kernel, self.run, self.profiler)
+            self.code = compiler.compile_program(self.ast)
+            self.delta_slots = [name not in self.frame.loop_names for name in self.frame.names]
+            self.run(self.code)
+        finally:
+            end_time = time.time()
+            self.print_computation_cost()
+            self.log_execution_details(start_time, end_time)
+
+    def run(self, code):
+        """
+        Executes a code object.
+
+        Args:
+        code (CodeObject): The code object to execute.
+
+        Returns:
+        The value returned by the code object.
+        """
+        instructions = code.instructions
+        constants = code.constants
+        names = code.names
+        delta = self.delta_slots
+        slots = self.frame.slots
+        logstack = self.logstack
+        memory_manager = self.memory_manager
+        charged = self.frame.charged
+        operator_table = self.operator_table
+        compound_operations = self.compound_operations
+        compound_operators = self.compound_operators
+        profiler = self.profiler
+        batch = profiler.batch
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        clock = time.perf_counter()
+
+        while True:
+            try:
+                while True:
+                    op = instructions[pc]
+                    arg = instructions[pc + 1]
+                    pc += 2
+
+                    if op == LOAD_NAME:
+                        value = slots[arg]
+                        if isinstance(value, LazyEval):
+                            value = value.evaluate()
+                        push(value)
+
+                    elif op == LOAD_CONST:
+                        push(constants[arg])
+
+                    elif op == CALL_KERNEL:
+                        push(constants[arg]())
+
+                    elif op == LOAD_INVARIANT:
+                        cache = constants[arg]
+                        value = cache.value
+                        if value is UNSET:
+                            value = cache.value = self.run(cache.code)
+                        push(value)
+
+                    elif op == BINARY_OP:
+                        right = pop()
+                        stack[-1] = operator_table[arg](stack[-1], right)
+
+                    elif op == JUMP_IF_FALSE:
+                        self.evaluations += 1
+                        if not pop():
+                            pc = arg
+
+                    elif op == JUMP:
+                        pc = arg
+
+                    elif op == LOOP:
+                        site = constants[arg]
+                        site.ticks += 1
+                        if site.ticks < batch or not profiler.flush(site):
+                            pc = site.head
+                        else:
+                            # the loop goes on in the faster tier from the start of the next iteration, without being
+                            # entered again.
+                            self.promote(site)
+                            site.entries -= 1
+                            site.tier(stack)
+                            pc = site.exit
+
+                    elif op == ASSIGN or op == ASSIGN_EAGER:
+                        var_name = names[arg]
+                        self.assignments += 1
+                        new_value = pop()
+                        if op == ASSIGN_EAGER:
+                            self.evaluations += 1
+                        memory_manager.track(new_value)
+                        # the previous value is released once the history holds it, so what they share stays charged.
+                        logstack.push(var_name, slots[arg])
+                        memory_manager.release(charged[arg])
+                        charged[arg] = slots[arg] = new_value
+
+                    elif op in compound_operations:
+                        var_name = names[arg]
+                        current_value = slots[arg]
+                        if isinstance(current_value, LazyEval):
+                            current_value = current_value.evaluate()
+                        self.evaluations += 1
+                        operand = pop()
+                        if delta[arg]:
+                            logstack.push_delta(var_name, compound_operators[op], operand, current_value)
+                        else:
+                            logstack.push(var_name, current_value)
+                        new_value = compound_operations[op](current_value, operand)
+                        memory_manager.track(new_value)
+                        memory_manager.release(charged[arg])
+                        charged[arg] = slots[arg] = new_value
+
+                    elif op == FOR_ITER:
+                        for item in stack[-1]:
+                            push(item)
+                            break
+                        else:
+                            pop()
+                            pc = arg
+
+                    elif op == SET_LOOP_VAR:
+                        slots[arg] = pop()
+
+                    elif op == PRINT:
+                        values = stack[-arg:]
+                        del stack[-arg:]
+                        self.evaluations += arg
+                        self.print_values(values)
+
+                    elif op == REVERSE:
+                        var_name = names[arg]
+                        self.reversals += 1
+                        previous_value = logstack.pop(var_name, slots[arg])
+                        if previous_value is not None:
+                            # the restored value replaces the current one in memory, the current one is in the
+                            # history now.
+                            memory_manager.track(previous_value)
+                            memory_manager.release(charged[arg])
+                            charged[arg] = slots[arg] = previous_value
+
+                    elif op == REVTRACE:
+                        var_name = names[arg]
+                        self.evaluations += 1
+                        index = pop()
+                        previous_value = logstack.peek(var_name, index, slots[arg])
+                        if previous_value is not None:
+                            print(f"Reverse Tracepath state {index} of {var_name}: {previous_value}")
+                        else:
+                            print(f"No state found for {var_name} at index {index}")
+
+                    elif op == REWIND:
+                        self.evaluations += 1
+                        self.rewind(pop())
+
+                    elif op == MAKE_THUNK:
+                        push(constants[arg].make(self))
+
+                    elif op == COPY_NAME:
+                        push(slots[arg])
+
+                    elif op == BUILD_LIST:
+                        values = Vector(stack[-arg:]) if arg else Vector()
+                        if arg:
+                            del stack[-arg:]
+                        push(values)
+
+                    elif op == INDEX:
+                        index = pop()
+                        sequence = pop()
+                        if not isinstance(sequence, Vector):
+                            self.error(f"Cannot index non-list type: {sequence}")
+                        push(sequence[index])
+
+                    elif op == LEN:
+                        sequence = pop()
+                        if not isinstance(sequence, (str, Vector)):
+                            self.error(f"len() function requires a string or list, got {type(sequence).__name__}")
+                        push(len(sequence))
+
+                    elif op == GET_ITER:
+                        self.evaluations += 1
+                        iterable_value = pop()
+                        if not isinstance(iterable_value, (Vector, str)):
+                            self.error(f'Variable "{constants[arg]}" is not an iterable')
+                        push(iter(iterable_value))
+
+                    elif op == GET_RANGE:
+                        self.evaluations += 2 + arg
+                        step = pop()
+                        end = pop()
+                        start = pop()
+                        push(count_range(start, end, step))
+
+                    elif op == RESET_INVARIANT:
+                        constants[arg].value = UNSET
+
+                    elif op == ENTER_LOOP:
+                        site = constants[arg]
+                        if site.tier is None:
+                            site.entries += 1
+                        else:
+                            site.tier(stack)
+                            pc = site.exit
+
+                    elif op == POP_TOP:
+                        pop()
+
+                    elif op == ACCOUNT_NAME:
+                        self.account(arg)
+
+                    elif op == END_STATEMENT:
+                        now = time.perf_counter()
+                        constants[arg].record(now - clock)
+                        clock = now
+
+                    elif op == RETURN_VALUE:
+                        return pop()
+
+                    else:
+                        self.error(f'Unknown opcode: {op}')
+            except Exception:
+                # an eager assignment whose expression raised assigns a thunk instead, so the error only
+                # surfaces if the value is read.
+                for start, end, depth, site in code.handlers:
+                    if start <= pc - 2 < end:
+                        break
+                else:
+                    raise
+                del stack[depth:]
+                push(constants[site].defer(self))
+                # ASSIGN_EAGER counts an evaluation that did not complete.
+                self.evaluations -= 1
+                pc = end
+
+    def promote(self, site):
+        """
+        Promotes a hot loop to the closure tier. The loop is compiled by a closure `Compiler` against the runtime
+        state of the virtual machine, and runs from the start of an iteration: a while loop tests its condition,
+        a for loop takes the rest of its iterator from the stack.
+
+        Args:
+        site (LoopSite): The site of the loop.
+        """
+        node = site.node
+        compiler = Compiler(self)
+        if node.tag == NodeType.WHILE:
+            run_loop = compiler.compile_statement(node)
+
+            def tier(stack):
+                run_loop()
+        else:
+            invariants = compiler.compile_invariant_cells(node)
+            iterate = compiler.compile_iteration(node)
+
+            def tier(stack):
+                for cell in invariants:
+                    cell[0] = UNSET_CELL
+                site.entries += 1
+                site.iterations += iterate(stack.pop())
+        site.promoted = site.iterations
+        site.tier = tier
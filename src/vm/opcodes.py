@@ -0,0 +1,56 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# opcodes.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+
+# Every instruction is two slots wide in the instruction array: the opcode followed by its argument.
+# Opcodes that take no argument carry a 0. They are numbered roughly by how often they run, since the
+# dispatch loop tests them in this order.
+
+LOAD_NAME = 0           # push the value of names[arg], forcing lazy values
+LOAD_CONST = 1          # push constants[arg]
+BINARY_OP = 2           # pop right, left; push OPERATORS[arg](left, right)
+JUMP_IF_FALSE = 3       # pop a condition; jump to arg if it is falsy
+JUMP = 4                # jump to arg
+ASSIGN = 5              # pop a value and assign it to names[arg], logging the previous value
+PLUS_ASSIGN = 6         # pop an operand and apply names[arg] += operand
+MINUS_ASSIGN = 7        # pop an operand and apply names[arg] -= operand
+TIMES_ASSIGN = 8        # pop an operand and apply names[arg] *= operand
+OVER_ASSIGN = 9         # pop an operand and apply names[arg] /= operand
+FOR_ITER = 10           # advance the iterator on top of the stack, or pop it and jump to arg when exhausted
+SET_LOOP_VAR = 11       # pop a value into names[arg] without logging it
+PRINT = 12              # pop arg values and print them
+REVERSE = 13            # restore names[arg] from the LogStack
+REVTRACE = 14           # pop an index and print that state of names[arg] from the LogStack
+MAKE_THUNK = 15         # push the value made by the LazySite constants[arg], computed or a LazyEval
+BUILD_LIST = 16         # pop arg values and push them as a list
+INDEX = 17              # pop index, sequence; push sequence[index]
+LEN = 18                # pop a sequence and push its length
+GET_ITER = 19           # pop a list or string and push an iterator over it, constants[arg] naming it
+GET_RANGE = 20          # pop step, end, start; push an iterator counting from start while below end (arg: step given)
+POP_TOP = 21            # discard the top of the stack
+END_STATEMENT = 22      # end of the top-level statement constants[arg], recording its time
+RETURN_VALUE = 23       # stop and return the top of the stack
+CALL_KERNEL = 24        # push the result of the fused arithmetic expression constants[arg]
+LOAD_INVARIANT = 25     # push the cached value of the loop invariant constants[arg], evaluating it if unset
+RESET_INVARIANT = 26    # clear the cached value of the loop invariant constants[arg]
+REWIND = 27             # pop a number of steps and rewind every variable by that many steps of the journal
+ACCOUNT_NAME = 28       # count the value a loop left in names[arg] against the memory limit
+COPY_NAME = 29          # push the value of names[arg] as it is, without forcing lazy values
+ASSIGN_EAGER = 30       # ASSIGN a value computed as the assignment ran, counting its evaluation
+LOOP = 31               # jump back to the start of the loop constants[arg], counting the iteration
+ENTER_LOOP = 32         # enter the loop constants[arg], running the faster tier it was promoted to if any
+
+# Binary operators in the order BINARY_OP indexes them.
+OPERATORS = ('plus', 'minus', 'times', 'over', 'modulo', 'int_div', 'eq', 'neq', 'lt', 'gt', 'lte', 'gte', 'and', 'or')
+
+# Compound assignment operators mapped to their opcode.
+COMPOUND_ASSIGN = {
+    'plus': PLUS_ASSIGN,
+    'minus': MINUS_ASSIGN,
+    'times': TIMES_ASSIGN,
+    'over': OVER_ASSIGN,
+}
+
+OPNAMES = {value: name for name, value in globals().items() if name.isupper() and isinstance(value, int)}
@@ -0,0 +1,118 @@
+# Ulto - Imperative Reversible Programming Language
+#
+# kernel_crossover.py
+#
+# Aman Thapa Magar <at719@sussex.ac.uk>
+#
+# Measures how an arithmetic expression of growing length is best evaluated: one ctypes call per operator
+# (liboperations), a tree of Python operator closures, the fused Python function of the ArithmeticKernel, or a
+# single call into the native batch kernel (libultokernel). Prints the time per evaluation for each strategy and
+# the operator count from which the native batch kernel wins, which is what NATIVE_MIN_OPERATORS is set from.
+#
+# Usage: python tests/benchmarks/kernel_crossover.py [repeats]
+
+import os
+import sys
+import ctypes
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from src.core.frame import Frame
+from src.core.kernel import ArithmeticKernel, OPERATORS, load_native_library
+from src.nodes import NodeType, Operator, Binary, Name, Constant
+
+OPERATOR_COUNTS = (1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 96)
+CYCLE = (Operator.PLUS, Operator.TIMES, Operator.MINUS, Operator.MODULO)
+NATIVE_NAMES = {'plus': 'execute_add', 'minus': 'execute_sub', 'times': 'execute_mul', 'modulo': 'execute_modulo'}
+
+
+def build_expression(operator_count):
+    """
+    Builds a left-deep expression over the variables `a`, `b` and `c`, e.g. ((a plus b) times c) minus a.
+    """
+    variables = ('a', 'b', 'c')
+    expr = Name('a')
+    for position in range(operator_count):
+        op = CYCLE[position % 4]
+        right = Name(variables[(position + 1) % 3]) if op != Operator.MODULO else Constant(7)
+        expr = Binary(expr, op, right)
+    return expr
+
+
+def closure_tree(expr, frame, operators):
+    """
+    Compiles an expression into one closure per node, applying `operators` at every binary node.
+    """
+    if expr.tag == NodeType.BINARY:
+        apply = operators[expr.op]
+        left = closure_tree(expr.left, frame, operators)
+        right = closure_tree(expr.right, frame, operators)
+        return lambda: apply(left(), right())
+    if expr.tag == NodeType.NAME:
+        slots = frame.slots
+        slot = frame.resolve(expr.id)
+        return lambda: slots[slot]
+    value = expr.value
+    return lambda: value
+
+
+def per_op_ctypes_operators():
+    """
+    Binds every operator to its liboperations function, as the interpreter did before the kernel.
+    """
+    lib = load_native_library('operations')
+    if lib is None:
+        return None
+    operators = {}
+    for op, name in NATIVE_NAMES.items():
+        function = getattr(lib, name)
+        function.argtypes = [ctypes.c_int, ctypes.c_int]
+        function.restype = ctypes.c_int
+        operators[op] = function
+    return operators
+
+
+def measure(function, repeats):
+    return min(timeit.repeat(function, number=repeats, repeat=5)) / repeats * 1e6
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    frame = Frame()
+    for name, value in (('a', 12345), ('b', -678), ('c', 91)):
+        frame.set(name, value)
+
+    per_op = per_op_ctypes_operators()
+    python_kernel = ArithmeticKernel(native=False)
+    native_kernel = ArithmeticKernel(native_min_operators=1)
+    if per_op is None:
+        print('liboperations is not available for this platform, skipping the per-operator ctypes column.')
+    if native_kernel.native is None:
+        print('libultokernel is not built, skipping the native batch column. Build it with')
+        print('    gcc -O2 -shared -fPIC -o src/libultokernel.so src/native/ultokernel.c')
+
+    print(f'{"operators":>9} {"ctypes/op":>10} {"closures":>10} {"fused py":>10} {"native":>10}   (microseconds)')
+    crossover = None
+    for operator_count in OPERATOR_COUNTS:
+        expr = build_expression(operator_count)
+        fallback = closure_tree(expr, frame, OPERATORS)
+        columns = [
+            measure(closure_tree(expr, frame, per_op), repeats) if per_op else None,
+            measure(fallback, repeats),
+            measure(python_kernel.fuse(expr, frame, fallback), repeats),
+            measure(native_kernel.fuse(expr, frame, fallback), repeats) if native_kernel.native else None,
+        ]
+        print(f'{operator_count:>9} ' + ' '.join(f'{column:>10.3f}' if column is not None else f'{"-":>10}'
+                                                 for column in columns))
+        if crossover is None and columns[3] is not None and columns[3] < columns[2]:
+            crossover = operator_count
+
+    if crossover is not None:
+        print(f'\nThe native batch kernel is faster from {crossover} operators on.')
+    elif native_kernel.native is not None:
+        print(f'\nThe fused Python function is faster up to {OPERATOR_COUNTS[-1]} operators.')
+
+
+if __name__ == '__main__':
+    main()
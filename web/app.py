@@ -1,8 +1,9 @@
 from flask import Flask, render_template, request, jsonify, send_from_directory
 import os
-from src.lexer import tokenize
+from src.lexer import generate_tokens
 from src.parser import Parser
 from src.semantic_analyser import SemanticAnalyser
+from src.optimiser import Optimiser
 from src.interpreter import Interpreter
 
 app = Flask(__name__)
@@ -53,17 +54,20 @@ def docstrings():
 @app.route('/run', methods=['POST'])
 def run_code():
     code = request.json.get('code', '')
+    # the memory limit in megabytes, ULTO_MEMORY_LIMIT or the default if not given.
+    memory_limit = request.json.get('memory_limit')
 
-    tokens = tokenize(code)
+    tokens = generate_tokens(code)
 
     parser = Parser(tokens)
     ast = parser.parse()
 
     analyser = SemanticAnalyser(ast)
     analyser.analyse()
+    ast = Optimiser(ast).optimise()
 
-    interpreter = Interpreter(ast)
     try:
+        interpreter = Interpreter(ast, memory_limit=memory_limit)
         output = interpreter.execute()
     except Exception as e:
         output = f"Error: {str(e)}"